@@ -1,28 +1,245 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, send_from_directory, jsonify
+from flask import Blueprint, Flask, current_app, g, has_request_context, render_template, request, redirect, url_for, flash, send_file, jsonify, abort, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import func
+from sqlalchemy import func, text, select, table, column, literal_column, tuple_, union_all
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.orm import attribute_keyed_dict, load_only, selectinload
 from werkzeug.utils import secure_filename
-from datetime import datetime
+from werkzeug.security import safe_join
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from markupsafe import escape
+import contextlib
+import csv
+import hashlib
+import html
+import io
+import itertools
+import json
+import mimetypes
 import os
+import re
+import time
+import uuid
+import zlib
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'uma_chave_secreta_muito_segura' # Em production, use env var
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['UPLOAD_FOLDER'] = os.path.join('static', 'uploads')
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024 # Limit 16MB
+import click
 
-# Ensure upload directory exists
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+import backup
+import cid10
+import compression
+import jobs
+import metrics
+import migrations
+import thumbnails
 
-db = SQLAlchemy(app)
+try:
+    from weasyprint import HTML as WeasyHTML
+except ImportError:  # Server-side PDF export is optional
+    WeasyHTML = None
+
+db = SQLAlchemy()
+bp = Blueprint('main', __name__, cli_group=None)
+
+def _database_uri():
+    uri = os.environ.get('DATABASE_URL', 'sqlite:///database.db')
+    # Heroku-style URLs; SQLAlchemy only accepts the postgresql:// scheme
+    if uri.startswith('postgres://'):
+        uri = 'postgresql://' + uri[len('postgres://'):]
+    return uri
+
+def _opcoes_engine(config):
+    uri = config['SQLALCHEMY_DATABASE_URI']
+    if uri in ('sqlite://', 'sqlite:///:memory:'):
+        return {}  # Flask-SQLAlchemy uses a StaticPool for in-memory databases
+    opcoes = {'pool_size': config['DB_POOL_SIZE'], 'max_overflow': config['DB_MAX_OVERFLOW']}
+    if not uri.startswith('sqlite'):
+        # Server databases drop idle connections; check before use and recycle old ones
+        opcoes.update(pool_pre_ping=True, pool_recycle=1800)
+    return opcoes
+
+def _configurar_sqlite(engine, pragmas):
+    """Applies the PRAGMAs to every new pooled connection (most of them are per connection)."""
+    @db.event.listens_for(engine, 'connect')
+    def _aplicar_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for nome, valor in pragmas.items():
+            cursor.execute(f"PRAGMA {nome} = {valor}")
+        cursor.close()
+
+def _contar_consultas(engine):
+    """Counts the SQL statements each request sends, for the query budget check."""
+    @db.event.listens_for(engine, 'before_cursor_execute')
+    def _contar(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context():
+            g.consultas = g.get('consultas', 0) + 1
+
+def orcamento_consultas(limite):
+    """Overrides QUERY_BUDGET for one view; None disables the check (batch endpoints)."""
+    def decorar(view):
+        view.orcamento_consultas = limite
+        return view
+    return decorar
+
+@contextlib.contextmanager
+def fora_do_orcamento():
+    """Statements run inside do not count against the view's QUERY_BUDGET: one-off work such as restoring an archived pericia."""
+    antes = g.get('consultas', 0)
+    try:
+        yield
+    finally:
+        g.consultas = antes
+
+def create_app(config=None):
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'uma_chave_secreta_muito_segura') # Em production, use env var
+    app.config['SQLALCHEMY_DATABASE_URI'] = _database_uri()
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 10))
+    app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    app.config['SQLITE_PRAGMAS'] = {
+        'journal_mode': 'WAL',            # Readers keep going while a writer commits
+        'synchronous': 'NORMAL',          # Safe with WAL; fsync only at checkpoints
+        'busy_timeout': 5000,             # ms a writer waits for the lock before "database is locked"
+        'mmap_size': 256 * 1024 * 1024,   # Reads served from the page cache without read() copies
+    }
+    app.config['UPLOAD_FOLDER'] = os.path.join('static', 'uploads')
+    app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024 # Limit 16MB (per request; chunked uploads send one chunk per request)
+    app.config['UPLOAD_CHUNK_SIZE'] = 4 * 1024 * 1024
+    app.config['UPLOAD_MAX_FILE_SIZE'] = 2 * 1024 * 1024 * 1024 # Chunked uploads, e.g. large imaging exams
+    app.config['UPLOAD_SESSION_MAX_AGE_HOURS'] = 24 # Chunked upload sessions untouched this long are discarded
+    app.config['UPLOADS_MAX_AGE'] = 365 * 24 * 3600 # Uploaded files never change once written
+    # Let a front proxy send the bytes: set USE_X_SENDFILE = True (Apache/lighttpd) or
+    # UPLOADS_ACCEL_REDIRECT to the internal nginx location mapped to UPLOAD_FOLDER, e.g. '/_uploads/'
+    app.config['UPLOADS_ACCEL_REDIRECT'] = None
+    app.config['THUMBNAIL_WORKERS'] = 2
+    app.config['BULK_BATCH_SIZE'] = 500
+    app.config['BULK_MAX_CONTENT_LENGTH'] = 256 * 1024 * 1024 # Bulk imports stream the body, so they may exceed MAX_CONTENT_LENGTH
+    app.config['SYNC_PAGE_SIZE'] = 500
+    app.config['SYNC_ALLOWED_ORIGIN'] = '*' # The PWA is served from its own origin
+    app.config['LAUDO_CACHE_FOLDER'] = os.path.join(app.instance_path, 'laudos')
+    app.config['DASHBOARD_PAGE_SIZE'] = 50
+    app.config['DASHBOARD_MAX_PAGE_SIZE'] = 200
+    app.config['QUERY_BUDGET'] = 10 # SQL statements per request before a warning is logged
+    app.config['QUERY_BUDGET_STRICT'] = False # Raise instead of logging; the backend tests turn this on
+    app.config['METRICS_ENABLED'] = True # Per-route and per-statement histograms on /metrics (see metrics.py)
+    app.config['METRICS_MAX_STATEMENTS'] = 500 # Distinct SQL fingerprints tracked; the rest are grouped
+    app.config['METRICS_COUNT_SELECT_ROWS'] = False # Also count rows returned by ORM queries; buffers every result, for profiling
+    app.config['SLOW_QUERY_MS'] = 200 # Statements at least this slow are logged with their parameters
+    app.config['JOBS_WORKERS'] = int(os.environ.get('JOBS_WORKERS', 1)) # Background job threads per process; 0 with a dedicated `flask tarefas`
+    app.config['JOBS_POLL_INTERVAL'] = 1.0 # Seconds between polls for jobs enqueued by other processes
+    app.config['JOBS_MAX_ATTEMPTS'] = 5
+    app.config['JOBS_TIMEOUT'] = 600 # A job running longer than this is assumed dead and requeued
+    app.config['JOBS_RETENTION_DAYS'] = 7 # Finished jobs are purged after this
+    # CID-10 tables for /api/cid (see cid10.py); e.g. the DATASUS CID-10-CATEGORIAS.CSV and CID-10-SUBCATEGORIAS.CSV
+    app.config['CID10_FILES'] = [cid10.AMOSTRA]
+    if os.environ.get('CID10_FILES'):
+        app.config['CID10_FILES'] = os.environ['CID10_FILES'].split(os.pathsep)
+    app.config['BACKUP_FOLDER'] = os.path.join(app.instance_path, 'backups') # Snapshots and the upload object store (see backup.py)
+    app.config['BACKUP_PAGES'] = 1024 # Database pages copied per step of the online backup
+    app.config['BACKUP_PAUSE'] = 0.01 # Seconds between steps, for writers to get the lock
+    app.config['BACKUP_KEEP'] = 14 # Snapshots kept; older ones and the uploads only they held are removed
+    app.config['COMPRESS_ENABLED'] = True # gzip/brotli by Accept-Encoding (see compression.py)
+    app.config['COMPRESS_MIN_BYTES'] = 1024 # Smaller bodies are sent as they are
+    app.config['COMPRESS_CACHE_BYTES'] = 32 * 1024 * 1024 # Compressed bodies of ETagged responses kept in memory, per process
+    app.config['COMPRESS_FOLDER'] = os.path.join(app.instance_path, 'compressed') # Precompressed static assets
+    app.config['AGENDA_MAX_DAYS'] = 366 # Widest window /api/agenda answers
+    app.config['AGENDA_ICS_DAYS_BEFORE'] = 90 # agenda.ics covers from this many days ago...
+    app.config['AGENDA_ICS_DAYS_AFTER'] = 365 # ...to this many days ahead
+    app.config['LAUDO_COMPRESS_MIN_BYTES'] = 1024 # Laudo sections this large are stored zlib-compressed; None stores them plain
+    app.config['ARCHIVE_AFTER_DAYS'] = 365 # Concluded, paid pericias untouched this long are moved to the archive by `flask arquivar`
+    app.config['ARCHIVE_BATCH_SIZE'] = 500 # Pericias archived per transaction
+    app.config.update(config or {})
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', _opcoes_engine(app.config))
+
+    # Ensure upload directory exists
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], '.partial'), exist_ok=True)
+    os.makedirs(app.config['LAUDO_CACHE_FOLDER'], exist_ok=True)
+
+    # Per-app state: whether FTS5 is usable, the cached dashboard summary (and the archive's), macros and agenda.ics, the CID-10 index
+    app.extensions['pericias'] = {'fts': False, 'resumo': None, 'arquivo': None, 'macros': None, 'agenda': None, 'cid': None}
+
+    # Rendered HTML without the templates' indentation or the lines of their block tags
+    app.jinja_env.trim_blocks = True
+    app.jinja_env.lstrip_blocks = True
+    app.jinja_env.add_extension(compression.SemIndentacao)
+
+    db.init_app(app)
+    compression.instalar(app)  # Before the blueprint: its after_request hook must run last
+    app.register_blueprint(bp)
+    app.extensions['tarefas'] = jobs.Fila(app, db, Tarefa)
+
+    with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            _configurar_sqlite(db.engine, app.config['SQLITE_PRAGMAS'])
+        _contar_consultas(db.engine)
+        if app.config['METRICS_ENABLED']:
+            app.extensions['metricas'] = metrics.Registro(app.config['METRICS_MAX_STATEMENTS'])
+            metrics.instrumentar(app, db.engine, db.session, app.extensions['metricas'])
+        # Cria o banco de dados; existing ones are upgraded with `flask migrar`
+        pendentes = migrations.preparar(db.engine, db.metadata)
+        if pendentes:
+            app.logger.warning(f"Banco de dados com {len(pendentes)} migração(ões) pendente(s): rode `flask --app app migrar`")
+        else:
+            _criar_indice_busca()
+        if app.config['CID10_FILES'] == [cid10.AMOSTRA]:
+            app.logger.warning("CID-10: só a amostra de backend/data/cid10.csv (~110 códigos) está carregada; "
+                               "aponte CID10_FILES para as tabelas do DATASUS para ter a tabela completa")
+
+    return app
+
+def _estado():
+    return current_app.extensions['pericias']
+
+def _fila():
+    return current_app.extensions['tarefas']
+
+# Quill HTML of the laudo, tens of KB per case: kept out of the pericia row so listings never read it
+SECOES_LAUDO = ('objetivo', 'metodologia', 'anamnese', 'antecedentes', 'exame_fisico', 'discussao', 'conclusao',
+                'quesitos', 'bibliografia')
+
+def _codificar_secao(texto):
+    """(conteudo, compressao) stored for a section: zlib when it is large enough and actually shrinks."""
+    dados = texto.encode('utf-8')
+    minimo = current_app.config['LAUDO_COMPRESS_MIN_BYTES']
+    if minimo is not None and len(dados) >= minimo:
+        comprimido = zlib.compress(dados)
+        if len(comprimido) < len(dados):
+            return comprimido, 'zlib'
+    return dados, None
+
+def _decodificar_secao(conteudo, compressao):
+    return (zlib.decompress(conteudo) if compressao == 'zlib' else conteudo).decode('utf-8')
+
+def _secao_laudo(nome):
+    def ler(self):
+        secao = self.secoes.get(nome)
+        return secao.texto if secao is not None else None
+
+    def gravar(self, valor):
+        valor = valor or None
+        if valor == ler(self):
+            return
+        if valor is None:
+            del self.secoes[nome]
+        elif nome in self.secoes:
+            self.secoes[nome].texto = valor
+        else:
+            self.secoes[nome] = LaudoSecao(secao=nome, texto=valor)
+        # Touch the pericia row too, so versao and sync_seq move with its laudo
+        self.atualizado_em = datetime.utcnow()
+
+    return property(ler, gravar)
 
 class Pericia(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     numero_processo = db.Column(db.String(50), nullable=False)
     nome_autor = db.Column(db.String(100), nullable=False)
-    data_pericia = db.Column(db.DateTime, nullable=True)
-    status = db.Column(db.String(20), default='Aguardando', index=True) # Aguardando, Agendado, Em Andamento, Concluido
+    data_pericia = db.Column(db.DateTime, nullable=True, index=True) # Agenda windows are ranges on it
+    status = db.Column(db.String(20), default='Aguardando') # Aguardando, Agendado, Em Andamento, Concluido
 
     # Dados Pessoais e Processuais
     tipo_acao = db.Column(db.String(50), nullable=True)
@@ -38,16 +255,16 @@ class Pericia(db.Model):
     endereco_cidade = db.Column(db.String(100), nullable=True)
     endereco_uf = db.Column(db.String(2), nullable=True)
 
-    # Dados do Laudo
-    objetivo = db.Column(db.Text, nullable=True)
-    metodologia = db.Column(db.Text, nullable=True)
-    anamnese = db.Column(db.Text, nullable=True) # HDA
-    antecedentes = db.Column(db.Text, nullable=True)
-    exame_fisico = db.Column(db.Text, nullable=True)
-    discussao = db.Column(db.Text, nullable=True)
-    conclusao = db.Column(db.Text, nullable=True)
-    quesitos = db.Column(db.Text, nullable=True)
-    bibliografia = db.Column(db.Text, nullable=True)
+    # Dados do Laudo: rows of laudo_secao (see LaudoSecao), read and written through these properties
+    objetivo = _secao_laudo('objetivo')
+    metodologia = _secao_laudo('metodologia')
+    anamnese = _secao_laudo('anamnese') # HDA
+    antecedentes = _secao_laudo('antecedentes')
+    exame_fisico = _secao_laudo('exame_fisico')
+    discussao = _secao_laudo('discussao')
+    conclusao = _secao_laudo('conclusao')
+    quesitos = _secao_laudo('quesitos')
+    bibliografia = _secao_laudo('bibliografia')
 
     # Financeiro
     valor_honorarios = db.Column(db.Float, default=0.0)
@@ -55,7 +272,26 @@ class Pericia(db.Model):
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
+    # Sincronização com o PWA
+    uid = db.Column(db.String(64), unique=True, nullable=True, default=lambda: uuid.uuid4().hex) # id do registro no PWA
+    versao = db.Column(db.Integer, nullable=False, default=1) # Optimistic concurrency, bumped on every UPDATE
+    sync_seq = db.Column(db.Integer, nullable=True, index=True) # Position in the global change feed
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow)
+    extras = db.Column(db.Text, nullable=True) # JSON: PWA fields that have no column here
+
     documents = db.relationship('Documento', backref='pericia', lazy=True, cascade="all, delete-orphan")
+    secoes = db.relationship('LaudoSecao', lazy=True, cascade="all, delete-orphan",
+                             collection_class=attribute_keyed_dict('secao'))
+
+    __mapper_args__ = {'version_id_col': versao}
+    __table_args__ = (
+        # Dashboard filtered by status, newest first (rowid = id breaks created_at ties)
+        db.Index('ix_pericia_status_created_at', 'status', 'created_at'),
+        # Financial summary: GROUP BY status_pagamento, status answered from the index alone
+        db.Index('ix_pericia_resumo', 'status', 'status_pagamento', 'valor_honorarios'),
+        # Ids are never handed out again, even after the newest rows are deleted or archived
+        {'sqlite_autoincrement': True},
+    )
 
     def __repr__(self):
         return f'<Pericia {self.numero_processo}>'
@@ -65,44 +301,851 @@ class Documento(db.Model):
     filename = db.Column(db.String(255), nullable=False)
     original_name = db.Column(db.String(255), nullable=False)
     upload_date = db.Column(db.DateTime, default=datetime.utcnow)
-    pericia_id = db.Column(db.Integer, db.ForeignKey('pericia.id'), nullable=False)
+    pericia_id = db.Column(db.Integer, db.ForeignKey('pericia.id'), nullable=False, index=True)
+    blob_id = db.Column(db.Integer, db.ForeignKey('blob.id'), nullable=True) # Null for files uploaded before content addressing
+
+    blob = db.relationship('Blob')
+
+    __table_args__ = {'sqlite_autoincrement': True} # Archived documentos come back under their own id
+
+# Document count for list views: a correlated subquery over ix_documento_pericia_id, deferred so only listings pay for it
+Pericia.num_documentos = db.column_property(
+    select(func.count(Documento.id)).where(Documento.pericia_id == Pericia.id).correlate_except(Documento).scalar_subquery(),
+    deferred=True,
+)
+
+class LaudoSecao(db.Model):
+    # One laudo section of a pericia
+    pericia_id = db.Column(db.Integer, db.ForeignKey('pericia.id'), primary_key=True)
+    secao = db.Column(db.String(20), primary_key=True) # One of SECOES_LAUDO
+    compressao = db.Column(db.String(10), nullable=True) # None (plain UTF-8) or 'zlib'
+    conteudo = db.Column(db.LargeBinary, nullable=False)
+
+    @property
+    def texto(self):
+        return _decodificar_secao(self.conteudo, self.compressao)
+
+    @texto.setter
+    def texto(self, valor):
+        self.conteudo, self.compressao = _codificar_secao(valor)
+
+def _linhas_secoes(pericia_id, valores):
+    """laudo_secao rows for the non-empty sections in valores (a dict by section name), for bulk inserts."""
+    linhas = []
+    for secao in SECOES_LAUDO:
+        if valores.get(secao):
+            conteudo, compressao = _codificar_secao(valores[secao])
+            linhas.append({'pericia_id': pericia_id, 'secao': secao, 'conteudo': conteudo, 'compressao': compressao})
+    return linhas
+
+def _secoes_por_pericia(connection, ids, secoes=SECOES_LAUDO):
+    """{pericia_id: {secao: texto}} for a batch of pericias, in one query."""
+    resultado = {}
+    if not ids:
+        return resultado
+    rows = connection.execute(
+        select(LaudoSecao.pericia_id, LaudoSecao.secao, LaudoSecao.conteudo, LaudoSecao.compressao)
+        .where(LaudoSecao.pericia_id.in_(ids), LaudoSecao.secao.in_(secoes))
+    )
+    for pericia_id, secao, conteudo, compressao in rows:
+        resultado.setdefault(pericia_id, {})[secao] = _decodificar_secao(conteudo, compressao)
+    return resultado
+
+class Blob(db.Model):
+    # Content-addressed file shared by every Documento with the same bytes
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False)
+    filename = db.Column(db.String(255), nullable=False) # Name inside UPLOAD_FOLDER
+    size = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, default=0, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Partial index: only orphans waiting for cleanup are in it
+        db.Index('ix_blob_orfao', 'ref_count', sqlite_where=db.text('ref_count <= 0'), postgresql_where=db.text('ref_count <= 0')),
+    )
 
 class Macro(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     titulo = db.Column(db.String(100), nullable=False)
     conteudo = db.Column(db.Text, nullable=False)
-    categoria = db.Column(db.String(50), nullable=False) # anamnese, exame_fisico, conclusao
+    categoria = db.Column(db.String(50), nullable=False, index=True) # anamnese, exame_fisico, conclusao
+
+class Tarefa(db.Model):
+    # Background job (see jobs.py)
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}') # JSON
+    chave = db.Column(db.String(255), nullable=True, index=True) # Deduplicates pending jobs for the same thing
+    prioridade = db.Column(db.Integer, nullable=False, default=jobs.PRIORIDADE_NORMAL) # Lower runs first
+    status = db.Column(db.String(20), nullable=False, default=jobs.PENDENTE) # pendente, executando, concluida, falhou
+    tentativas = db.Column(db.Integer, nullable=False, default=0)
+    max_tentativas = db.Column(db.Integer, nullable=False, default=5)
+    erro = db.Column(db.Text, nullable=True)
+    disponivel_em = db.Column(db.DateTime, nullable=False, default=datetime.utcnow) # Not run before this (retry backoff)
+    criada_em = db.Column(db.DateTime, default=datetime.utcnow)
+    iniciada_em = db.Column(db.DateTime, nullable=True)
+    concluida_em = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        # Claiming: WHERE status = 'pendente' ORDER BY prioridade, id
+        db.Index('ix_tarefa_fila', 'status', 'prioridade'),
+    )
+
+class PericiaRemovida(db.Model):
+    # Tombstone so sync clients learn about deletes
+    id = db.Column(db.Integer, primary_key=True)
+    uid = db.Column(db.String(64), nullable=False)
+    sync_seq = db.Column(db.Integer, nullable=False, index=True)
+    removido_em = db.Column(db.DateTime, default=datetime.utcnow)
+
+class PericiaArquivada(db.Model):
+    # Concluded, paid pericia moved out of the hot tables by `flask arquivar` (see "Archive" below); same id as before
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    uid = db.Column(db.String(64), unique=True, nullable=True)
+    # Copies of the columns the dashboard, search results and agenda show
+    numero_processo = db.Column(db.String(50), nullable=False)
+    nome_autor = db.Column(db.String(100), nullable=False)
+    data_pericia = db.Column(db.DateTime, nullable=True, index=True)
+    status = db.Column(db.String(20), nullable=False)
+    tipo_acao = db.Column(db.String(50), nullable=True)
+    valor_honorarios = db.Column(db.Float, nullable=True)
+    status_pagamento = db.Column(db.String(20), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=True, index=True)
+    versao = db.Column(db.Integer, nullable=False)
+    num_documentos = db.Column(db.Integer, nullable=False, default=0)
+    arquivada_em = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # zlib-compressed JSON: every pericia column, the laudo sections and the documento rows
+    dados = db.Column(db.LargeBinary, nullable=False)
+
+    __table_args__ = (
+        # Same shapes as Pericia's: archive listing filtered by status, and its totals from the index alone
+        db.Index('ix_pericia_arquivada_status_created_at', 'status', 'created_at'),
+        db.Index('ix_pericia_arquivada_resumo', 'status', 'status_pagamento', 'valor_honorarios'),
+    )
+
+class Contador(db.Model):
+    # Named counters shared by every worker through the database
+    nome = db.Column(db.String(50), primary_key=True)
+    valor = db.Column(db.Integer, nullable=False, default=0)
+
+class ResumoMensal(db.Model):
+    # Fees per month (of data_pericia, else created_at), tipo_acao and status_pagamento, kept current by Pericia events
+    mes = db.Column(db.String(7), primary_key=True) # YYYY-MM
+    tipo_acao = db.Column(db.String(50), primary_key=True) # '' when the pericia has none
+    status_pagamento = db.Column(db.String(20), primary_key=True)
+    quantidade = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Float, nullable=False, default=0.0)
+
+    __table_args__ = (
+        # Aging report: every pending month, without reading the paid ones
+        db.Index('ix_resumo_mensal_pagamento', 'status_pagamento', 'mes'),
+    )
+
+# --- Change Feed Counter ---
+
+def _reservar_sequencias(connection, nomes, quantidade=1):
+    """Advances Contadores inside the current transaction, creating missing ones, in one upsert: {nome: new value}."""
+    upsert = (postgresql_insert if connection.dialect.name == 'postgresql' else sqlite_insert)(Contador)
+    return dict(connection.execute(
+        upsert.values([{'nome': nome, 'valor': quantidade} for nome in nomes])
+        .on_conflict_do_update(index_elements=['nome'], set_={'valor': Contador.valor + upsert.excluded.valor})
+        .returning(Contador.nome, Contador.valor)
+    ).all())
+
+def _reservar_sequencia(connection, nome, quantidade=1):
+    """New value of one Contador (the last of the range reserved)."""
+    return _reservar_sequencias(connection, [nome], quantidade)[nome]
+
+# Anything agenda.ics shows also bumps the 'agenda' counter, its ETag in every worker
+COLUNAS_AGENDA = ('uid', 'numero_processo', 'nome_autor', 'data_pericia', 'status', 'tipo_acao')
+# Likewise the dashboard totals and the 'resumo' counter, so laudo edits and autosaves keep them cached
+COLUNAS_RESUMO = ('status', 'status_pagamento', 'valor_honorarios')
+
+def _contadores_alterados(target, removida=False):
+    state = db.inspect(target)
+    nova = removida or state.key is None
+    contadores = ['sync']
+    agendada = target.data_pericia or any(state.attrs.data_pericia.history.deleted)
+    if agendada and (nova or any(state.attrs[col].history.has_changes() for col in COLUNAS_AGENDA)):
+        contadores.append('agenda')
+    if nova or any(state.attrs[col].history.has_changes() for col in COLUNAS_RESUMO):
+        contadores.append('resumo')
+    return contadores
+
+# SQLite serialises writers, so sync_seq values become visible in the order they were reserved
+@db.event.listens_for(Pericia, 'before_insert')
+def _pericia_antes_inserir(mapper, connection, target):
+    target.sync_seq = _reservar_sequencias(connection, _contadores_alterados(target))['sync']
+    target.atualizado_em = datetime.utcnow()
+
+@db.event.listens_for(Pericia, 'before_update')
+def _pericia_antes_atualizar(mapper, connection, target):
+    if db.session.is_modified(target, include_collections=False):
+        target.sync_seq = _reservar_sequencias(connection, _contadores_alterados(target))['sync']
+        target.atualizado_em = datetime.utcnow()
+
+@db.event.listens_for(Pericia, 'after_insert')
+def _pericia_inserida(mapper, connection, target):
+    _indexar_pericia(connection, target)
+
+@db.event.listens_for(Pericia, 'after_delete')
+def _pericia_removida(mapper, connection, target):
+    _desindexar_pericia(connection, target.id)
+    contadores = _contadores_alterados(target, removida=True)
+    if target.uid:
+        connection.execute(db.insert(PericiaRemovida).values(
+            uid=target.uid, sync_seq=_reservar_sequencias(connection, contadores)['sync'], removido_em=datetime.utcnow()
+        ))
+    else:
+        # Nothing to tell sync clients about
+        _reservar_sequencias(connection, [nome for nome in contadores if nome != 'sync'])
+
+@db.event.listens_for(Pericia, 'after_update')
+def _pericia_atualizada(mapper, connection, target):
+    state = db.inspect(target)
+    colunas = [col for col in COLUNAS_BUSCA if col not in SECOES_LAUDO]
+    if any(state.attrs[col].history.has_changes() for col in colunas) or _secoes_alteradas(target) & set(COLUNAS_BUSCA):
+        _indexar_pericia(connection, target)
+
+def _secoes_alteradas(pericia):
+    """Names of the laudo sections added, removed or rewritten since the last flush."""
+    historico = db.inspect(pericia).attrs.secoes.history
+    alteradas = {s.secao for s in list(historico.added) + list(historico.deleted)}
+    alteradas.update(s.secao for s in historico.unchanged if db.inspect(s).attrs.conteudo.history.has_changes())
+    return alteradas
+
+# Blob reference counts follow Documento rows, whichever route creates or deletes them
+@db.event.listens_for(Documento, 'after_insert')
+def _documento_inserido(mapper, connection, target):
+    if target.blob_id:
+        connection.execute(db.update(Blob).where(Blob.id == target.blob_id).values(ref_count=Blob.ref_count + 1))
+
+@db.event.listens_for(Documento, 'after_delete')
+def _documento_removido(mapper, connection, target):
+    if target.blob_id:
+        connection.execute(db.update(Blob).where(Blob.id == target.blob_id).values(ref_count=Blob.ref_count - 1))
+
+# Any macro write bumps the 'macros' counter, which every worker compares against its cache
+@db.event.listens_for(Macro, 'after_insert')
+@db.event.listens_for(Macro, 'after_update')
+@db.event.listens_for(Macro, 'after_delete')
+def _macro_alterada(mapper, connection, target):
+    _reservar_sequencia(connection, 'macros')
+
+
+# --- Financial Rollups ---
+# ResumoMensal receives the delta of every Pericia insert, update and delete
+# in the same transaction, so reports read a few hundred rollup rows instead
+# of every pericia. `flask recalcular-financeiro` rebuilds it from scratch.
+
+COLUNAS_FINANCEIRO = ('valor_honorarios', 'status_pagamento', 'data_pericia', 'created_at', 'tipo_acao')
+
+# Load the previous value on assignment, so an update can take it out of its old rollup
+for _coluna in COLUNAS_FINANCEIRO:
+    db.event.listen(getattr(Pericia, _coluna), 'set', lambda target, value, oldvalue, initiator: None, active_history=True)
+
+def _chave_financeira(data_pericia, created_at, tipo_acao, status_pagamento):
+    data = data_pericia or created_at or datetime.utcnow()
+    return (f"{data.year:04d}-{data.month:02d}", tipo_acao or '', status_pagamento or 'Pendente')
+
+def _somar_resumos(connection, deltas):
+    """deltas: {chave: (quantidade, total)} added to ResumoMensal, creating missing rows, in one upsert."""
+    linhas = [
+        {'mes': mes, 'tipo_acao': tipo_acao, 'status_pagamento': status_pagamento, 'quantidade': quantidade, 'total': total}
+        for (mes, tipo_acao, status_pagamento), (quantidade, total) in deltas.items() if quantidade or total
+    ]
+    if not linhas:
+        return
+    upsert = (postgresql_insert if connection.dialect.name == 'postgresql' else sqlite_insert)(ResumoMensal)
+    connection.execute(upsert.on_conflict_do_update(
+        index_elements=['mes', 'tipo_acao', 'status_pagamento'],
+        set_={'quantidade': ResumoMensal.quantidade + upsert.excluded.quantidade,
+              'total': ResumoMensal.total + upsert.excluded.total},
+    ), linhas)
+
+def _acumular(deltas, chave, quantidade, valor):
+    atual = deltas.get(chave, (0, 0.0))
+    deltas[chave] = (atual[0] + quantidade, atual[1] + quantidade * (valor or 0.0))
+
+def _valores_financeiros(target, anteriores=False):
+    state = db.inspect(target)
+    valores = {}
+    for col in COLUNAS_FINANCEIRO:
+        historico = state.attrs[col].history
+        valores[col] = historico.deleted[0] if anteriores and historico.deleted else state.attrs[col].value
+    return valores
+
+@db.event.listens_for(Pericia, 'after_insert')
+def _financeiro_inserido(mapper, connection, target):
+    v = _valores_financeiros(target)
+    deltas = {}
+    _acumular(deltas, _chave_financeira(v['data_pericia'], v['created_at'], v['tipo_acao'], v['status_pagamento']), 1, v['valor_honorarios'])
+    _somar_resumos(connection, deltas)
+
+@db.event.listens_for(Pericia, 'after_update')
+def _financeiro_atualizado(mapper, connection, target):
+    state = db.inspect(target)
+    if not any(state.attrs[col].history.has_changes() for col in COLUNAS_FINANCEIRO):
+        return
+    antes, depois = _valores_financeiros(target, anteriores=True), _valores_financeiros(target)
+    deltas = {}
+    _acumular(deltas, _chave_financeira(antes['data_pericia'], antes['created_at'], antes['tipo_acao'], antes['status_pagamento']), -1, antes['valor_honorarios'])
+    _acumular(deltas, _chave_financeira(depois['data_pericia'], depois['created_at'], depois['tipo_acao'], depois['status_pagamento']), 1, depois['valor_honorarios'])
+    _somar_resumos(connection, deltas)
+
+@db.event.listens_for(Pericia, 'after_delete')
+def _financeiro_removido(mapper, connection, target):
+    v = _valores_financeiros(target)
+    deltas = {}
+    _acumular(deltas, _chave_financeira(v['data_pericia'], v['created_at'], v['tipo_acao'], v['status_pagamento']), -1, v['valor_honorarios'])
+    _somar_resumos(connection, deltas)
+
+def _recalcular_resumo_mensal(connection):
+    """Rebuilds every rollup with one grouped pass over pericia and the archive (archived fees still count)."""
+    fontes = union_all(*(
+        select(modelo.id, modelo.data_pericia, modelo.created_at, modelo.tipo_acao, modelo.status_pagamento, modelo.valor_honorarios)
+        for modelo in (Pericia, PericiaArquivada)
+    )).subquery()
+    data = func.coalesce(fontes.c.data_pericia, fontes.c.created_at)
+    if connection.dialect.name == 'postgresql':
+        mes = func.to_char(data, 'YYYY-MM')
+    else:
+        mes = func.strftime('%Y-%m', data)
+    tipo_acao = func.coalesce(fontes.c.tipo_acao, '')
+    status_pagamento = func.coalesce(fontes.c.status_pagamento, 'Pendente')
+    connection.execute(db.delete(ResumoMensal))
+    connection.execute(db.insert(ResumoMensal).from_select(
+        ['mes', 'tipo_acao', 'status_pagamento', 'quantidade', 'total'],
+        select(mes, tipo_acao, status_pagamento, func.count(fontes.c.id), func.coalesce(func.sum(fontes.c.valor_honorarios), 0.0))
+        .group_by(mes, tipo_acao, status_pagamento)
+    ))
+
+@bp.cli.command('recalcular-financeiro')
+def recalcular_financeiro_command():
+    """Rebuilds the monthly financial rollups from the pericia table and the archive."""
+    with db.engine.begin() as conn:
+        _recalcular_resumo_mensal(conn)
+    print("Resumo financeiro recalculado.")
+
+# --- Full-Text Search (SQLite FTS5) ---
+
+COLUNAS_BUSCA = ('numero_processo', 'nome_autor', 'anamnese', 'discussao', 'conclusao')
+
+# Standalone FTS5 table keyed by rowid = pericia.id. remove_diacritics makes "função" match "funcao".
+pericia_fts = table('pericia_fts', column('rowid'), *(column(col) for col in COLUNAS_BUSCA))
+_fts_match = literal_column('pericia_fts').op('MATCH')
+
+def _criar_indice_busca():
+    """Creates the FTS5 table when the database supports it, backfilling it on first creation."""
+    with db.engine.begin() as conn:
+        if conn.dialect.name != 'sqlite':
+            return
+        existia = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'pericia_fts'")).first()
+        try:
+            conn.execute(text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS pericia_fts USING fts5("
+                + ", ".join(COLUNAS_BUSCA) +
+                ", tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+            ))
+        except Exception as e:
+            current_app.logger.warning(f"FTS5 indisponível, busca usará LIKE: {e}")
+            return
+        _estado()['fts'] = True
+        if not existia:
+            _reindexar_busca(conn)
+
+def _reindexar_busca(conn):
+    conn.execute(text("DELETE FROM pericia_fts"))
+    colunas = [getattr(Pericia, col) for col in COLUNAS_BUSCA if col not in SECOES_LAUDO]
+    rows = conn.execute(select(Pericia.id, *colunas)).yield_per(1000)
+    for batch in rows.partitions():
+        secoes = _secoes_por_pericia(conn, [row.id for row in batch], COLUNAS_BUSCA)
+        conn.execute(pericia_fts.insert(), [_documento_busca({**row._mapping, **secoes.get(row.id, {})}) for row in batch])
+    # Archived pericias stay searchable, from their payload
+    for batch in conn.execute(select(PericiaArquivada.dados)).yield_per(1000).partitions():
+        conteudos = [_ler_arquivo(dados) for dados, in batch]
+        conn.execute(pericia_fts.insert(), [_documento_busca({**c['pericia'], **c['secoes']}) for c in conteudos])
+
+def _texto_plano(conteudo):
+    # Laudo fields hold Quill HTML; index only the visible text
+    if not conteudo:
+        return ''
+    return html.unescape(re.sub(r'<[^>]+>', ' ', conteudo))
+
+def _documento_busca(valores):
+    """FTS row from a dict with the id and the COLUNAS_BUSCA values (missing ones index as empty)."""
+    return {'rowid': valores['id'], **{col: _texto_plano(valores.get(col)) for col in COLUNAS_BUSCA}}
+
+def _indexar_lote(connection, linhas):
+    # Bulk inserts bypass the mapper events, so they index their rows here
+    if _estado()['fts'] and linhas:
+        connection.execute(pericia_fts.insert(), [_documento_busca(linha) for linha in linhas])
+
+def _indexar_pericia(connection, pericia):
+    if not _estado()['fts']:
+        return
+    _desindexar_pericia(connection, pericia.id)
+    valores = {col: getattr(pericia, col) for col in COLUNAS_BUSCA}
+    connection.execute(pericia_fts.insert(), _documento_busca(dict(valores, id=pericia.id)))
+
+def _desindexar_pericia(connection, pericia_id):
+    if _estado()['fts']:
+        connection.execute(pericia_fts.delete().where(pericia_fts.c.rowid == pericia_id))
 
-# Cria o banco de dados
-with app.app_context():
-    db.create_all()
+def _fts_query(search):
+    """Turns free text into an FTS5 query: every term must match, each as a prefix."""
+    termos = re.findall(r'\w+', search or '')
+    return ' '.join(f'"{t}"*' for t in termos) or None
 
-@app.route('/')
+@bp.cli.command('reindexar-busca')
+def reindexar_busca_command():
+    """Rebuilds the full-text search index from the pericia and laudo_secao tables."""
+    if not _estado()['fts']:
+        print("FTS5 não disponível neste banco de dados.")
+        return
+    with db.engine.begin() as conn:
+        _reindexar_busca(conn)
+    print("Índice de busca reconstruído.")
+
+@bp.cli.command('migrar')
+@click.option('--dry-run', is_flag=True, help='Only print the pending steps.')
+@click.option('--lote', default=5000, show_default=True, help='Rows per backfill transaction.')
+@click.option('--pausa', default=0.0, show_default=True, help='Seconds to sleep between backfill batches.')
+def migrar_command(dry_run, lote, pausa):
+    """Applies pending schema migrations (see migrations.py)."""
+    migrations.migrar(db.engine, db.metadata, dry_run=dry_run, lote=lote, pausa=pausa)
+    if not dry_run:
+        _criar_indice_busca()
+
+@bp.after_app_request
+def _verificar_orcamento(response):
+    view = current_app.view_functions.get(request.endpoint)
+    limite = getattr(view, 'orcamento_consultas', current_app.config['QUERY_BUDGET'])
+    consultas = g.get('consultas', 0)
+    if limite is not None and consultas > limite:
+        mensagem = f"{request.endpoint} fez {consultas} consultas SQL (orçamento: {limite})"
+        if current_app.config['QUERY_BUDGET_STRICT']:
+            raise RuntimeError(mensagem)
+        current_app.logger.warning(mensagem)
+    return response
+
+@bp.route('/metrics')
+def metricas():
+    registro = current_app.extensions.get('metricas')
+    if registro is None:
+        abort(404)
+    return Response(registro.exportar(), mimetype='text/plain; version=0.0.4')
+
+# --- Dashboard Listing ---
+
+# Columns shown in the dashboard table; the laudo sections live in laudo_secao and are never read here.
+COLUNAS_LISTAGEM = (
+    Pericia.id, Pericia.numero_processo, Pericia.nome_autor, Pericia.data_pericia,
+    Pericia.status, Pericia.valor_honorarios, Pericia.status_pagamento, Pericia.created_at,
+    Pericia.num_documentos,
+)
+
+def _filtrar_pericias(search, status_filter, modelo=Pericia):
+    """Filtered query over the active pericias or, with modelo=PericiaArquivada, the archived ones."""
+    query = modelo.query
+
+    if search:
+        fts = _fts_query(search)
+        if _estado()['fts'] and fts:
+            # Archived pericias stay in pericia_fts, under the same id
+            query = query.filter(modelo.id.in_(select(pericia_fts.c.rowid).where(_fts_match(fts))))
+        else:
+            query = query.filter(
+                (modelo.numero_processo.contains(search)) |
+                (modelo.nome_autor.contains(search))
+            )
+
+    if status_filter:
+        query = query.filter(modelo.status == status_filter)
+
+    return query
+
+def _encode_cursor(pericia):
+    return f"{pericia.created_at.isoformat()}_{pericia.id}"
+
+def _decode_cursor(cursor):
+    """Returns (created_at, id) from a cursor string, or None if it is malformed."""
+    created_at, _, pk = (cursor or '').rpartition('_')
+    try:
+        return datetime.fromisoformat(created_at), int(pk)
+    except ValueError:
+        return None
+
+def _page_size():
+    per_page = request.args.get('per_page', type=int) or current_app.config['DASHBOARD_PAGE_SIZE']
+    return max(1, min(per_page, current_app.config['DASHBOARD_MAX_PAGE_SIZE']))
+
+def _listar_pagina(query, cursor, per_page, modelo=Pericia):
+    """Keyset page over (created_at, id), newest first. Returns (pericias, next_cursor)."""
+    query = query.options(load_only(*(getattr(modelo, coluna.key) for coluna in COLUNAS_LISTAGEM)))
+
+    if cursor:
+        created_at, pk = cursor
+        # Row-value comparison, so the planner seeks straight to the cursor in the created_at index
+        query = query.filter(tuple_(modelo.created_at, modelo.id) < (created_at, pk))
+
+    # Fetch one extra row to know whether there is a next page
+    pericias = query.order_by(modelo.created_at.desc(), modelo.id.desc()).limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(pericias) > per_page:
+        pericias = pericias[:per_page]
+        next_cursor = _encode_cursor(pericias[-1])
+
+    return pericias, next_cursor
+
+def _pericia_resumo(p):
+    return {
+        'id': p.id,
+        'numero_processo': p.numero_processo,
+        'nome_autor': p.nome_autor,
+        'data_pericia': p.data_pericia.isoformat() if p.data_pericia else None,
+        'status': p.status,
+        'valor_honorarios': p.valor_honorarios,
+        'status_pagamento': p.status_pagamento,
+        'created_at': p.created_at.isoformat() if p.created_at else None,
+        'documentos': p.num_documentos,
+    }
+
+def _linhas_resumo(query, modelo=Pericia):
+    """(status_pagamento, status, quantidade, total) rows of a single grouped query."""
+    return query.with_entities(
+        modelo.status_pagamento, modelo.status,
+        func.count(modelo.id), func.sum(modelo.valor_honorarios)
+    ).group_by(modelo.status_pagamento, modelo.status).all()
+
+def _calcular_resumo(*linhas):
+    """Totals and counts per status_pagamento and per status, from the rows of one or more _linhas_resumo()."""
+    resumo = {'por_pagamento': {}, 'por_status': {}, 'quantidade': 0, 'total': 0.0}
+    for status_pagamento, status, quantidade, total in itertools.chain(*linhas):
+        total = total or 0.0
+        for chave, grupo in ((status_pagamento, 'por_pagamento'), (status, 'por_status')):
+            item = resumo[grupo].setdefault(chave, {'quantidade': 0, 'total': 0.0})
+            item['quantidade'] += quantidade
+            item['total'] += total
+        resumo['quantidade'] += quantidade
+        resumo['total'] += total
+    return resumo
+
+def _linhas_resumo_arquivo(versao=None):
+    """_linhas_resumo() of the whole archive, regrouped only when the 'arquivo' counter moves."""
+    if versao is None:
+        versao = db.session.scalar(select(Contador.valor).where(Contador.nome == 'arquivo')) or 0
+    if not versao:
+        return []  # Nothing was ever archived
+    estado = _estado()
+    if estado['arquivo'] is None or estado['arquivo'][0] != versao:
+        estado['arquivo'] = (versao, _linhas_resumo(PericiaArquivada.query, PericiaArquivada))
+    return estado['arquivo'][1]
+
+def _resumo_financeiro(search, status_filter, arquivo=False):
+    # The totals of the active view count the archived pericias too, filtered or not; ?arquivo=1 counts only them.
+    # Only the unfiltered dashboard is cached; filtered views always aggregate.
+    if search or status_filter:
+        modelos = (PericiaArquivada,) if arquivo else (Pericia, PericiaArquivada)
+        return _calcular_resumo(*(_linhas_resumo(_filtrar_pericias(search, status_filter, modelo), modelo)
+                                  for modelo in modelos))
+    if arquivo:
+        return _calcular_resumo(_linhas_resumo_arquivo())
+
+    # Stamped with the 'resumo' counter: every write that can move a total, from any worker, advances it.
+    # Archived pericias count too, so archiving leaves the totals where they were.
+    contadores = dict(db.session.execute(select(Contador.nome, Contador.valor).where(Contador.nome.in_(['resumo', 'arquivo']))).all())
+    chave = (contadores.get('resumo', 0), contadores.get('arquivo', 0))
+    estado = _estado()
+    if estado['resumo'] is None or estado['resumo'][0] != chave:
+        estado['resumo'] = (chave, _calcular_resumo(_linhas_resumo(Pericia.query), _linhas_resumo_arquivo(chave[1])))
+    return estado['resumo'][1]
+
+def _arquivo_pedido():
+    return request.args.get('arquivo') in ('1', 'true')
+
+@bp.route('/')
 def index():
     # Search and Filter
     search = request.args.get('search')
     status_filter = request.args.get('status')
+    cursor = request.args.get('cursor')
+    # Active pericias by default; ?arquivo=1 lists the archived ones
+    arquivo = _arquivo_pedido()
+    modelo = PericiaArquivada if arquivo else Pericia
 
-    query = Pericia.query
+    query = _filtrar_pericias(search, status_filter, modelo)
+    pericias, next_cursor = _listar_pagina(query, _decode_cursor(cursor) if cursor else None, _page_size(), modelo)
 
-    if search:
-        query = query.filter(
-            (Pericia.numero_processo.contains(search)) |
-            (Pericia.nome_autor.contains(search))
-        )
+    # Totais Financeiros
+    resumo = _resumo_financeiro(search, status_filter, arquivo)
+    total_recebido = resumo['por_pagamento'].get('Pago', {}).get('total', 0.0)
+    total_pendente = resumo['por_pagamento'].get('Pendente', {}).get('total', 0.0)
 
-    if status_filter:
-        query = query.filter(Pericia.status == status_filter)
+    return render_template('index.html', pericias=pericias, search=search, status_filter=status_filter,
+                           total_recebido=total_recebido, total_pendente=total_pendente,
+                           cursor=cursor, next_cursor=next_cursor, resumo=resumo, arquivo=arquivo)
 
-    pericias = query.order_by(Pericia.created_at.desc()).all()
+@bp.route('/api/pericias')
+def listar_pericias_api():
+    cursor = request.args.get('cursor')
+    decoded = None
+    if cursor:
+        decoded = _decode_cursor(cursor)
+        if decoded is None:
+            return jsonify({'error': 'Invalid cursor'}), 400
 
-    # Totais Financeiros
-    total_recebido = query.filter(Pericia.status_pagamento == 'Pago').with_entities(func.sum(Pericia.valor_honorarios)).scalar() or 0.0
-    total_pendente = query.filter(Pericia.status_pagamento == 'Pendente').with_entities(func.sum(Pericia.valor_honorarios)).scalar() or 0.0
+    modelo = PericiaArquivada if _arquivo_pedido() else Pericia
+    query = _filtrar_pericias(request.args.get('search'), request.args.get('status'), modelo)
+    pericias, next_cursor = _listar_pagina(query, decoded, _page_size(), modelo)
+
+    return jsonify({
+        'items': [_pericia_resumo(p) for p in pericias],
+        'next_cursor': next_cursor
+    })
+
+@bp.route('/api/pericias/resumo')
+def resumo_pericias_api():
+    return jsonify(_resumo_financeiro(request.args.get('search'), request.args.get('status'), _arquivo_pedido()))
+
+# Age of pending fees in whole months since the month of the exam (rollups have month resolution)
+FAIXAS_ATRASO = ('a_vencer', '0-30', '31-60', '61-90', '90+')
+
+def _deslocar_mes(mes, meses):
+    ano, numero = map(int, mes.split('-'))
+    indice = ano * 12 + numero - 1 + meses
+    return f"{indice // 12:04d}-{indice % 12 + 1:02d}"
+
+def _meses_entre(de, ate):
+    return (int(ate[:4]) * 12 + int(ate[5:])) - (int(de[:4]) * 12 + int(de[5:]))
+
+@bp.route('/api/financeiro')
+def financeiro_api():
+    """Fees between de and ate (YYYY-MM, inclusive) by month, tipo_acao and status_pagamento, plus pending aging."""
+    hoje = datetime.utcnow()
+    mes_atual = f"{hoje.year:04d}-{hoje.month:02d}"
+    ate = request.args.get('ate') or mes_atual
+    de = request.args.get('de') or (_deslocar_mes(ate, -11) if re.fullmatch(r'\d{4}-\d{2}', ate) else ate)
+    for nome, valor in (('de', de), ('ate', ate)):
+        if not re.fullmatch(r'\d{4}-(0[1-9]|1[0-2])', valor):
+            return jsonify({'error': f'{nome} must be YYYY-MM'}), 400
+    if not 0 <= _meses_entre(de, ate) < 600:
+        return jsonify({'error': 'de must come before ate, at most 50 years apart'}), 400
+
+    tipo_acao = request.args.get('tipo_acao')
+    status_pagamento = request.args.get('status_pagamento')
+    query = ResumoMensal.query.filter(ResumoMensal.mes.between(de, ate))
+    if tipo_acao is not None:
+        query = query.filter(ResumoMensal.tipo_acao == tipo_acao)
+    if status_pagamento:
+        query = query.filter(ResumoMensal.status_pagamento == status_pagamento)
+
+    meses = {}
+    mes = de
+    while mes <= ate:
+        meses[mes] = {'mes': mes, 'quantidade': 0, 'total': 0.0, 'pago': 0.0, 'pendente': 0.0}
+        mes = _deslocar_mes(mes, 1)
+    por_tipo, por_pagamento = {}, {}
+    total, quantidade = 0.0, 0
+    for r in query:
+        if not r.quantidade:
+            continue
+        linha = meses[r.mes]
+        linha['quantidade'] += r.quantidade
+        linha['total'] += r.total
+        linha['pago' if r.status_pagamento == 'Pago' else 'pendente'] += r.total
+        for grupo, chave in ((por_tipo, r.tipo_acao or 'Não informado'), (por_pagamento, r.status_pagamento)):
+            item = grupo.setdefault(chave, {'quantidade': 0, 'total': 0.0})
+            item['quantidade'] += r.quantidade
+            item['total'] += r.total
+        total += r.total
+        quantidade += r.quantidade
+
+    # Aging covers everything still pending, whatever the range
+    atraso = {faixa: {'quantidade': 0, 'total': 0.0} for faixa in FAIXAS_ATRASO}
+    pendentes = ResumoMensal.query.filter(ResumoMensal.status_pagamento == 'Pendente')
+    if tipo_acao is not None:
+        pendentes = pendentes.filter(ResumoMensal.tipo_acao == tipo_acao)
+    for r in pendentes:
+        idade = _meses_entre(r.mes, mes_atual)
+        faixa = FAIXAS_ATRASO[0] if idade < 0 else FAIXAS_ATRASO[min(idade, 3) + 1]
+        atraso[faixa]['quantidade'] += r.quantidade
+        atraso[faixa]['total'] += r.total
+
+    def arredondar(item):
+        return {k: round(v, 2) if isinstance(v, float) else v for k, v in item.items()}
+
+    return jsonify({
+        'de': de,
+        'ate': ate,
+        'quantidade': quantidade,
+        'total': round(total, 2),
+        'meses': [arredondar(m) for m in meses.values()],
+        'por_tipo_acao': {k: arredondar(v) for k, v in por_tipo.items()},
+        'por_pagamento': {k: arredondar(v) for k, v in por_pagamento.items()},
+        'atraso_pendentes': {k: arredondar(v) for k, v in atraso.items()},
+    })
 
-    return render_template('index.html', pericias=pericias, search=search, status_filter=status_filter, total_recebido=total_recebido, total_pendente=total_pendente)
+@bp.route('/api/search')
+def buscar_api():
+    search = request.args.get('q', '')
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    fts = _fts_query(search)
+    if not fts:
+        return jsonify([])
 
-@app.route('/nova', methods=['GET', 'POST'])
+    if not _estado()['fts']:
+        pericias = _filtrar_pericias(search, None).options(load_only(*COLUNAS_LISTAGEM)).limit(limit).all()
+        return jsonify([dict(_pericia_resumo(p), snippet=None, arquivada=False) for p in pericias])
+
+    # snippet() marks hits with control chars so the text can be escaped before adding <mark>
+    snippet = func.snippet(literal_column('pericia_fts'), -1, '\x02', '\x03', '…', 12)
+    rows = db.session.execute(
+        select(pericia_fts.c.rowid, snippet)
+        .where(_fts_match(fts))
+        .order_by(literal_column('rank'))
+        .limit(limit)
+    ).all()
+    snippets = {pk: str(escape(trecho)).replace('\x02', '<mark>').replace('\x03', '</mark>') for pk, trecho in rows}
+
+    pericias = {p.id: p for p in Pericia.query.options(load_only(*COLUNAS_LISTAGEM)).filter(Pericia.id.in_(snippets))}
+    # Matches that are not active were archived: read them from the archive's listing columns
+    arquivadas = set(snippets) - set(pericias)
+    if arquivadas:
+        pericias.update((p.id, p) for p in PericiaArquivada.query.filter(PericiaArquivada.id.in_(arquivadas)).options(
+            load_only(*(getattr(PericiaArquivada, coluna.key) for coluna in COLUNAS_LISTAGEM))))
+    return jsonify([
+        dict(_pericia_resumo(pericias[pk]), snippet=snippets[pk], arquivada=pk in arquivadas)
+        for pk in snippets if pk in pericias
+    ])
+
+# --- CID-10 Lookup ---
+
+def _indice_cid():
+    # Built on first use; the tables only change with a deploy
+    estado = _estado()
+    if estado['cid'] is None:
+        estado['cid'] = cid10.carregar(current_app.config['CID10_FILES'])
+    return estado['cid']
+
+@bp.route('/api/cid')
+def buscar_cid_api():
+    """Typeahead over CID-10 codes and descriptions (accents and one typo per word ignored)."""
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    response = jsonify(_indice_cid().buscar(request.args.get('q', ''), limit))
+    response.cache_control.public = True
+    response.cache_control.max_age = 3600
+    return response
+
+# --- Agenda ---
+
+def _data_agenda(valor):
+    # FullCalendar sends ISO 8601 with the browser's offset; data_pericia holds local wall-clock times
+    return datetime.fromisoformat(valor).replace(tzinfo=None)
+
+def _agendadas(inicio, fim, colunas):
+    """Rows of colunas for the pericias, active and archived, with data_pericia in [inicio, fim), in date order."""
+    linhas = []
+    for modelo in (Pericia, PericiaArquivada):
+        linhas += db.session.execute(
+            select(*(getattr(modelo, coluna) for coluna in colunas))
+            .where(modelo.data_pericia >= inicio, modelo.data_pericia < fim)
+            .order_by(modelo.data_pericia)
+        ).all()
+    return sorted(linhas, key=lambda row: row.data_pericia)
+
+@bp.route('/api/agenda')
+def agenda_api():
+    """Pericias scheduled in [start, end), the calendar's visible window, read by range from ix_pericia_data_pericia."""
+    try:
+        inicio, fim = _data_agenda(request.args['start']), _data_agenda(request.args['end'])
+    except (KeyError, ValueError):
+        return jsonify({'error': 'start and end must be ISO 8601 dates'}), 400
+    max_dias = current_app.config['AGENDA_MAX_DAYS']
+    if not inicio < fim <= inicio + timedelta(days=max_dias):
+        return jsonify({'error': f'end must be after start and at most {max_dias} days later'}), 400
+
+    rows = _agendadas(inicio, fim, ('id', 'uid', 'numero_processo', 'nome_autor', 'data_pericia', 'status'))
+    return jsonify([{
+        'id': row.id,
+        'uid': row.uid,
+        'numero_processo': row.numero_processo,
+        'nome_autor': row.nome_autor,
+        'data_pericia': row.data_pericia.isoformat(),
+        'status': row.status,
+    } for row in rows])
+
+def _texto_ics(valor):
+    return (valor or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\r\n', '\\n').replace('\n', '\\n')
+
+def _linha_ics(linha):
+    # RFC 5545: at most 75 octets per line, continued on lines starting with a space, never inside a UTF-8 character
+    dados = linha.encode('utf-8')
+    partes, inicio = [], 0
+    while inicio < len(dados):
+        fim = min(inicio + (75 if not partes else 74), len(dados))
+        while fim < len(dados) and dados[fim] & 0xC0 == 0x80:
+            fim -= 1
+        partes.append(dados[inicio:fim].decode('utf-8'))
+        inicio = fim
+    return '\r\n '.join(partes) + '\r\n'
+
+def _evento_ics(row):
+    data = row.data_pericia
+    if (data.hour, data.minute, data.second) == (0, 0, 0):
+        dtstart = f'DTSTART;VALUE=DATE:{data:%Y%m%d}'  # Scheduled by day only, as the form does
+    else:
+        dtstart = f'DTSTART:{data:%Y%m%dT%H%M%S}'
+    descricao = f'Status: {row.status}' + (f'\nAção: {row.tipo_acao}' if row.tipo_acao else '')
+    linhas = [
+        'BEGIN:VEVENT',
+        f'UID:{row.uid or row.id}@pericias',
+        # The creation time, so every worker renders the same bytes for the same ETag
+        f'DTSTAMP:{row.created_at or datetime(1970, 1, 1):%Y%m%dT%H%M%SZ}',
+        dtstart,
+        f"SUMMARY:{_texto_ics(f'{row.numero_processo} - {row.nome_autor}')}",
+        f'DESCRIPTION:{_texto_ics(descricao)}',
+        'END:VEVENT',
+    ]
+    return ''.join(_linha_ics(linha) for linha in linhas)
+
+def _agenda_em_cache():
+    """agenda.ics and its ETag, rebuilt when the 'agenda' counter or the day moves; unchanged events are reused."""
+    versao = db.session.scalar(select(Contador.valor).where(Contador.nome == 'agenda')) or 0
+    hoje = date.today()
+    etag = f'agenda-{versao}-{hoje:%Y%m%d}'
+    estado = _estado()
+    if estado['agenda'] is None or estado['agenda']['etag'] != etag:
+        anteriores = estado['agenda']['eventos'] if estado['agenda'] else {}
+        inicio = hoje - timedelta(days=current_app.config['AGENDA_ICS_DAYS_BEFORE'])
+        fim = hoje + timedelta(days=current_app.config['AGENDA_ICS_DAYS_AFTER'])
+        rows = _agendadas(inicio, fim, ('id', 'versao', 'uid', 'numero_processo', 'nome_autor', 'data_pericia',
+                                        'status', 'tipo_acao', 'created_at'))
+        eventos = {}
+        for row in rows:
+            anterior = anteriores.get(row.id)
+            eventos[row.id] = anterior if anterior and anterior[0] == row.versao else (row.versao, _evento_ics(row))
+        corpo = ''.join([
+            'BEGIN:VCALENDAR\r\n', 'VERSION:2.0\r\n', 'PRODID:-//MedicalFarmer//Pericias//PT-BR\r\n',
+            'CALSCALE:GREGORIAN\r\n', _linha_ics('X-WR-CALNAME:Perícias'),
+            *(texto for _, texto in eventos.values()),
+            'END:VCALENDAR\r\n',
+        ])
+        estado['agenda'] = {'etag': etag, 'eventos': eventos, 'corpo': corpo}
+    return estado['agenda']
+
+@bp.route('/agenda.ics')
+def agenda_ics():
+    cache = _agenda_em_cache()
+    response = Response(cache['corpo'], mimetype='text/calendar')
+    response.set_etag(cache['etag'])
+    # Calendar clients poll every few minutes: a 304 costs one counter read
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@bp.route('/nova', methods=['GET', 'POST'])
 def nova_pericia():
     if request.method == 'POST':
         numero_processo = request.form['numero_processo']
@@ -132,71 +1175,890 @@ def nova_pericia():
         )
         db.session.add(nova)
         db.session.commit()
-        return redirect(url_for('editar_pericia', id=nova.id))
+        return redirect(url_for('main.editar_pericia', id=nova.id))
     return render_template('form_pericia.html', pericia=None)
 
-@app.route('/pericia/<int:id>', methods=['GET', 'POST'])
+@bp.route('/pericia/<int:id>', methods=['GET', 'POST'])
 def editar_pericia(id):
-    pericia = Pericia.query.get_or_404(id)
-    macros = Macro.query.all()
+    # The laudo comes with the pericia: a lazy load while the POST sets the sections would autoflush halfway
+    query = Pericia.query.options(selectinload(Pericia.secoes))
+    if request.method == 'GET':
+        # Load the documents with the pericia rather than lazily from inside the template
+        query = query.options(selectinload(Pericia.documents))
+        pericia = query.filter_by(id=id).first() or _pericia_do_arquivo(id)
+        if pericia is None:
+            abort(404)
+        return render_template('form_pericia.html', pericia=pericia, macros=_macros_em_cache()['todas'],
+                               arquivada=pericia not in db.session)
 
-    if request.method == 'POST':
-        pericia.numero_processo = request.form.get('numero_processo', pericia.numero_processo)
-        pericia.nome_autor = request.form.get('nome_autor', pericia.nome_autor)
-        pericia.tipo_acao = request.form.get('tipo_acao')
+    pericia = _pericia_ativa(query, id)
+    pericia.numero_processo = request.form.get('numero_processo', pericia.numero_processo)
+    pericia.nome_autor = request.form.get('nome_autor', pericia.nome_autor)
+    pericia.tipo_acao = request.form.get('tipo_acao')
+
+    # Datas
+    data_pericia = request.form.get('data_pericia')
+    if data_pericia:
+        pericia.data_pericia = datetime.strptime(data_pericia, '%Y-%m-%d')
+
+    data_nasc = request.form.get('data_nascimento')
+    if data_nasc:
+        try:
+            pericia.data_nascimento = datetime.strptime(data_nasc, '%Y-%m-%d')
+        except:
+            pass
 
-        # Datas
-        data_pericia = request.form.get('data_pericia')
-        if data_pericia:
-             pericia.data_pericia = datetime.strptime(data_pericia, '%Y-%m-%d')
+    # Textos: only the sections the form has, so the ones it does not show (e.g. synced from the PWA) survive
+    for secao in SECOES_LAUDO:
+        if secao in request.form:
+            setattr(pericia, secao, request.form[secao])
+
+    # Outros campos
+    pericia.cpf = request.form.get('cpf')
+    pericia.rg = request.form.get('rg')
+    pericia.profissao = request.form.get('profissao')
+    pericia.endereco_cidade = request.form.get('endereco_cidade')
+    pericia.endereco_uf = request.form.get('endereco_uf')
+
+    # Financeiro
+    try:
+        pericia.valor_honorarios = float(request.form.get('valor_honorarios', 0.0))
+    except:
+        pericia.valor_honorarios = 0.0
+
+    pericia.status_pagamento = request.form.get('status_pagamento', 'Pendente')
+
+
+    if 'finalizar' in request.form:
+        pericia.status = 'Concluido'
+    elif pericia.status == 'Aguardando' or pericia.status == 'Agendado':
+        pericia.status = 'Em Andamento'
+
+    _fila().enfileirar('invalidar_laudo', {'pericia_id': pericia.id}, chave=f'invalidar_laudo:{pericia.id}',
+                       prioridade=jobs.PRIORIDADE_BAIXA)
+    db.session.commit()
+    return redirect(url_for('main.index'))
+
+# Required on create, so a PATCH may not clear them
+COLUNAS_NAO_NULAS = ('numero_processo', 'nome_autor', 'status', 'status_pagamento')
+
+def _campos_patch(dados):
+    """Validates a PATCH body (column or PWA names) into {coluna: valor}. Raises ValueError with the reason."""
+    colunas = set(_colunas_importaveis()) - {'uid'}
+    campos = {}
+    for chave, valor in dados.items():
+        coluna = CAMPOS_PWA.get(chave, chave)
+        if coluna not in colunas:
+            raise ValueError(f'Campo desconhecido: {chave}')
+        try:
+            if coluna == 'valor_honorarios':
+                valor = _parse_valor(valor)
+            elif valor in ('', None):
+                valor = None
+            elif coluna in COLUNAS_DATA:
+                valor = _parse_data(valor)
+            elif not isinstance(valor, str):
+                raise ValueError
+        except (TypeError, ValueError):
+            raise ValueError(f'Valor inválido para {coluna}: {valor!r}')
+        if valor is None and coluna in COLUNAS_NAO_NULAS:
+            raise ValueError(f'Campo obrigatório: {coluna}')
+        campos[coluna] = valor
+    return campos
+
+@bp.route('/api/pericia/<int:id>', methods=['PATCH'])
+def atualizar_pericia_api(id):
+    """Autosave: writes only the fields sent, if the client's versao is still the current one.
+
+    Body: {"versao": 3, "anamnese": "<p>...</p>", ...}. The UPDATE sets just the changed
+    columns (and laudo_secao rows); 409 with the server's record when someone saved in between.
+    """
+    dados = request.get_json(silent=True)
+    if not isinstance(dados, dict):
+        return jsonify({'error': 'Body must be a JSON object'}), 400
+    versao = dados.pop('versao', None)
+    if not isinstance(versao, int) or isinstance(versao, bool):
+        return jsonify({'error': 'versao is required'}), 400
+    try:
+        campos = _campos_patch(dados)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    pericia = _pericia_ativa(Pericia.query.options(selectinload(Pericia.secoes)), id)
+    if pericia.versao != versao:
+        return jsonify({'error': 'Conflict', 'versao': pericia.versao, 'servidor': _registro_sync(pericia)}), 409
+
+    status_anterior = pericia.status
+    for coluna, valor in campos.items():
+        setattr(pericia, coluna, valor)
+    if not db.session.is_modified(pericia):
+        return jsonify({'id': pericia.id, 'versao': pericia.versao})
+
+    try:
+        db.session.flush()
+    except StaleDataError:
+        # Saved by someone else between our read and the UPDATE
+        db.session.rollback()
+        pericia = Pericia.query.options(selectinload(Pericia.secoes)).filter_by(id=id).first_or_404()
+        return jsonify({'error': 'Conflict', 'versao': pericia.versao, 'servidor': _registro_sync(pericia)}), 409
+    nova_versao = pericia.versao
+    # Only finalized laudos have cached output; drafts are rendered on every view
+    if 'Concluido' in (status_anterior, pericia.status):
+        _fila().enfileirar('invalidar_laudo', {'pericia_id': id}, chave=f'invalidar_laudo:{id}',
+                           prioridade=jobs.PRIORIDADE_BAIXA)
+    db.session.commit()
+    return jsonify({'id': id, 'versao': nova_versao})
 
-        data_nasc = request.form.get('data_nascimento')
-        if data_nasc:
+# --- Bulk Import / Export ---
+
+# PWA (static/js/modules/models.js) field names accepted alongside the column names
+CAMPOS_PWA = {
+    'numeroProcesso': 'numero_processo',
+    'nomeAutor': 'nome_autor',
+    'dataPericia': 'data_pericia',
+    'tipoAcao': 'tipo_acao',
+    'dataNascimento': 'data_nascimento',
+    'estadoCivil': 'estado_civil',
+    'exameFisico': 'exame_fisico',
+    'valorHonorarios': 'valor_honorarios',
+    'statusPagamento': 'status_pagamento',
+    'createdAt': 'created_at',
+}
+
+COLUNAS_DATA = {'data_pericia', 'data_nascimento', 'created_at'}
+
+# Maintained by the server; never taken from imported or synced records
+COLUNAS_CONTROLE = {'id', 'versao', 'sync_seq', 'atualizado_em', 'extras'}
+
+def _colunas_importaveis():
+    return [c.name for c in Pericia.__table__.columns if c.name not in COLUNAS_CONTROLE] + list(SECOES_LAUDO)
+
+def _extras_importacao(registro, colunas):
+    """JSON with the record fields that have no column, so PWA-only data survives a round trip."""
+    extras = {}
+    if isinstance(registro.get('extras'), str):
+        try:
+            extras.update(json.loads(registro['extras']))
+        except ValueError:
+            pass
+    for chave, valor in registro.items():
+        if chave in COLUNAS_CONTROLE or CAMPOS_PWA.get(chave, chave) in colunas:
+            continue
+        extras[chave] = valor
+    return json.dumps(extras, ensure_ascii=False) if extras else None
+
+def _parse_data(valor):
+    """Accepts ISO dates/datetimes (as the PWA stores them) and dd/mm/yyyy (spreadsheets)."""
+    if not valor:
+        return None
+    valor = str(valor).strip()
+    if re.fullmatch(r'\d{2}/\d{2}/\d{4}', valor):
+        return datetime.strptime(valor, '%d/%m/%Y')
+    return datetime.fromisoformat(valor.replace('Z', '+00:00')).replace(tzinfo=None)
+
+def _parse_valor(valor):
+    if valor in (None, ''):
+        return 0.0
+    if isinstance(valor, str):
+        valor = valor.replace('R$', '').strip()
+        if ',' in valor: # 1.500,50
+            valor = valor.replace('.', '').replace(',', '.')
+    return float(valor)
+
+def _linha_importacao(registro, colunas):
+    """Validates one imported record and returns the row to insert. Raises ValueError with the reason."""
+    if not isinstance(registro, dict):
+        raise ValueError('Registro deve ser um objeto')
+
+    campos = dict(registro)
+    endereco = campos.pop('endereco', None)
+    if isinstance(endereco, dict):
+        for campo in ('cep', 'cidade', 'uf'):
+            campos.setdefault(f'endereco_{campo}', endereco.get(campo))
+
+    linha = {}
+    for chave, valor in campos.items():
+        coluna = CAMPOS_PWA.get(chave, chave)
+        if coluna not in colunas or coluna in linha or valor in ('', None):
+            continue
+        try:
+            if coluna in COLUNAS_DATA:
+                valor = _parse_data(valor)
+            elif coluna == 'valor_honorarios':
+                valor = _parse_valor(valor)
+        except (TypeError, ValueError):
+            raise ValueError(f'Valor inválido para {coluna}: {valor!r}')
+        linha[coluna] = valor
+
+    for obrigatorio in ('numero_processo', 'nome_autor'):
+        if not linha.get(obrigatorio):
+            raise ValueError(f'Campo obrigatório ausente: {obrigatorio}')
+
+    linha.setdefault('status', 'Agendado' if linha.get('data_pericia') else 'Aguardando')
+    linha.setdefault('status_pagamento', 'Pendente')
+    linha.setdefault('valor_honorarios', 0.0)
+    linha.setdefault('created_at', datetime.utcnow())
+    linha.setdefault('uid', uuid.uuid4().hex)
+    # executemany needs the same keys on every row
+    linha = {coluna: linha.get(coluna) for coluna in colunas}
+    linha['extras'] = _extras_importacao(registro, colunas)
+    return linha
+
+def _ler_registros(formato):
+    """Yields (line number, record or exception) from the request body without reading it all at once."""
+    texto = io.TextIOWrapper(request.stream, encoding='utf-8-sig', newline='')
+    if formato == 'csv':
+        primeira = texto.readline()
+        delimitador = ';' if primeira.count(';') > primeira.count(',') else ','
+        leitor = csv.DictReader(texto, fieldnames=next(csv.reader([primeira], delimiter=delimitador)), delimiter=delimitador)
+        for numero, registro in enumerate(leitor, start=2):
+            yield numero, registro
+    else:
+        for numero, linha in enumerate(texto, start=1):
+            if not linha.strip():
+                continue
             try:
-                pericia.data_nascimento = datetime.strptime(data_nasc, '%Y-%m-%d')
-            except:
-                pass
+                yield numero, json.loads(linha)
+            except ValueError as e:
+                yield numero, ValueError(f'JSON inválido: {e}')
+
+def _inserir_lote(lote, erros):
+    """Inserts a batch with one executemany; on failure retries row by row to report the offending rows."""
+    linhas = [linha for _, linha in lote]
+
+    # Bulk inserts skip before_insert, so the change-feed positions are reserved here
+    contadores = ['sync', 'resumo', 'agenda'] if any(linha.get('data_pericia') for linha in linhas) else ['sync', 'resumo']
+    ultimo = _reservar_sequencias(db.session.connection(), contadores, len(linhas))['sync']
+    agora = datetime.utcnow()
+    for posicao, linha in enumerate(linhas, start=ultimo - len(linhas) + 1):
+        linha['sync_seq'] = posicao
+        linha['atualizado_em'] = agora
+
+    def colunas_pericia(linha):
+        return {coluna: valor for coluna, valor in linha.items() if coluna not in SECOES_LAUDO}
+
+    try:
+        with db.session.begin_nested():
+            ids = db.session.scalars(
+                db.insert(Pericia).returning(Pericia.id, sort_by_parameter_order=True), [colunas_pericia(l) for l in linhas]
+            ).all()
+        inseridas = list(zip(linhas, ids))
+    except SQLAlchemyError:
+        inseridas = []
+        for numero, linha in lote:
+            try:
+                with db.session.begin_nested():
+                    pk = db.session.scalars(db.insert(Pericia).returning(Pericia.id), [colunas_pericia(linha)]).one()
+                inseridas.append((linha, pk))
+            except SQLAlchemyError as e:
+                erros.append({'linha': numero, 'erro': str(getattr(e, 'orig', None) or e)})
+
+    deltas, secoes = {}, []
+    for linha, pk in inseridas:
+        linha['id'] = pk
+        chave = _chave_financeira(linha.get('data_pericia'), linha.get('created_at') or agora,
+                                  linha.get('tipo_acao'), linha.get('status_pagamento'))
+        _acumular(deltas, chave, 1, linha.get('valor_honorarios'))
+        secoes += _linhas_secoes(pk, linha)
+    if secoes:
+        db.session.execute(db.insert(LaudoSecao), secoes)
+    _indexar_lote(db.session.connection(), [linha for linha, _ in inseridas])
+    _somar_resumos(db.session.connection(), deltas)
+    return len(inseridas)
+
+@bp.route('/api/pericias/bulk', methods=['POST'])
+@orcamento_consultas(None) # A few statements per batch of BULK_BATCH_SIZE rows
+def importar_pericias_api():
+    request.max_content_length = current_app.config['BULK_MAX_CONTENT_LENGTH']
+    formato = 'csv' if request.mimetype in ('text/csv', 'application/csv') or request.args.get('format') == 'csv' else 'ndjson'
+    colunas = _colunas_importaveis()
+    tamanho_lote = current_app.config['BULK_BATCH_SIZE']
+
+    inseridos = 0
+    erros = []
+    lote = []
+
+    # Every batch goes into the same transaction; only valid rows are inserted
+    try:
+        for numero, registro in _ler_registros(formato):
+            try:
+                if isinstance(registro, Exception):
+                    raise registro
+                lote.append((numero, _linha_importacao(registro, colunas)))
+            except ValueError as e:
+                erros.append({'linha': numero, 'erro': str(e)})
+                continue
+
+            if len(lote) >= tamanho_lote:
+                inseridos += _inserir_lote(lote, erros)
+                lote = []
+
+        if lote:
+            inseridos += _inserir_lote(lote, erros)
+        db.session.commit()
+    except UnicodeDecodeError:
+        db.session.rollback()
+        return jsonify({'error': 'Body must be UTF-8'}), 400
+
+    return jsonify({'inseridos': inseridos, 'erros': erros})
+
+def _valor_exportacao(valor):
+    return valor.isoformat() if isinstance(valor, datetime) else valor
+
+def _linhas_exportacao(query, colunas, lote=500):
+    """Streams export rows as dicts; the laudo sections of each chunk come from one laudo_secao query."""
+    # yield_per streams rows from the cursor in chunks instead of loading the whole table
+    rows = iter(query.with_entities(*colunas).order_by(Pericia.id).yield_per(lote))
+    while True:
+        bloco = list(itertools.islice(rows, lote))
+        if not bloco:
+            return
+        secoes = _secoes_por_pericia(db.session.connection(), [row.id for row in bloco])
+        for row in bloco:
+            laudo = secoes.get(row.id, {})
+            yield {**{c.name: v for c, v in zip(colunas, row)}, **{secao: laudo.get(secao) for secao in SECOES_LAUDO}}
+
+@bp.route('/api/pericias/export')
+def exportar_pericias_api():
+    formato = request.args.get('format', 'ndjson')
+    colunas = list(Pericia.__table__.columns)
+    query = _filtrar_pericias(request.args.get('search'), request.args.get('status'))
+    rows = _linhas_exportacao(query, colunas)
+    nomes = [c.name for c in colunas] + list(SECOES_LAUDO)
+
+    def gerar_ndjson():
+        for row in rows:
+            yield json.dumps({nome: _valor_exportacao(v) for nome, v in row.items()}, ensure_ascii=False) + '\n'
+
+    def gerar_csv():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(nomes)
+        for row in rows:
+            writer.writerow([_valor_exportacao(row[nome]) for nome in nomes])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    if formato == 'csv':
+        response = Response(stream_with_context(gerar_csv()), mimetype='text/csv')
+    else:
+        response = Response(stream_with_context(gerar_ndjson()), mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = f'attachment; filename=pericias.{formato}'
+    return response
+
+@bp.route('/pericia/<int:id>/delete')
+@orcamento_consultas(None) # The cascade deletes each documento (and updates its blob) separately
+def deletar_pericia(id):
+    pericia = _pericia_ativa(Pericia.query, id)
+    if pericia.documents:
+        _fila().enfileirar('remover_blobs_orfaos', chave='remover_blobs_orfaos')
+    _fila().enfileirar('invalidar_laudo', {'pericia_id': id})
+    db.session.delete(pericia)
+    db.session.commit()
+    return redirect(url_for('main.index'))
+
+# --- Sync (PWA <-> backend) ---
+# Every Pericia write and delete takes the next value of the 'sync' counter.
+# Clients pull everything after their cursor and push their own changes with
+# the versao they last saw; a different server versao is reported as a conflict.
+
+def _registro_sync(p):
+    registro = json.loads(p.extras) if p.extras else {}
+    for coluna in _colunas_importaveis():
+        valor = getattr(p, coluna)
+        if coluna in ('data_pericia', 'data_nascimento') and valor:
+            valor = valor.date().isoformat() # The PWA stores plain dates
+        registro[coluna] = _valor_exportacao(valor)
+    registro['endereco'] = dict(registro.get('endereco') or {}, cep=p.endereco_cep or '', cidade=p.endereco_cidade or '', uf=p.endereco_uf or '')
+    registro['id'] = p.uid
+    registro['versao'] = p.versao
+    del registro['uid']
+    return registro
+
+@bp.after_app_request
+def _cors_sync(response):
+    # Endpoints the PWA calls from its own origin
+    if request.path in ('/api/sync', '/api/cid', '/api/agenda') and current_app.config['SYNC_ALLOWED_ORIGIN']:
+        response.headers['Access-Control-Allow-Origin'] = current_app.config['SYNC_ALLOWED_ORIGIN']
+        response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+        response.headers['Access-Control-Allow-Methods'] = 'GET, POST'
+    return response
+
+@bp.route('/api/sync')
+def sync_pull_api():
+    since = request.args.get('since', 0, type=int)
+    limit = max(1, min(request.args.get('limit', current_app.config['SYNC_PAGE_SIZE'], type=int), current_app.config['SYNC_PAGE_SIZE']))
+
+    alterados = (Pericia.query.options(selectinload(Pericia.secoes))
+                 .filter(Pericia.sync_seq > since).order_by(Pericia.sync_seq).limit(limit).all())
+    removidos = PericiaRemovida.query.filter(PericiaRemovida.sync_seq > since).order_by(PericiaRemovida.sync_seq).limit(limit).all()
+
+    # Merge both feeds by position and cut at the page size
+    eventos = sorted([(p.sync_seq, p) for p in alterados] + [(r.sync_seq, r) for r in removidos], key=lambda e: e[0])
+    has_more = len(eventos) > limit or len(alterados) == limit or len(removidos) == limit
+    eventos = eventos[:limit]
+
+    return jsonify({
+        'changes': [_registro_sync(obj) for _, obj in eventos if isinstance(obj, Pericia)],
+        'deleted': [obj.uid for _, obj in eventos if isinstance(obj, PericiaRemovida)],
+        'cursor': eventos[-1][0] if eventos else since,
+        'has_more': has_more
+    })
+
+@bp.route('/api/sync', methods=['POST'])
+@orcamento_consultas(None) # Each applied change is its own savepoint and UPDATE
+def sync_push_api():
+    dados = request.get_json(silent=True) or {}
+    colunas = _colunas_importaveis()
+    aplicados, conflitos, erros = [], [], []
+
+    # Every record the batch touches, in one query each for pericias, documents and laudo sections
+    uids = [str(r.get('id') or '') for r in (dados.get('changes') or []) + (dados.get('deleted') or []) if isinstance(r, dict)]
+    # A client changing an archived pericia brings it back
+    _desarquivar(select(PericiaArquivada.id).where(PericiaArquivada.uid.in_(set(uids))))
+    existentes = {p.uid: p for p in Pericia.query.options(selectinload(Pericia.documents), selectinload(Pericia.secoes))
+                  .filter(Pericia.uid.in_(set(uids)))}
+
+    for registro in dados.get('changes') or []:
+        uid = str(registro.get('id') or '') if isinstance(registro, dict) else ''
+        if not uid:
+            erros.append({'id': None, 'erro': 'Registro sem id'})
+            continue
+
+        pericia = existentes.get(uid)
+        base = registro.get('versao')
+        if pericia is None and base:
+            conflitos.append({'id': uid, 'motivo': 'removido', 'servidor': None})
+            continue
+        if pericia is not None and base != pericia.versao:
+            conflitos.append({'id': uid, 'motivo': 'versao', 'servidor': _registro_sync(pericia)})
+            continue
 
-        # Textos
-        pericia.objetivo = request.form.get('objetivo')
-        pericia.metodologia = request.form.get('metodologia')
-        pericia.anamnese = request.form.get('anamnese')
-        pericia.antecedentes = request.form.get('antecedentes')
-        pericia.exame_fisico = request.form.get('exame_fisico')
-        pericia.discussao = request.form.get('discussao')
-        pericia.conclusao = request.form.get('conclusao')
-        pericia.quesitos = request.form.get('quesitos')
-        pericia.bibliografia = request.form.get('bibliografia')
-
-        # Outros campos
-        pericia.cpf = request.form.get('cpf')
-        pericia.rg = request.form.get('rg')
-        pericia.profissao = request.form.get('profissao')
-        pericia.endereco_cidade = request.form.get('endereco_cidade')
-        pericia.endereco_uf = request.form.get('endereco_uf')
-
-        # Financeiro
         try:
-            pericia.valor_honorarios = float(request.form.get('valor_honorarios', 0.0))
-        except:
-             pericia.valor_honorarios = 0.0
+            linha = _linha_importacao(registro, colunas)
+        except ValueError as e:
+            erros.append({'id': uid, 'erro': str(e)})
+            continue
+        linha['uid'] = uid
+
+        try:
+            with db.session.begin_nested():
+                if pericia is None:
+                    pericia = Pericia(**linha)
+                    db.session.add(pericia)
+                    existentes[uid] = pericia
+                else:
+                    for coluna, valor in linha.items():
+                        setattr(pericia, coluna, valor)
+        except StaleDataError:
+            # Someone else updated the row between our read and the UPDATE
+            db.session.refresh(pericia)
+            conflitos.append({'id': uid, 'motivo': 'versao', 'servidor': _registro_sync(pericia)})
+            continue
+        except SQLAlchemyError as e:
+            erros.append({'id': uid, 'erro': str(getattr(e, 'orig', None) or e)})
+            continue
+        aplicados.append({'id': uid, 'versao': pericia.versao})
+
+    removeu = False
+    for item in dados.get('deleted') or []:
+        uid = str(item.get('id') or '') if isinstance(item, dict) else ''
+        pericia = existentes.get(uid)
+        if pericia is None:
+            aplicados.append({'id': uid, 'versao': None}) # Already gone
+            continue
+        if item.get('versao') != pericia.versao:
+            conflitos.append({'id': uid, 'motivo': 'versao', 'servidor': _registro_sync(pericia)})
+            continue
+        with db.session.begin_nested():
+            db.session.delete(pericia)
+        removeu = True
+        aplicados.append({'id': uid, 'versao': None})
 
-        pericia.status_pagamento = request.form.get('status_pagamento', 'Pendente')
+    if removeu:
+        _fila().enfileirar('remover_blobs_orfaos', chave='remover_blobs_orfaos')
+    db.session.commit()
+
+    return jsonify({'applied': aplicados, 'conflicts': conflitos, 'errors': erros})
+
+# --- Document Storage (content-addressed blobs) ---
+
+BLOCO_STREAM = 64 * 1024
+
+def _caminho_parcial(nome):
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], '.partial', nome)
+
+def _copiar_stream(stream, destino, hasher, limite=None):
+    """Copies a stream to an open file in fixed-size blocks, feeding the hasher. Returns bytes written."""
+    total = 0
+    while True:
+        bloco = stream.read(BLOCO_STREAM)
+        if not bloco:
+            return total
+        total += len(bloco)
+        if limite is not None and total > limite:
+            raise ValueError('File too large')
+        hasher.update(bloco)
+        destino.write(bloco)
 
+def _guardar_blob(caminho_tmp, sha256, size, original_name):
+    """Moves a fully written temp file into the blob store, or discards it if the content is already stored."""
+    blob = Blob.query.filter_by(sha256=sha256).first()
+    if blob and os.path.exists(os.path.join(current_app.config['UPLOAD_FOLDER'], blob.filename)):
+        os.remove(caminho_tmp)
+        return blob
 
-        if 'finalizar' in request.form:
-            pericia.status = 'Concluido'
-        elif pericia.status == 'Aguardando' or pericia.status == 'Agendado':
-            pericia.status = 'Em Andamento'
+    extensao = os.path.splitext(original_name)[1].lower()
+    filename = f"{sha256}{extensao}"
+    os.replace(caminho_tmp, os.path.join(current_app.config['UPLOAD_FOLDER'], filename))
 
+    if blob:
+        # Row survived but the file went missing; the new bytes restore it
+        blob.filename = filename
+        db.session.flush()
+        return blob
+    blob = Blob(sha256=sha256, filename=filename, size=size)
+    db.session.add(blob)
+    try:
+        db.session.flush()
+    except IntegrityError:
+        # The same content, uploaded at the same time, got its row in first; both wrote identical bytes.
+        # Nothing else is pending in the upload routes, so the whole transaction can go.
+        db.session.rollback()
+        blob = Blob.query.filter_by(sha256=sha256).one()
+    return blob
+
+def _remover_blobs_orfaos():
+    orfaos = Blob.query.filter(Blob.ref_count <= 0).all()
+    for blob in orfaos:
+        # Re-checked in the DELETE so a concurrent upload that just reused the blob keeps it
+        removido = db.session.execute(db.delete(Blob).where(Blob.id == blob.id, Blob.ref_count <= 0)).rowcount
         db.session.commit()
-        return redirect(url_for('index'))
+        if removido:
+            caminho = os.path.join(current_app.config['UPLOAD_FOLDER'], blob.filename)
+            thumbnails.remover_miniaturas(caminho)
+            try:
+                os.remove(caminho)
+            except OSError:
+                pass
 
-    return render_template('form_pericia.html', pericia=pericia, macros=macros)
+def _criar_documento(pericia, blob, original_name):
+    doc = Documento(filename=blob.filename, original_name=original_name, pericia_id=pericia.id, blob_id=blob.id)
+    db.session.add(doc)
+    db.session.commit()
+    return doc
 
-@app.route('/api/pericia/<int:id>/upload', methods=['POST'])
+# --- Thumbnails / Previews ---
+
+_derivacoes = None
+
+def _executor_derivacoes():
+    global _derivacoes
+    if _derivacoes is None:
+        _derivacoes = ProcessPoolExecutor(max_workers=current_app.config['THUMBNAIL_WORKERS'])
+    return _derivacoes
+
+def _agendar_miniaturas(filename):
+    """Queues thumbnail generation as a background job; the request does not wait for it."""
+    caminho = os.path.abspath(os.path.join(current_app.config['UPLOAD_FOLDER'], filename))
+    if not thumbnails.suporta(caminho):
+        return False
+    if not all(os.path.exists(thumbnails.caminho_miniatura(caminho, t)) for t in thumbnails.TAMANHOS):
+        _fila().enfileirar('miniaturas', {'filename': filename}, chave=f'miniaturas:{filename}')
+        db.session.commit()
+    return True
+
+# --- Background Jobs ---
+# Handlers may run more than once (retries, a worker dying mid-job): keep them idempotent.
+
+@bp.before_app_request
+def _iniciar_tarefas():
+    _fila().iniciar()
+
+@jobs.tarefa('miniaturas')
+def _tarefa_miniaturas(payload):
+    # CPU-heavy: rendered in the process pool, the job thread only waits for it
+    caminho = os.path.abspath(os.path.join(current_app.config['UPLOAD_FOLDER'], payload['filename']))
+    if os.path.exists(caminho):
+        _executor_derivacoes().submit(thumbnails.gerar_miniaturas, caminho).result()
+
+@jobs.tarefa('remover_arquivo')
+def _tarefa_remover_arquivo(payload):
+    caminho = os.path.join(current_app.config['UPLOAD_FOLDER'], payload['filename'])
+    thumbnails.remover_miniaturas(caminho)
+    try:
+        os.remove(caminho)
+    except FileNotFoundError:
+        pass
+
+@jobs.tarefa('remover_blobs_orfaos')
+def _tarefa_remover_blobs_orfaos(payload):
+    _remover_blobs_orfaos()
+
+@jobs.tarefa('invalidar_laudo')
+def _tarefa_invalidar_laudo(payload):
+    _invalidar_laudo(payload['pericia_id'])
+
+def _tarefa_json(t):
+    return {
+        'id': t.id,
+        'tipo': t.tipo,
+        'status': t.status,
+        'prioridade': t.prioridade,
+        'tentativas': t.tentativas,
+        'max_tentativas': t.max_tentativas,
+        'erro': t.erro,
+        'criada_em': t.criada_em.isoformat() if t.criada_em else None,
+        'disponivel_em': t.disponivel_em.isoformat() if t.disponivel_em else None,
+        'concluida_em': t.concluida_em.isoformat() if t.concluida_em else None,
+    }
+
+@bp.route('/api/tarefas/<int:id>')
+def status_tarefa_api(id):
+    return jsonify(_tarefa_json(Tarefa.query.get_or_404(id)))
+
+@bp.route('/api/tarefas')
+def listar_tarefas_api():
+    status = request.args.get('status')
+    query = Tarefa.query
+    if status:
+        query = query.filter_by(status=status)
+    tarefas = query.order_by(Tarefa.id.desc()).limit(100).all()
+    return jsonify([_tarefa_json(t) for t in tarefas])
+
+@bp.cli.command('tarefas')
+@click.option('--threads', default=2, show_default=True, help='Jobs run in parallel.')
+@click.option('--uma-vez', is_flag=True, help='Run the due jobs and exit.')
+def tarefas_command(threads, uma_vez):
+    """Runs background jobs (see jobs.py) in a dedicated process."""
+    fila = _fila()
+    if uma_vez:
+        print(f"{fila.executar_pendentes()} tarefa(s) executada(s).")
+        return
+    fila.iniciar(threads)
+    print(f"Executando tarefas com {threads} thread(s). Ctrl+C para sair.")
+    while True:
+        time.sleep(3600)
+
+# --- Backups ---
+
+def _caminho_banco():
+    """File of the SQLite database, or None when it is not a SQLite file (the online backup API needs one)."""
+    url = db.engine.url
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        return None
+    return url.database
+
+def _fazer_backup():
+    config = current_app.config
+    return backup.fazer_backup(_caminho_banco(), config['UPLOAD_FOLDER'], config['BACKUP_FOLDER'],
+                               paginas=config['BACKUP_PAGES'], pausa=config['BACKUP_PAUSE'], manter=config['BACKUP_KEEP'])
+
+@jobs.tarefa('backup')
+def _tarefa_backup(payload):
+    _fazer_backup()
+
+@bp.route('/api/backup', methods=['POST'])
+def backup_api():
+    """Queues a snapshot of the database and uploads; follow it at /api/tarefas/<id>."""
+    if _caminho_banco() is None:
+        return jsonify({'error': 'Online backup needs a SQLite database file; back up other databases with their own tools'}), 400
+    # Idempotent but long: a single attempt, and no second backup queued behind a waiting one
+    tarefa = _fila().enfileirar('backup', prioridade=jobs.PRIORIDADE_BAIXA, chave='backup', max_tentativas=1)
+    db.session.commit()
+    return jsonify(_tarefa_json(tarefa)), 202
+
+@bp.route('/api/backups')
+def listar_backups_api():
+    return jsonify(backup.listar(current_app.config['BACKUP_FOLDER']))
+
+@bp.cli.command('backup')
+def backup_command():
+    """Snapshots the database and uploads into BACKUP_FOLDER (see backup.py)."""
+    if _caminho_banco() is None:
+        raise click.ClickException('Online backup needs a SQLite database file.')
+    manifesto = _fazer_backup()
+    estatisticas = manifesto['estatisticas']
+    print(f"Snapshot {manifesto['nome']}: {estatisticas['arquivos']} arquivo(s), {estatisticas['objetos_novos']} novo(s), "
+          f"{estatisticas['bytes_copiados']} bytes copiados em {estatisticas['segundos']}s.")
+
+@bp.cli.command('restaurar')
+@click.argument('snapshot')
+@click.option('--verificar', is_flag=True, help='Only verify the snapshot.')
+def restaurar_command(snapshot, verificar):
+    """Restores a snapshot over the database and uploads. Stop the app first."""
+    if _caminho_banco() is None:
+        raise click.ClickException('Restore needs a SQLite database file.')
+    destino = current_app.config['BACKUP_FOLDER']
+    if verificar:
+        problemas = backup.verificar(destino, snapshot)
+        for problema in problemas:
+            print(problema)
+        if problemas:
+            raise click.ClickException(f'{len(problemas)} problema(s) em {snapshot}.')
+        print(f'{snapshot}: ok.')
+        return
+    db.engine.dispose()  # No pooled connection may outlive the file it read
+    try:
+        resultado = backup.restaurar(destino, snapshot, _caminho_banco(), current_app.config['UPLOAD_FOLDER'])
+    except ValueError as e:
+        raise click.ClickException(f'{snapshot} não foi restaurado: {e}')
+    print(f"{snapshot} restaurado: {resultado['restaurados']} de {resultado['arquivos']} arquivo(s) copiados.")
+
+# --- Archive ---
+# Concluded, paid pericias untouched for ARCHIVE_AFTER_DAYS leave pericia,
+# laudo_secao and documento for one pericia_arquivada row each: the listing
+# columns plus everything else in one compressed payload. They are moved
+# with Core statements, so no mapper event fires: the search index, the
+# financial rollups and the blob reference counts keep counting them.
+# pericia and documento ids are AUTOINCREMENT, so an archived pericia and
+# its documentos always come back under ids nobody else took.
+# Pages that only read (edit form, laudo, search, agenda) read through to
+# the archive; anything that writes brings the pericia back first.
+
+# Listing, search and agenda columns copied out of the payload
+COLUNAS_ARQUIVO = ('id', 'uid', 'numero_processo', 'nome_autor', 'data_pericia', 'status', 'tipo_acao',
+                   'valor_honorarios', 'status_pagamento', 'created_at', 'versao')
+
+def _codificar_arquivo(pericia, secoes, documentos):
+    dados = {'pericia': pericia, 'secoes': secoes, 'documentos': documentos}
+    return zlib.compress(json.dumps(dados, ensure_ascii=False, default=_valor_exportacao).encode('utf-8'), 9)
+
+def _ler_arquivo(dados):
+    """The payload of _codificar_arquivo() with its dates parsed; columns the tables no longer have are dropped."""
+    conteudo = json.loads(zlib.decompress(dados))
+
+    def linha(tabela, valores):
+        return {coluna.name: datetime.fromisoformat(valores[coluna.name])
+                if valores.get(coluna.name) and isinstance(coluna.type, db.DateTime) else valores.get(coluna.name)
+                for coluna in tabela.columns}
+
+    return {'pericia': linha(Pericia.__table__, conteudo['pericia']), 'secoes': conteudo['secoes'],
+            'documentos': [linha(Documento.__table__, doc) for doc in conteudo['documentos']]}
+
+def _arquivar_lote(conn, corte, lote):
+    """Archives up to lote pericias concluded, paid and untouched since corte. Returns how many."""
+    rows = conn.execute(
+        select(Pericia.__table__).where(
+            Pericia.status == 'Concluido', Pericia.status_pagamento == 'Pago',
+            func.coalesce(Pericia.atualizado_em, Pericia.created_at) < corte,
+        ).limit(lote)
+    ).mappings().all()
+    if not rows:
+        return 0
+    ids = [row['id'] for row in rows]
+    secoes = _secoes_por_pericia(conn, ids)
+    documentos = {}
+    for doc in conn.execute(select(Documento.__table__).where(Documento.pericia_id.in_(ids))).mappings():
+        documentos.setdefault(doc['pericia_id'], []).append(dict(doc))
+
+    agora = datetime.utcnow()
+    conn.execute(db.insert(PericiaArquivada), [
+        {**{coluna: row[coluna] for coluna in COLUNAS_ARQUIVO}, 'num_documentos': len(documentos.get(row['id'], ())),
+         'arquivada_em': agora, 'dados': _codificar_arquivo(dict(row), secoes.get(row['id'], {}), documentos.get(row['id'], []))}
+        for row in rows
+    ])
+    conn.execute(db.delete(LaudoSecao).where(LaudoSecao.pericia_id.in_(ids)))
+    conn.execute(db.delete(Documento).where(Documento.pericia_id.in_(ids)))
+    # Only the versions copied: a pericia saved in the meantime rolls the batch back
+    removidas = conn.execute(db.delete(Pericia).where(
+        tuple_(Pericia.id, Pericia.versao).in_([(row['id'], row['versao']) for row in rows]))).rowcount
+    if removidas != len(rows):
+        raise RuntimeError('Perícias alteradas durante o arquivamento; rode de novo')
+    _reservar_sequencias(conn, ['arquivo', 'resumo'])
+    return len(rows)
+
+def arquivar(dias=None, lote=None, pausa=0.0):
+    """Moves every archivable pericia into the archive, one transaction per batch. Returns how many."""
+    config = current_app.config
+    corte = datetime.utcnow() - timedelta(days=config['ARCHIVE_AFTER_DAYS'] if dias is None else dias)
+    total = 0
+    while True:
+        with db.engine.begin() as conn:
+            movidas = _arquivar_lote(conn, corte, lote or config['ARCHIVE_BATCH_SIZE'])
+        total += movidas
+        if not movidas:
+            return total
+        if pausa:
+            time.sleep(pausa)
+
+def _desarquivar(ids):
+    """Moves archived pericias back into the hot tables, in the session's transaction. Returns how many were archived."""
+    conn = db.session.connection()
+    arquivadas = conn.execute(select(PericiaArquivada.id, PericiaArquivada.dados).where(PericiaArquivada.id.in_(ids))).all()
+    if not arquivadas:
+        return 0
+    # A new place in the change feed: PWA clients that synced while it was archived never received it
+    ultimo = _reservar_sequencias(conn, ['sync', 'arquivo', 'resumo'], len(arquivadas))['sync']
+    pericias, secoes, documentos = [], [], []
+    for posicao, (pk, dados) in enumerate(arquivadas, start=ultimo - len(arquivadas) + 1):
+        conteudo = _ler_arquivo(dados)
+        pericias.append(dict(conteudo['pericia'], sync_seq=posicao))
+        secoes += _linhas_secoes(pk, conteudo['secoes'])
+        documentos += conteudo['documentos']
+    conn.execute(db.insert(Pericia), pericias)
+    if secoes:
+        conn.execute(db.insert(LaudoSecao), secoes)
+    if documentos:
+        conn.execute(db.insert(Documento), documentos)
+    conn.execute(db.delete(PericiaArquivada).where(PericiaArquivada.id.in_([pk for pk, _ in arquivadas])))
+    return len(arquivadas)
+
+def _pericia_ativa(query, id):
+    """The pericia from query by id, brought back from the archive first if needed: for routes that write to it."""
+    pericia = query.filter_by(id=id).first()
+    if pericia is None:
+        with fora_do_orcamento():
+            if not _desarquivar([id]):
+                abort(404)
+            pericia = query.filter_by(id=id).first_or_404()
+    return pericia
+
+def _pericia_do_arquivo(id):
+    """An archived pericia as a transient Pericia (with its laudo and documents) for read-only views, or None."""
+    arquivada = db.session.get(PericiaArquivada, id)
+    if arquivada is None:
+        return None
+    conteudo = _ler_arquivo(arquivada.dados)
+    pericia = Pericia(**conteudo['pericia'])
+    pericia.secoes = {secao: LaudoSecao(secao=secao, conteudo=texto.encode('utf-8'), compressao=None)
+                      for secao, texto in conteudo['secoes'].items()}
+    pericia.documents = [Documento(**doc) for doc in conteudo['documentos']]
+    return pericia
+
+@jobs.tarefa('arquivar')
+def _tarefa_arquivar(payload):
+    arquivar()
+
+@bp.route('/api/arquivar', methods=['POST'])
+def arquivar_api():
+    """Queues the archival of the pericias older than ARCHIVE_AFTER_DAYS; follow it at /api/tarefas/<id>."""
+    tarefa = _fila().enfileirar('arquivar', prioridade=jobs.PRIORIDADE_BAIXA, chave='arquivar')
+    db.session.commit()
+    return jsonify(_tarefa_json(tarefa)), 202
+
+@bp.cli.command('arquivar')
+@click.option('--dias', type=int, help='Archive pericias untouched this many days (default: ARCHIVE_AFTER_DAYS).')
+@click.option('--lote', type=int, help='Pericias per transaction (default: ARCHIVE_BATCH_SIZE).')
+@click.option('--pausa', default=0.0, show_default=True, help='Seconds to sleep between batches.')
+def arquivar_command(dias, lote, pausa):
+    """Moves concluded, paid pericias out of the hot tables into the archive."""
+    print(f"{arquivar(dias, lote, pausa)} perícia(s) arquivada(s).")
+
+def _documento_json(doc):
+    return {
+        'message': 'Success',
+        'id': doc.id,
+        'original_name': doc.original_name,
+        'url': url_for('main.uploaded_file', filename=doc.filename),
+        'delete_url': url_for('main.deletar_documento', pericia_id=doc.pericia_id, doc_id=doc.id)
+    }
+
+@bp.route('/api/pericia/<int:id>/upload', methods=['POST'])
 def upload_documento_api(id):
-    pericia = Pericia.query.get_or_404(id)
+    pericia = _pericia_ativa(Pericia.query, id)
 
     if 'upload_document' not in request.files:
         return jsonify({'error': 'No file'}), 400
@@ -207,52 +2069,372 @@ def upload_documento_api(id):
 
     if file:
         filename = secure_filename(file.filename)
-        unique_filename = f"{datetime.now().timestamp()}_{filename}"
-        file.save(os.path.join(app.config['UPLOAD_FOLDER'], unique_filename))
+        caminho_tmp = _caminho_parcial(uuid.uuid4().hex)
+        hasher = hashlib.sha256()
+        with open(caminho_tmp, 'wb') as destino:
+            size = _copiar_stream(file.stream, destino, hasher)
 
-        doc = Documento(filename=unique_filename, original_name=filename, pericia_id=pericia.id)
-        db.session.add(doc)
+        blob = _guardar_blob(caminho_tmp, hasher.hexdigest(), size, filename)
+        doc = _criar_documento(pericia, blob, filename)
+        _agendar_miniaturas(doc.filename)
+        return jsonify(_documento_json(doc))
+
+# --- Resumable Chunked Uploads ---
+# The client opens a session, PUTs raw chunks with an Upload-Offset header and
+# completes it. GET on the session returns the stored offset so an interrupted
+# upload resumes where it stopped.
+
+# Running SHA-256 per session, with how many bytes it has seen, so completing does
+# not re-read the file. It is only trusted while that count matches the file: a chunk
+# handled by another worker (or before a restart) leaves it behind, and the file is
+# then hashed on completion.
+_upload_hashers = {}
+
+def _hasher_upload(upload_id, offset):
+    """The session's running hash if it has seen exactly the first offset bytes, else None (dropped)."""
+    hasher, vistos = _upload_hashers.get(upload_id, (None, None))
+    if vistos != offset:
+        _upload_hashers.pop(upload_id, None)
+        return None
+    return hasher
+
+def _sessao_upload(upload_id):
+    if not re.fullmatch(r'[0-9a-f]{32}', upload_id):
+        return None
+    try:
+        with open(_caminho_parcial(upload_id + '.json')) as f:
+            sessao = json.load(f)
+    except FileNotFoundError:
+        return None
+    sessao['offset'] = os.path.getsize(_caminho_parcial(upload_id))
+    return sessao
+
+def _descartar_sessao(upload_id):
+    _upload_hashers.pop(upload_id, None)
+    for nome in (upload_id, upload_id + '.json'):
+        try:
+            os.remove(_caminho_parcial(nome))
+        except OSError:
+            pass
+
+def _agendar_expiracao_uploads():
+    """Queues a sweep of abandoned sessions unless one is already waiting; it requeues itself while any remain."""
+    _fila().enfileirar('expirar_uploads', chave='expirar_uploads',
+                       atraso=current_app.config['UPLOAD_SESSION_MAX_AGE_HOURS'] * 3600)
+
+@jobs.tarefa('expirar_uploads')
+def _tarefa_expirar_uploads(payload):
+    # Sessions the client never completed or cancelled, and temp files of uploads cut short;
+    # every chunk touches the data file, so its mtime is the session's last activity
+    limite = time.time() - current_app.config['UPLOAD_SESSION_MAX_AGE_HOURS'] * 3600
+    ativas = 0
+    for upload_id in {nome.removesuffix('.json') for nome in os.listdir(_caminho_parcial(''))}:
+        if not re.fullmatch(r'[0-9a-f]{32}', upload_id):
+            continue
+        try:
+            tocada = max(os.path.getmtime(_caminho_parcial(nome)) for nome in (upload_id, upload_id + '.json')
+                         if os.path.exists(_caminho_parcial(nome)))
+        except ValueError:
+            continue  # Completed in the meantime
+        if tocada < limite:
+            _descartar_sessao(upload_id)
+        else:
+            ativas += 1
+    if ativas:
+        _agendar_expiracao_uploads()
         db.session.commit()
 
-        return jsonify({
-            'message': 'Success',
-            'id': doc.id,
-            'original_name': doc.original_name,
-            'url': url_for('uploaded_file', filename=doc.filename),
-            'delete_url': url_for('deletar_documento', pericia_id=pericia.id, doc_id=doc.id)
-        })
+@bp.route('/api/pericia/<int:id>/uploads', methods=['POST'])
+def iniciar_upload_api(id):
+    # Only checked here; an archived pericia comes back when the upload completes
+    if db.session.get(Pericia, id) is None and db.session.get(PericiaArquivada, id) is None:
+        abort(404)
+    dados = request.get_json(silent=True) or {}
+
+    filename = secure_filename(dados.get('filename') or '')
+    if not filename:
+        return jsonify({'error': 'No filename'}), 400
+
+    size = dados.get('size')
+    if size is not None and (not isinstance(size, int) or size < 0 or size > current_app.config['UPLOAD_MAX_FILE_SIZE']):
+        return jsonify({'error': 'Invalid size'}), 400
+
+    upload_id = uuid.uuid4().hex
+    with open(_caminho_parcial(upload_id + '.json'), 'w') as f:
+        json.dump({'pericia_id': id, 'original_name': filename, 'size': size}, f)
+    open(_caminho_parcial(upload_id), 'wb').close()
+    _upload_hashers[upload_id] = (hashlib.sha256(), 0)
+    _agendar_expiracao_uploads()
+    db.session.commit()
+
+    return jsonify({
+        'upload_id': upload_id,
+        'offset': 0,
+        'chunk_size': current_app.config['UPLOAD_CHUNK_SIZE'],
+        'upload_url': url_for('main.enviar_parte_upload_api', upload_id=upload_id),
+        'complete_url': url_for('main.concluir_upload_api', upload_id=upload_id)
+    }), 201
+
+@bp.route('/api/uploads/<upload_id>', methods=['GET'])
+def status_upload_api(upload_id):
+    sessao = _sessao_upload(upload_id)
+    if sessao is None:
+        return jsonify({'error': 'Unknown upload'}), 404
+    return jsonify({'upload_id': upload_id, 'offset': sessao['offset'], 'size': sessao['size']})
+
+@bp.route('/api/uploads/<upload_id>', methods=['PUT'])
+def enviar_parte_upload_api(upload_id):
+    sessao = _sessao_upload(upload_id)
+    if sessao is None:
+        return jsonify({'error': 'Unknown upload'}), 404
+
+    offset = request.headers.get('Upload-Offset', type=int)
+    if offset != sessao['offset']:
+        # Client is out of step (e.g. a retried chunk); tell it where to resume
+        return jsonify({'error': 'Offset mismatch', 'offset': sessao['offset']}), 409
+
+    limite = current_app.config['UPLOAD_MAX_FILE_SIZE'] - offset
+    if request.content_length and request.content_length > min(limite, current_app.config['UPLOAD_CHUNK_SIZE']):
+        return jsonify({'error': 'Chunk too large', 'offset': offset}), 413
 
-@app.route('/pericia/<int:pericia_id>/documento/<int:doc_id>/delete')
+    hasher = _hasher_upload(upload_id, offset)
+    if hasher is None and offset == 0:
+        hasher = hashlib.sha256()
+
+    with open(_caminho_parcial(upload_id), 'ab') as destino:
+        try:
+            escritos = _copiar_stream(request.stream, destino, hasher or hashlib.sha256(), limite)
+        except ValueError:
+            destino.truncate(offset)
+            _upload_hashers.pop(upload_id, None)
+            return jsonify({'error': 'File too large', 'offset': offset}), 413
+    if hasher is not None:
+        _upload_hashers[upload_id] = (hasher, offset + escritos)
+
+    return jsonify({'upload_id': upload_id, 'offset': offset + escritos})
+
+@bp.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def cancelar_upload_api(upload_id):
+    if _sessao_upload(upload_id) is None:
+        return jsonify({'error': 'Unknown upload'}), 404
+    _descartar_sessao(upload_id)
+    return jsonify({'message': 'Cancelled'})
+
+@bp.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+def concluir_upload_api(upload_id):
+    sessao = _sessao_upload(upload_id)
+    if sessao is None:
+        return jsonify({'error': 'Unknown upload'}), 404
+    if sessao['size'] is not None and sessao['offset'] != sessao['size']:
+        return jsonify({'error': 'Upload incomplete', 'offset': sessao['offset']}), 409
+
+    pericia = _pericia_ativa(Pericia.query, sessao['pericia_id'])
+    caminho_tmp = _caminho_parcial(upload_id)
+
+    hasher = _hasher_upload(upload_id, sessao['offset'])
+    if hasher is None:
+        hasher = hashlib.sha256()
+        with open(caminho_tmp, 'rb') as origem:
+            for bloco in iter(lambda: origem.read(BLOCO_STREAM), b''):
+                hasher.update(bloco)
+
+    blob = _guardar_blob(caminho_tmp, hasher.hexdigest(), sessao['offset'], sessao['original_name'])
+    doc = _criar_documento(pericia, blob, sessao['original_name'])
+    _descartar_sessao(upload_id)
+    _agendar_miniaturas(doc.filename)
+    return jsonify(_documento_json(doc))
+
+@bp.route('/pericia/<int:pericia_id>/documento/<int:doc_id>/delete')
 def deletar_documento(pericia_id, doc_id):
-    doc = Documento.query.get_or_404(doc_id)
+    doc = db.session.get(Documento, doc_id)
+    if doc is None:
+        _pericia_ativa(Pericia.query, pericia_id)  # Its documents were archived with it
+        doc = Documento.query.get_or_404(doc_id)
     if doc.pericia_id != pericia_id:
-        return redirect(url_for('index')) # Security check
+        return redirect(url_for('main.index')) # Security check
 
-    try:
-        os.remove(os.path.join(app.config['UPLOAD_FOLDER'], doc.filename))
-    except:
-        pass # Ignore if file doesn't exist
+    if doc.blob_id is None:
+        _fila().enfileirar('remover_arquivo', {'filename': doc.filename})
+    else:
+        # Shared blobs are only removed once no Documento references them
+        _fila().enfileirar('remover_blobs_orfaos', chave='remover_blobs_orfaos')
 
     db.session.delete(doc)
     db.session.commit()
-    return redirect(url_for('editar_pericia', id=pericia_id))
+    return redirect(url_for('main.editar_pericia', id=pericia_id))
 
-@app.route('/uploads/<filename>')
+# Content hashes of legacy (non-blob) uploads, keyed by path and validated by mtime/size
+_etag_cache = {}
+
+def _etag_upload(filename, caminho):
+    # Blob files are named <sha256><ext>, so the lookup goes through the sha256 index
+    sha256 = os.path.splitext(filename)[0]
+    blob = Blob.query.filter_by(sha256=sha256, filename=filename).with_entities(Blob.sha256).first()
+    if blob:
+        return blob.sha256
+
+    stat = os.stat(caminho)
+    chave = (stat.st_mtime_ns, stat.st_size)
+    cached = _etag_cache.get(caminho)
+    if cached and cached[0] == chave:
+        return cached[1]
+
+    hasher = hashlib.sha256()
+    with open(caminho, 'rb') as f:
+        for bloco in iter(lambda: f.read(BLOCO_STREAM), b''):
+            hasher.update(bloco)
+    _etag_cache[caminho] = (chave, hasher.hexdigest())
+    return _etag_cache[caminho][1]
+
+@bp.route('/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    # Resolved like the upload routes, which write relative to the working directory
+    caminho = safe_join(os.path.abspath(current_app.config['UPLOAD_FOLDER']), filename)
+    if caminho is None or filename.startswith('.') or not os.path.isfile(caminho):
+        abort(404)
 
-@app.route('/pericia/<int:id>/ver')
-def ver_laudo(id):
-    pericia = Pericia.query.get_or_404(id)
+    etag = _etag_upload(filename, caminho)
+    accel = current_app.config['UPLOADS_ACCEL_REDIRECT']
+    if accel:
+        # The proxy serves the bytes (and Range); we only answer the conditional part
+        response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = accel.rstrip('/') + '/' + filename
+        response.set_etag(etag)
+        response.make_conditional(request)
+    else:
+        # conditional=True answers If-None-Match with 304 and Range with 206
+        response = send_file(caminho, etag=etag, conditional=True, max_age=current_app.config['UPLOADS_MAX_AGE'])
+
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['UPLOADS_MAX_AGE']
+    response.cache_control.immutable = True
+    return response
+
+@bp.route('/uploads/<int:id>/thumb/<int:size>')
+def miniatura_documento(id, size):
+    doc = Documento.query.get_or_404(id)
+    if size not in thumbnails.TAMANHOS:
+        abort(404)
+
+    caminho = os.path.abspath(os.path.join(current_app.config['UPLOAD_FOLDER'], doc.filename))
+    miniatura = thumbnails.caminho_miniatura(caminho, size)
+    if not os.path.exists(miniatura):
+        if not os.path.exists(caminho) or not _agendar_miniaturas(doc.filename):
+            abort(404)
+        response = jsonify({'status': 'pending'})
+        response.status_code = 202
+        response.headers['Retry-After'] = '2'
+        return response
+
+    etag = f"{_etag_upload(doc.filename, caminho)}-{size}"
+    response = send_file(miniatura, etag=etag, conditional=True, max_age=current_app.config['UPLOADS_MAX_AGE'])
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+# --- Laudo Output Cache ---
+# Finalized laudos are rendered once per (id, versao) and kept on disk as HTML
+# and, when WeasyPrint is installed, PDF. Any write bumps versao, so a stale
+# file can never be served; editar_pericia also drops the old files right away.
+
+def _pasta_laudo(pericia_id):
+    # One folder per pericia, so dropping its old versions never lists the whole cache
+    return os.path.join(current_app.config['LAUDO_CACHE_FOLDER'], str(pericia_id))
+
+def _caminho_laudo(pericia_id, versao, extensao):
+    return os.path.join(_pasta_laudo(pericia_id), f"{versao}.{extensao}")
+
+def _invalidar_laudo(pericia_id, manter_versao=None):
+    pasta = _pasta_laudo(pericia_id)
+    try:
+        nomes = os.listdir(pasta)
+    except FileNotFoundError:
+        return
+    for nome in nomes:
+        if not nome.startswith(f"{manter_versao}."):
+            try:
+                os.remove(os.path.join(pasta, nome))
+            except OSError:
+                pass
+
+def _gravar_laudo(caminho, conteudo):
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    parcial = f"{caminho}.{uuid.uuid4().hex}.tmp"
+    with open(parcial, 'wb') as f:
+        f.write(conteudo)
+    os.replace(parcial, caminho)
+
+def _renderizar_laudo(pericia):
     return render_template('print_laudo.html', pericia=pericia)
 
+def _laudo_em_cache(pericia, extensao, gerar):
+    """Path of the cached output for this pericia version, generating it on first use."""
+    caminho = _caminho_laudo(pericia.id, pericia.versao, extensao)
+    if not os.path.exists(caminho):
+        _invalidar_laudo(pericia.id, manter_versao=pericia.versao)
+        _gravar_laudo(caminho, gerar())
+    return caminho
+
+def _enviar_laudo(caminho, pericia_id, versao, mimetype):
+    # The HTML is compressed once, next to the cached file, and goes away with it
+    response = compression.enviar_arquivo(caminho, mimetype, f"laudo-{pericia_id}-{versao}")
+    # Same URL, new content after an edit: always revalidate, usually a 304
+    response.cache_control.no_cache = True
+    return response
+
+def _pericia_com_laudo(id):
+    pericia = Pericia.query.options(selectinload(Pericia.secoes)).filter_by(id=id).first() or _pericia_do_arquivo(id)
+    if pericia is None:
+        abort(404)
+    return pericia
+
+def _versao_laudo(id):
+    # Two-column lookup; the full row is only loaded when the cache has to be filled
+    row = db.session.query(Pericia.versao, Pericia.status).filter(Pericia.id == id).first()
+    if row is None:
+        row = db.session.query(PericiaArquivada.versao, PericiaArquivada.status).filter(PericiaArquivada.id == id).first()
+    if row is None:
+        abort(404)
+    return row
+
+@bp.route('/pericia/<int:id>/ver')
+def ver_laudo(id):
+    versao, status = _versao_laudo(id)
+    if status != 'Concluido':
+        # Drafts change all the time; not worth caching
+        return _renderizar_laudo(_pericia_com_laudo(id))
+
+    caminho = _caminho_laudo(id, versao, 'html')
+    if not os.path.exists(caminho):
+        pericia = _pericia_com_laudo(id)
+        caminho = _laudo_em_cache(pericia, 'html', lambda: _renderizar_laudo(pericia).encode('utf-8'))
+        versao = pericia.versao
+    return _enviar_laudo(caminho, id, versao, 'text/html; charset=utf-8')
+
+@bp.route('/pericia/<int:id>/laudo.pdf')
+def laudo_pdf(id):
+    if WeasyHTML is None:
+        return jsonify({'error': 'PDF export unavailable: install weasyprint'}), 501
+
+    versao, status = _versao_laudo(id)
+    caminho = _caminho_laudo(id, versao, 'pdf')
+    if status == 'Concluido' and os.path.exists(caminho):
+        return _enviar_laudo(caminho, id, versao, 'application/pdf')
+
+    pericia = _pericia_com_laudo(id)
+    gerar = lambda: WeasyHTML(string=_renderizar_laudo(pericia), base_url=request.url_root).write_pdf()
+    if status != 'Concluido':
+        return Response(gerar(), mimetype='application/pdf')
+
+    caminho = _laudo_em_cache(pericia, 'pdf', gerar)
+    return _enviar_laudo(caminho, id, pericia.versao, 'application/pdf')
+
 # --- Macros Routes ---
-@app.route('/macros')
+@bp.route('/macros')
 def listar_macros():
-    macros = Macro.query.all()
-    return render_template('macros.html', macros=macros)
+    return render_template('macros.html', macros=_macros_em_cache()['todas'])
 
-@app.route('/macros/nova', methods=['POST'])
+@bp.route('/macros/nova', methods=['POST'])
 def nova_macro():
     titulo = request.form['titulo']
     categoria = request.form['categoria']
@@ -261,19 +2443,45 @@ def nova_macro():
     nova = Macro(titulo=titulo, categoria=categoria, conteudo=conteudo)
     db.session.add(nova)
     db.session.commit()
-    return redirect(url_for('listar_macros'))
+    return redirect(url_for('main.listar_macros'))
 
-@app.route('/macros/<int:id>/delete')
+@bp.route('/macros/<int:id>/delete')
 def deletar_macro(id):
     macro = Macro.query.get_or_404(id)
     db.session.delete(macro)
     db.session.commit()
-    return redirect(url_for('listar_macros'))
+    return redirect(url_for('main.listar_macros'))
+
+def _serializar_macros(itens):
+    corpo = current_app.json.dumps([{'id': m['id'], 'titulo': m['titulo'], 'conteudo': m['conteudo']} for m in itens])
+    return corpo, hashlib.sha1(corpo.encode()).hexdigest()
+
+def _macros_em_cache():
+    """All macros plus the JSON (and its ETag) of each category, rebuilt when the 'macros' counter moves."""
+    versao = db.session.scalar(select(Contador.valor).where(Contador.nome == 'macros')) or 0
+    estado = _estado()
+    if estado['macros'] is None or estado['macros'][0] != versao:
+        todas = [{'id': m.id, 'titulo': m.titulo, 'categoria': m.categoria, 'conteudo': m.conteudo}
+                 for m in Macro.query.order_by(Macro.id)]
+        categorias = {}
+        for m in todas:
+            categorias.setdefault(m['categoria'], []).append(m)
+        estado['macros'] = (versao, {
+            'todas': todas,
+            'json': {categoria: _serializar_macros(itens) for categoria, itens in categorias.items()},
+            'vazia': _serializar_macros([]),
+        })
+    return estado['macros'][1]
 
-@app.route('/api/macros/<categoria>')
+@bp.route('/api/macros/<categoria>')
 def get_macros_by_category(categoria):
-    macros = Macro.query.filter_by(categoria=categoria).all()
-    return jsonify([{'id': m.id, 'titulo': m.titulo, 'conteudo': m.conteudo} for m in macros])
+    cache = _macros_em_cache()
+    corpo, etag = cache['json'].get(categoria, cache['vazia'])
+    response = Response(corpo, mimetype='application/json')
+    response.set_etag(etag)
+    # Clients revalidate every time and get a bodyless 304 while the category is unchanged
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
+    create_app().run(debug=True, port=5000)
@@ -0,0 +1,266 @@
+"""
+Online backups of the SQLite database and the upload folder.
+
+    flask --app app backup                  # or POST /api/backup, run as a background job
+    flask --app app restaurar <snapshot> [--verificar]
+
+Every backup is a snapshot directory; uploads go to an object store shared
+by all snapshots:
+
+    BACKUP_FOLDER/
+        objetos/ab/<sha256>          each upload's content, stored once
+        snapshots/<YYYYMMDDTHHMMSSZ>/
+            database.db              consistent copy made with SQLite's online backup API
+            manifest.json            the copy's sha256; upload path -> sha256, size, mtime
+
+The database is copied `paginas` pages per step, sleeping `pausa` seconds
+between steps, so writers get the lock in between (in WAL mode they are not
+blocked at all). If another connection writes mid-copy SQLite starts over,
+so the copy is always a consistent snapshot.
+
+Uploads are copied only when their content is not in the store yet. Blob
+files are named after their sha256, so an unchanged one is not even read;
+other files are hashed again only when their size or mtime differs from the
+previous manifest. Thumbnails and partial uploads are derived or transient
+and left out.
+
+A snapshot is written under a temporary name and renamed when complete.
+Restore first verifies it (database hash and integrity_check, the hash of
+every object) and writes nothing if any check fails.
+"""
+import contextlib
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: concurrent backups into one folder are not guarded
+    fcntl = None
+
+BLOCO = 1024 * 1024
+MANIFESTO = 'manifest.json'
+BANCO = 'database.db'
+
+_SHA256 = re.compile(r'^([0-9a-f]{64})(\.[^./]*)?$')
+_DERIVADO = re.compile(r'\.thumb\d+\.jpg$')
+
+
+def _sha256(caminho):
+    hasher = hashlib.sha256()
+    with open(caminho, 'rb') as f:
+        while bloco := f.read(BLOCO):
+            hasher.update(bloco)
+    return hasher.hexdigest()
+
+
+def _objeto(destino, sha256):
+    return os.path.join(destino, 'objetos', sha256[:2], sha256)
+
+
+def _snapshots(destino):
+    pasta = os.path.join(destino, 'snapshots')
+    if not os.path.isdir(pasta):
+        return []
+    return sorted(nome for nome in os.listdir(pasta) if not nome.startswith('.'))
+
+
+def ler_manifesto(destino, nome):
+    with open(os.path.join(destino, 'snapshots', nome, MANIFESTO), encoding='utf-8') as f:
+        return json.load(f)
+
+
+@contextlib.contextmanager
+def _travado(destino):
+    """One backup, prune or restore at a time per BACKUP_FOLDER, across processes."""
+    os.makedirs(destino, exist_ok=True)
+    with open(os.path.join(destino, '.lock'), 'w') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def copiar_banco(origem, destino, paginas=1024, pausa=0.0):
+    """Copies a live SQLite database with the online backup API, into a standalone (non-WAL) file."""
+    fonte = sqlite3.connect(origem)
+    copia = sqlite3.connect(destino)
+    try:
+        # The sleep in progress() happens between steps, when the copy holds no lock on the source
+        fonte.backup(copia, pages=paginas, progress=lambda status, restantes, total: time.sleep(pausa) if pausa else None)
+        copia.execute('PRAGMA journal_mode=DELETE')
+    finally:
+        copia.close()
+        fonte.close()
+
+
+def _guardar_objeto(destino, caminho):
+    """Copies a file into the object store under its sha256, hashed while copying. Returns (sha256, bytes copied)."""
+    temporario = os.path.join(destino, 'objetos', f'.{os.getpid()}.tmp')
+    os.makedirs(os.path.dirname(temporario), exist_ok=True)
+    hasher = hashlib.sha256()
+    with open(caminho, 'rb') as origem, open(temporario, 'wb') as copia:
+        while bloco := origem.read(BLOCO):
+            hasher.update(bloco)
+            copia.write(bloco)
+    sha256 = hasher.hexdigest()
+    final = _objeto(destino, sha256)
+    if os.path.exists(final):
+        os.remove(temporario)
+        return sha256, 0
+    os.makedirs(os.path.dirname(final), exist_ok=True)
+    os.replace(temporario, final)
+    return sha256, os.path.getsize(final)
+
+
+def _arquivos_upload(uploads):
+    for raiz, pastas, arquivos in os.walk(uploads):
+        pastas[:] = [p for p in pastas if not p.startswith('.')]  # .partial
+        for nome in arquivos:
+            if not nome.startswith('.') and not _DERIVADO.search(nome):
+                caminho = os.path.join(raiz, nome)
+                yield os.path.relpath(caminho, uploads).replace(os.sep, '/'), caminho
+
+
+def fazer_backup(banco, uploads, destino, paginas=1024, pausa=0.0, manter=None):
+    """Takes a snapshot of banco and uploads into destino. Returns its manifest."""
+    inicio = time.monotonic()
+    with _travado(destino):
+        anteriores = _snapshots(destino)
+        anterior = ler_manifesto(destino, anteriores[-1])['uploads'] if anteriores else {}
+
+        base = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+        nome, n = base, 1
+        while nome in anteriores:  # Two backups within a second
+            nome, n = f'{base}-{n}', n + 1
+        temporario = os.path.join(destino, 'snapshots', f'.{nome}.tmp')
+        shutil.rmtree(temporario, ignore_errors=True)
+        os.makedirs(temporario)
+
+        copia = os.path.join(temporario, BANCO)
+        copiar_banco(banco, copia, paginas, pausa)
+
+        arquivos, novos, copiados = {}, 0, 0
+        for relativo, caminho in _arquivos_upload(uploads):
+            try:
+                stat = os.stat(caminho)
+                info = anterior.get(relativo)
+                casado = _SHA256.match(os.path.basename(relativo))
+                if info and (info['tamanho'], info['mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+                    sha256 = info['sha256']
+                else:
+                    sha256 = casado.group(1) if casado else None
+                if sha256 is None or not os.path.exists(_objeto(destino, sha256)):
+                    sha256, tamanho = _guardar_objeto(destino, caminho)
+                    novos += bool(tamanho)
+                    copiados += tamanho
+            except FileNotFoundError:
+                continue  # Removed while the backup ran
+            arquivos[relativo] = {'sha256': sha256, 'tamanho': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+        manifesto = {
+            'nome': nome,
+            'criado_em': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'banco': {'arquivo': BANCO, 'sha256': _sha256(copia), 'tamanho': os.path.getsize(copia)},
+            'uploads': arquivos,
+            'estatisticas': {
+                'arquivos': len(arquivos),
+                'objetos_novos': novos,
+                'bytes_copiados': copiados,
+                'segundos': round(time.monotonic() - inicio, 3),
+            },
+        }
+        with open(os.path.join(temporario, MANIFESTO), 'w', encoding='utf-8') as f:
+            json.dump(manifesto, f, indent=1, sort_keys=True)
+        os.replace(temporario, os.path.join(destino, 'snapshots', nome))
+
+        if manter:
+            _podar(destino, manter)
+    return manifesto
+
+
+def _podar(destino, manter):
+    """Removes all but the newest `manter` snapshots, then the objects none of the kept ones uses."""
+    snapshots = _snapshots(destino)
+    for nome in snapshots[:-manter]:
+        shutil.rmtree(os.path.join(destino, 'snapshots', nome))
+    usados = {info['sha256'] for nome in snapshots[-manter:] for info in ler_manifesto(destino, nome)['uploads'].values()}
+    pasta = os.path.join(destino, 'objetos')
+    for prefixo in os.listdir(pasta) if os.path.isdir(pasta) else ():
+        if len(prefixo) != 2:
+            continue
+        for sha256 in os.listdir(os.path.join(pasta, prefixo)):
+            if sha256 not in usados:
+                os.remove(os.path.join(pasta, prefixo, sha256))
+
+
+def listar(destino):
+    """Manifests of every complete snapshot, oldest first, without the per-file listing."""
+    resumos = []
+    for nome in _snapshots(destino):
+        manifesto = ler_manifesto(destino, nome)
+        manifesto.pop('uploads')
+        resumos.append(manifesto)
+    return resumos
+
+
+def verificar(destino, nome):
+    """Problems found in a snapshot: an empty list means it restores as recorded."""
+    if nome not in _snapshots(destino):
+        return [f'snapshot {nome} não encontrado']
+    manifesto = ler_manifesto(destino, nome)
+    problemas = []
+
+    copia = os.path.join(destino, 'snapshots', nome, manifesto['banco']['arquivo'])
+    if not os.path.exists(copia) or _sha256(copia) != manifesto['banco']['sha256']:
+        problemas.append(f"{manifesto['banco']['arquivo']}: sha256 diferente do manifesto")
+    else:
+        conexao = sqlite3.connect(f'file:{copia}?mode=ro', uri=True)
+        try:
+            resultado = [row[0] for row in conexao.execute('PRAGMA integrity_check')]
+        finally:
+            conexao.close()
+        if resultado != ['ok']:
+            problemas.append(f"{manifesto['banco']['arquivo']}: integrity_check: {'; '.join(resultado[:5])}")
+
+    verificados = set()
+    for relativo, info in sorted(manifesto['uploads'].items()):
+        if info['sha256'] in verificados:
+            continue
+        objeto = _objeto(destino, info['sha256'])
+        if not os.path.exists(objeto):
+            problemas.append(f'{relativo}: objeto {info["sha256"]} ausente')
+        elif _sha256(objeto) != info['sha256']:
+            problemas.append(f'{relativo}: objeto {info["sha256"]} corrompido')
+        else:
+            verificados.add(info['sha256'])
+    return problemas
+
+
+def restaurar(destino, nome, banco, uploads):
+    """Restores a verified snapshot over banco and into uploads; raises ValueError, writing nothing, if it fails verification."""
+    with _travado(destino):
+        problemas = verificar(destino, nome)
+        if problemas:
+            raise ValueError('; '.join(problemas))
+        manifesto = ler_manifesto(destino, nome)
+
+        # Through the backup API as well, so a database file that still has a WAL is replaced consistently
+        copiar_banco(os.path.join(destino, 'snapshots', nome, manifesto['banco']['arquivo']), banco)
+
+        restaurados = 0
+        for relativo, info in manifesto['uploads'].items():
+            caminho = os.path.join(uploads, *relativo.split('/'))
+            if os.path.exists(caminho) and os.path.getsize(caminho) == info['tamanho'] and _sha256(caminho) == info['sha256']:
+                continue
+            os.makedirs(os.path.dirname(caminho), exist_ok=True)
+            shutil.copyfile(_objeto(destino, info['sha256']), caminho + '.restaurando')
+            os.replace(caminho + '.restaurando', caminho)
+            # Same mtime as when backed up, so the next backup does not hash it again
+            os.utime(caminho, ns=(info['mtime_ns'], info['mtime_ns']))
+            restaurados += 1
+    return {'banco': manifesto['banco'], 'arquivos': len(manifesto['uploads']), 'restaurados': restaurados}
@@ -0,0 +1,185 @@
+"""
+CID-10 typeahead index, built once per process and kept in memory.
+
+Loaded from CSV files separated by ';' with a DESCRICAO column and the code
+in SUBCAT, CAT or CODIGO: the DATASUS tables (CID-10-CATEGORIAS.CSV and
+CID-10-SUBCATEGORIAS.CSV, codes without the dot, latin-1) work as they come.
+data/cid10.csv is a small seed with the codes most common in pericias;
+point CID10_FILES at the DATASUS tables for all ~14k entries.
+
+Everything is in sorted lists searched with bisect:
+
+  - codes without the dot, so "m545", "M54.5" and "M54" are prefix lookups
+  - the distinct words of the accent-folded descriptions, each with the
+    sorted ranks of the entries using it ("lomb" finds "lombar", "lombalgia")
+  - one-character deletions of those words (a SymSpell-style index), for
+    typos: "lonbar" reaches "lombar" through the shared deletion "lobar"
+
+Code matches come first, in code order. Every query word must then match a
+description word by prefix or, when it has no prefix match, within one edit.
+An entry's rank is fixed at load time (shortest descriptions first), so the
+postings of the most selective query word are merged in rank order and the
+search stops as soon as it has enough entries: a query costs about the same
+whether it matches ten entries or ten thousand.
+"""
+import bisect
+import csv
+import heapq
+import io
+import os
+import re
+import unicodedata
+from array import array
+
+# The seed shipped in the repository, used when CID10_FILES is not set
+AMOSTRA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'cid10.csv')
+
+MAXIMO = '\U0010ffff'
+_CODIGO = re.compile(r'^[a-z](\d|$)')  # "m" lists chapter M rather than every word starting with m
+
+
+def dobrar(texto):
+    """Lowercase without accents: "Síndrome" -> "sindrome"."""
+    decomposto = unicodedata.normalize('NFKD', texto)
+    return ''.join(c for c in decomposto if not unicodedata.combining(c)).lower()
+
+
+def _chave_codigo(codigo):
+    return re.sub(r'[^0-9a-z]', '', dobrar(codigo))
+
+
+def _com_ponto(codigo):
+    # DATASUS writes subcategories as "M545"
+    codigo = codigo.strip().upper()
+    if '.' not in codigo and len(codigo) > 3:
+        codigo = f'{codigo[:3]}.{codigo[3:]}'
+    return codigo
+
+
+def _delecoes(palavra):
+    return {palavra[:i] + palavra[i + 1:] for i in range(len(palavra))}
+
+
+def ler_csv(caminho):
+    """(code, description) pairs from one CID-10 CSV file."""
+    with open(caminho, 'rb') as f:
+        dados = f.read()
+    try:
+        texto = dados.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        texto = dados.decode('latin-1')
+    leitor = csv.DictReader(io.StringIO(texto), delimiter=';')
+    coluna = next((c for c in ('SUBCAT', 'CAT', 'CODIGO') if c in (leitor.fieldnames or ())), None)
+    if coluna is None or 'DESCRICAO' not in leitor.fieldnames:
+        raise ValueError(f'{caminho}: expected a SUBCAT, CAT or CODIGO column and DESCRICAO')
+    for linha in leitor:
+        if linha[coluna] and linha['DESCRICAO']:
+            yield _com_ponto(linha[coluna]), linha['DESCRICAO'].strip()
+
+
+class Indice:
+    def __init__(self, entradas):
+        unicas = {}
+        for codigo, descricao in entradas:
+            unicas.setdefault(codigo, descricao)
+        ordenadas = sorted(unicas.items(), key=lambda e: _chave_codigo(e[0]))
+
+        self.codigos = [codigo for codigo, _ in ordenadas]
+        self.descricoes = [descricao for _, descricao in ordenadas]
+        self._chaves = [_chave_codigo(codigo) for codigo in self.codigos]  # Sorted, like the ids
+        self._palavras = [tuple(re.findall(r'\w+', dobrar(d))) for d in self.descricoes]
+
+        # Ranks order the entries for description matches; postings hold ranks
+        self._por_rank = array('I', sorted(range(len(self.codigos)),
+                                           key=lambda id: (len(self._palavras[id]), len(self.descricoes[id]), id)))
+        rank = array('I', bytes(4 * len(self._por_rank)))
+        for posicao, id in enumerate(self._por_rank):
+            rank[id] = posicao
+
+        usos = {}
+        for id, palavras in enumerate(self._palavras):
+            for palavra in set(palavras):
+                usos.setdefault(palavra, []).append(rank[id])
+        self._vocabulario = sorted(usos)
+        self._postings = [array('I', sorted(usos[palavra])) for palavra in self._vocabulario]
+        self._acumulado = array('I', [0])  # Postings before each vocabulary position, to size a prefix range
+        for postings in self._postings:
+            self._acumulado.append(self._acumulado[-1] + len(postings))
+
+        delecoes = {}
+        for posicao, palavra in enumerate(self._vocabulario):
+            if len(palavra) >= 4:
+                for variante in _delecoes(palavra) | {palavra}:
+                    delecoes.setdefault(variante, []).append(posicao)
+        self._delecoes = {variante: tuple(posicoes) for variante, posicoes in delecoes.items()}
+
+    def __len__(self):
+        return len(self.codigos)
+
+    def _faixa(self, lista, prefixo):
+        return bisect.bisect_left(lista, prefixo), bisect.bisect_left(lista, prefixo + MAXIMO)
+
+    def _aproximadas(self, termo):
+        """Vocabulary positions within one insertion, deletion, substitution or transposition of termo."""
+        posicoes = set()
+        for variante in _delecoes(termo) | {termo}:
+            posicoes.update(self._delecoes.get(variante, ()))
+        return sorted(posicoes)
+
+    def _termo(self, termo):
+        """(vocabulary positions, typo) for a query word: its prefix matches, else the words one edit away."""
+        inicio, fim = self._faixa(self._vocabulario, termo)
+        if inicio < fim:
+            return range(inicio, fim), False
+        return (self._aproximadas(termo) if len(termo) >= 4 else []), True
+
+    def _tamanho(self, posicoes):
+        if isinstance(posicoes, range):
+            return self._acumulado[posicoes.stop] - self._acumulado[posicoes.start]
+        return sum(len(self._postings[p]) for p in posicoes)
+
+    def _filtro(self, termo, posicoes, aproximado):
+        if aproximado:
+            palavras = {self._vocabulario[p] for p in posicoes}
+            return lambda id: any(palavra in palavras for palavra in self._palavras[id])
+        return lambda id: any(palavra.startswith(termo) for palavra in self._palavras[id])
+
+    def buscar(self, consulta, limite=10):
+        """Best matches for a typed query: a code prefix ("M54.", "m545") and/or description words."""
+        termos = re.findall(r'\w+', dobrar(consulta or ''))
+        if not termos:
+            return []
+        ids = []
+
+        chave = _chave_codigo(consulta)
+        if _CODIGO.match(chave):
+            inicio, fim = self._faixa(self._chaves, chave)
+            ids.extend(range(inicio, min(fim, inicio + limite)))
+
+        if len(ids) < limite:
+            # Exact words before typos; the word with the fewest entries drives the merge
+            casados = [(termo, *self._termo(termo)) for termo in termos]
+            if all(posicoes for _, posicoes, _ in casados):
+                casados.sort(key=lambda c: (c[2], self._tamanho(c[1])))
+                guia = casados[0][1]
+                filtros = [self._filtro(*c) for c in casados[1:]]
+                vistos = set(ids)
+                ranks = heapq.merge(*(self._postings[p] for p in guia)) if len(guia) > 1 \
+                    else iter(self._postings[guia[0]])
+                anterior = None
+                for rank in ranks:
+                    if rank == anterior:  # An entry with several words matching the prefix
+                        continue
+                    anterior = rank
+                    id = self._por_rank[rank]
+                    if id not in vistos and all(filtro(id) for filtro in filtros):
+                        ids.append(id)
+                        if len(ids) == limite:
+                            break
+
+        return [{'codigo': self.codigos[id], 'descricao': self.descricoes[id]} for id in ids]
+
+
+def carregar(caminhos):
+    """Builds the index from every file in caminhos (later files do not override earlier codes)."""
+    return Indice(entrada for caminho in caminhos for entrada in ler_csv(caminho))
@@ -0,0 +1,235 @@
+"""
+Response compression, negotiated from Accept-Encoding: brotli when the
+optional `brotli` package is installed, else gzip.
+
+  - dynamic responses (dashboard HTML, JSON APIs, laudo drafts) with a
+    textual mimetype and at least COMPRESS_MIN_BYTES are compressed per
+    request at a fast level; streamed ones (the exports) chunk by chunk
+  - responses with an ETag are fixed for that ETag, so their compressed
+    bytes are kept in an in-memory LRU of COMPRESS_CACHE_BYTES and served
+    from there on the next miss; their ETag is made weak, which conditional
+    requests (If-None-Match) still match
+  - files that never change under their name (finalized laudos in the laudo
+    cache, static assets) are compressed once at the highest level, on
+    first request, and sent from disk by enviar_arquivo()
+
+SemIndentacao strips the templates' indentation when they are loaded, so the
+rendered HTML carries no per-line whitespace at no cost per render.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+import uuid
+import zlib
+from collections import OrderedDict
+
+from flask import current_app, request, send_file
+from jinja2.ext import Extension
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # Optional: without it only gzip is offered
+    brotli = None
+
+MIMETYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'text/calendar', 'text/javascript',
+    'application/javascript', 'application/json', 'application/x-ndjson', 'application/xml', 'image/svg+xml',
+}
+SUFIXOS = {'br': 'br', 'gzip': 'gz'}
+
+# Dynamic responses: fast levels; files compressed once: the smallest output
+NIVEL_DINAMICO = {'br': 5, 'gzip': 6}
+NIVEL_MAXIMO = {'br': 11, 'gzip': 9}
+
+_PRESERVADO = re.compile(r'(<(pre|textarea)\b.*?</\2>)', re.S | re.I)
+
+
+def codificacoes():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negociar(accept_encodings):
+    """Best encoding the client accepts, or None for identity. Ties go to brotli."""
+    melhor, qualidade = None, 0
+    for codificacao in codificacoes():
+        q = accept_encodings.quality(codificacao)
+        if q > qualidade:
+            melhor, qualidade = codificacao, q
+    return melhor
+
+
+def comprimir(dados, codificacao, nivel=None):
+    if nivel is None:
+        nivel = NIVEL_DINAMICO[codificacao]
+    if codificacao == 'br':
+        return brotli.compress(dados, quality=nivel)
+    return gzip.compress(dados, compresslevel=nivel, mtime=0)
+
+
+def _fluxo(original, partes, codificacao):
+    """Compresses a streamed body, flushing after every chunk so the client still gets each one as it is produced."""
+    try:
+        if codificacao == 'br':
+            compressor = brotli.Compressor(quality=NIVEL_DINAMICO['br'])
+            for parte in partes:
+                saida = compressor.process(parte) + compressor.flush()
+                if saida:
+                    yield saida
+            yield compressor.finish()
+        else:
+            compressor = zlib.compressobj(NIVEL_DINAMICO['gzip'], zlib.DEFLATED, 31)  # 31: gzip container
+            for parte in partes:
+                saida = compressor.compress(parte) + compressor.flush(zlib.Z_SYNC_FLUSH)
+                if saida:
+                    yield saida
+            yield compressor.flush()
+    finally:
+        if hasattr(original, 'close'):
+            original.close()
+
+
+class CacheVariantes:
+    """LRU of compressed bodies by (path, ETag, encoding), bounded by their total size."""
+
+    def __init__(self, limite):
+        self.limite = limite
+        self.tamanho = 0
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obter(self, chave, gerar):
+        with self._lock:
+            if chave in self._itens:
+                self._itens.move_to_end(chave)
+                return self._itens[chave]
+        dados = gerar()
+        if len(dados) <= self.limite:
+            with self._lock:
+                if chave not in self._itens:
+                    self._itens[chave] = dados
+                    self.tamanho += len(dados)
+                    while self.tamanho > self.limite:
+                        _, removido = self._itens.popitem(last=False)
+                        self.tamanho -= len(removido)
+        return dados
+
+
+def _comprimivel(mimetype, tamanho=None):
+    config = current_app.config
+    return (config['COMPRESS_ENABLED'] and mimetype in MIMETYPES
+            and (tamanho is None or tamanho >= config['COMPRESS_MIN_BYTES']))
+
+
+def comprimir_resposta(response):
+    """after_request hook for the dynamic responses; registered first, so it runs after every other hook."""
+    if (response.direct_passthrough or 'Content-Encoding' in response.headers
+            or not 200 <= response.status_code < 300 or response.status_code in (204, 206)
+            or 'no-transform' in (response.headers.get('Cache-Control') or '')):
+        return response
+    if response.is_streamed:
+        if not _comprimivel(response.mimetype):
+            return response
+        response.vary.add('Accept-Encoding')
+        codificacao = negociar(request.accept_encodings)
+        if codificacao:
+            original = response.response
+            response.response = _fluxo(original, response.iter_encoded(), codificacao)
+            response.headers['Content-Encoding'] = codificacao
+            response.headers.pop('Content-Length', None)
+        return response
+
+    dados = response.get_data()
+    if not _comprimivel(response.mimetype, len(dados)):
+        return response
+    response.vary.add('Accept-Encoding')
+    codificacao = negociar(request.accept_encodings)
+    if codificacao is None:
+        return response
+
+    etag, fraca = response.get_etag()
+    if etag:
+        cache = current_app.extensions['compressao']
+        comprimido = cache.obter((request.path, etag, codificacao), lambda: comprimir(dados, codificacao))
+        if not fraca:
+            response.set_etag(etag, weak=True)  # Same content, other bytes than the identity representation
+    else:
+        comprimido = comprimir(dados, codificacao)
+    if len(comprimido) < len(dados):
+        response.set_data(comprimido)
+        response.headers['Content-Encoding'] = codificacao
+    return response
+
+
+def arquivo_comprimido(caminho, codificacao, pasta=None):
+    """
+    Path of a copy of caminho compressed at the highest level, made on first use.
+    Without a pasta it sits next to the file (which must never change under its
+    name) and goes away with it; with one, its name covers the file's size and mtime.
+    """
+    sufixo = SUFIXOS[codificacao]
+    if pasta is None:
+        destino = f'{caminho}.{sufixo}'
+    else:
+        stat = os.stat(caminho)
+        chave = hashlib.sha1(f'{os.path.abspath(caminho)}:{stat.st_size}:{stat.st_mtime_ns}'.encode()).hexdigest()
+        destino = os.path.join(pasta, f'{chave}.{sufixo}')
+    if not os.path.exists(destino):
+        with open(caminho, 'rb') as f:
+            dados = comprimir(f.read(), codificacao, NIVEL_MAXIMO[codificacao])
+        parcial = f'{destino}.{uuid.uuid4().hex}.tmp'
+        with open(parcial, 'wb') as f:
+            f.write(dados)
+        os.replace(parcial, destino)
+    return destino
+
+
+def enviar_arquivo(caminho, mimetype, etag, pasta=None, **kwargs):
+    """send_file() of caminho or, when the client accepts one, of its precompressed variant (with its own ETag)."""
+    codificacao = None
+    if _comprimivel(mimetype.split(';')[0], os.path.getsize(caminho)):
+        codificacao = negociar(request.accept_encodings)
+    if codificacao:
+        caminho, etag = arquivo_comprimido(caminho, codificacao, pasta), f'{etag}-{SUFIXOS[codificacao]}'
+    response = send_file(caminho, mimetype=mimetype, etag=etag, conditional=True, **kwargs)
+    if codificacao:
+        response.headers['Content-Encoding'] = codificacao
+    if _comprimivel(mimetype.split(';')[0]):
+        response.vary.add('Accept-Encoding')
+    return response
+
+
+def _static(app):
+    def enviar_static(filename):
+        caminho = safe_join(app.static_folder, filename)
+        mimetype = mimetypes.guess_type(filename)[0]
+        if caminho is None or not os.path.isfile(caminho) or not _comprimivel(mimetype):
+            return app.send_static_file(filename)
+        stat = os.stat(caminho)
+        return enviar_arquivo(caminho, mimetype, f'{stat.st_mtime_ns:x}-{stat.st_size:x}',
+                              pasta=app.config['COMPRESS_FOLDER'], max_age=app.get_send_file_max_age(filename))
+    return enviar_static
+
+
+class SemIndentacao(Extension):
+    """Removes the leading whitespace of every template line (outside <pre> and <textarea>) when a template is loaded."""
+
+    def preprocess(self, source, name, filename=None):
+        partes = _PRESERVADO.split(source)
+        # re.split with two groups: text, whole preserved block, tag name, text, ...
+        return ''.join(
+            re.sub(r'^[ \t]+', '', parte, flags=re.M) if i % 3 == 0 else (parte if i % 3 == 1 else '')
+            for i, parte in enumerate(partes)
+        )
+
+
+def instalar(app):
+    """Call before registering the blueprints: after_request hooks run in reverse order, so this one runs last."""
+    app.extensions['compressao'] = CacheVariantes(app.config['COMPRESS_CACHE_BYTES'])
+    os.makedirs(app.config['COMPRESS_FOLDER'], exist_ok=True)
+    app.after_request(comprimir_resposta)
+    if app.has_static_folder:
+        app.view_functions['static'] = _static(app)
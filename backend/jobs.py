@@ -0,0 +1,187 @@
+"""
+Durable background jobs, stored in the application database.
+
+Routes enqueue a job in the same transaction as the change that needs it
+(a deleted documento and the removal of its file commit together), and the
+HTTP response returns right away. Worker threads claim jobs by priority and
+age, run the registered handler and record the outcome:
+
+  - a failing job is retried with exponential backoff up to max_tentativas,
+    then kept as 'falhou' with the error for inspection (/api/tarefas)
+  - a job left 'executando' by a worker that died is requeued after
+    JOBS_TIMEOUT seconds, so handlers must be idempotent
+  - finished jobs are purged after JOBS_RETENTION_DAYS
+
+Each web process runs JOBS_WORKERS threads, started on its first request.
+With JOBS_WORKERS = 0 nothing runs in the web processes; run a dedicated
+worker instead:
+
+    flask --app app tarefas [--threads 2]
+"""
+import json
+import os
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+TAREFAS = {}
+
+PRIORIDADE_ALTA = -10
+PRIORIDADE_NORMAL = 0
+PRIORIDADE_BAIXA = 10
+
+PENDENTE, EXECUTANDO, CONCLUIDA, FALHOU = 'pendente', 'executando', 'concluida', 'falhou'
+
+
+def tarefa(tipo):
+    """Registers the handler of a job type. It receives the payload dict and runs inside an app context."""
+    def registrar(fn):
+        TAREFAS[tipo] = fn
+        return fn
+    return registrar
+
+
+class Fila:
+    def __init__(self, app, db, modelo):
+        self.app = app
+        self.db = db
+        self.modelo = modelo
+        self._acordar = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._ultima_manutencao = 0.0
+
+    def enfileirar(self, tipo, payload=None, prioridade=PRIORIDADE_NORMAL, chave=None, atraso=0, max_tentativas=None):
+        """Adds a job to the current session; it is queued when the caller commits.
+
+        With a chave, nothing is added while a job with the same chave is still waiting to run.
+        """
+        if tipo not in TAREFAS:
+            raise ValueError(f"Tarefa desconhecida: {tipo}")
+        Tarefa = self.modelo
+        sessao = self.db.session
+        if chave is not None:
+            existente = sessao.scalar(select(Tarefa).where(Tarefa.chave == chave, Tarefa.status == PENDENTE))
+            if existente is not None:
+                return existente
+
+        nova = Tarefa(
+            tipo=tipo, payload=json.dumps(payload or {}), prioridade=prioridade, chave=chave,
+            max_tentativas=max_tentativas or self.app.config['JOBS_MAX_ATTEMPTS'],
+            disponivel_em=datetime.utcnow() + timedelta(seconds=atraso),
+        )
+        sessao.add(nova)
+        # Wake this process' workers once the job is visible to them
+        self.db.event.listen(sessao(), 'after_commit', lambda s: self._acordar.set(), once=True)
+        return nova
+
+    def _engine(self):
+        # Worker threads run outside any app context
+        with self.app.app_context():
+            return self.db.engine
+
+    def _manutencao(self, agora):
+        Tarefa = self.modelo
+        with self._engine().begin() as conn:
+            conn.execute(self.db.update(Tarefa).where(
+                Tarefa.status == EXECUTANDO,
+                Tarefa.iniciada_em < agora - timedelta(seconds=self.app.config['JOBS_TIMEOUT'])
+            ).values(status=PENDENTE, disponivel_em=agora))
+            conn.execute(self.db.delete(Tarefa).where(
+                Tarefa.status == CONCLUIDA,
+                Tarefa.concluida_em < agora - timedelta(days=self.app.config['JOBS_RETENTION_DAYS'])
+            ))
+
+    def reservar(self):
+        """Claims the next due job for this worker. Returns (id, tipo, payload, tentativas) or None."""
+        Tarefa = self.modelo
+        engine = self._engine()
+        agora = datetime.utcnow()
+        if time.monotonic() - self._ultima_manutencao > 60:
+            self._ultima_manutencao = time.monotonic()
+            self._manutencao(agora)
+
+        while True:
+            # Read and claim in separate transactions: an idle poll never takes SQLite's write lock
+            with engine.connect() as conn:
+                proxima = conn.execute(
+                    select(Tarefa.id, Tarefa.tipo, Tarefa.payload, Tarefa.tentativas)
+                    .where(Tarefa.status == PENDENTE, Tarefa.disponivel_em <= agora)
+                    .order_by(Tarefa.prioridade, Tarefa.id).limit(1)
+                    .with_for_update(skip_locked=True)
+                ).first()
+            if proxima is None:
+                return None
+            # Guarded by the status, so two workers can never both claim it
+            with engine.begin() as conn:
+                reservada = conn.execute(self.db.update(Tarefa).where(
+                    Tarefa.id == proxima.id, Tarefa.status == PENDENTE
+                ).values(status=EXECUTANDO, iniciada_em=agora, tentativas=Tarefa.tentativas + 1)).rowcount
+            if reservada:
+                return proxima.id, proxima.tipo, json.loads(proxima.payload), proxima.tentativas + 1
+
+    def executar(self, id, tipo, payload, tentativas):
+        """Runs one claimed job and records the outcome. Returns whether it succeeded."""
+        Tarefa = self.modelo
+        engine = self._engine()
+        try:
+            with self.app.app_context():
+                TAREFAS[tipo](payload)
+        except Exception as e:
+            self.app.logger.warning(f"Tarefa {id} ({tipo}) falhou na tentativa {tentativas}: {e}")
+            with engine.begin() as conn:
+                maximo = conn.execute(select(Tarefa.max_tentativas).where(Tarefa.id == id)).scalar_one()
+                valores = {'erro': traceback.format_exc(limit=5)}
+                if tentativas >= maximo:
+                    valores.update(status=FALHOU, concluida_em=datetime.utcnow())
+                else:
+                    espera = min(2 ** tentativas, 3600)
+                    valores.update(status=PENDENTE, disponivel_em=datetime.utcnow() + timedelta(seconds=espera))
+                conn.execute(self.db.update(Tarefa).where(Tarefa.id == id).values(**valores))
+            return False
+
+        with engine.begin() as conn:
+            conn.execute(self.db.update(Tarefa).where(Tarefa.id == id).values(
+                status=CONCLUIDA, concluida_em=datetime.utcnow(), erro=None
+            ))
+        return True
+
+    def executar_pendentes(self, limite=None):
+        """Runs due jobs in the calling thread until the queue is empty. Returns how many ran."""
+        executadas = 0
+        while limite is None or executadas < limite:
+            reservada = self.reservar()
+            if reservada is None:
+                break
+            self.executar(*reservada)
+            executadas += 1
+        return executadas
+
+    def _trabalhar(self):
+        intervalo = self.app.config['JOBS_POLL_INTERVAL']
+        while True:
+            try:
+                reservada = self.reservar()
+            except Exception as e:  # e.g. "database is locked" under a long write; try again later
+                self.app.logger.warning(f"Fila de tarefas indisponível: {e}")
+                reservada = None
+            if reservada is None:
+                self._acordar.wait(intervalo)
+                self._acordar.clear()
+                continue
+            self.executar(*reservada)
+
+    def iniciar(self, threads=None):
+        """Starts the worker threads of this process (again after a fork, e.g. gunicorn --preload)."""
+        threads = self.app.config['JOBS_WORKERS'] if threads is None else threads
+        if not threads or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            for i in range(threads):
+                threading.Thread(target=self._trabalhar, name=f'tarefas-{i}', daemon=True).start()
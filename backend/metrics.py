@@ -0,0 +1,208 @@
+"""
+Request instrumentation, exposed in the Prometheus text format on /metrics.
+
+  - per route: latency, SQL statements, time spent in SQL and rows changed by
+    INSERT/UPDATE/DELETE (and returned by ORM queries, with METRICS_COUNT_SELECT_ROWS)
+  - per statement fingerprint (the SQL with literals and IN lists collapsed):
+    latency, plus the SQL itself as an info series
+  - per template: render time
+
+Statements slower than SLOW_QUERY_MS are logged with their parameters.
+
+Histograms live in memory, per process: with several WSGI workers each one
+exposes its own numbers, so scrape every worker (or let Prometheus sum them).
+Streamed responses (the CSV export) are measured up to their first byte.
+"""
+import bisect
+import functools
+import hashlib
+import re
+import threading
+import time
+
+from flask import before_render_template, current_app, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BUCKETS_SQL = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+BUCKETS_CONTAGEM = (0, 1, 2, 5, 10, 20, 50, 100, 500, 1000, 10000)
+
+_LITERAIS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_LISTAS = re.compile(r"\((?:\s*(?:\?|:\w+|%\(\w+\)s|%s)\s*,)+\s*(?:\?|:\w+|%\(\w+\)s|%s)\s*\)")
+_LISTAS_REPETIDAS = re.compile(r"\(\.\.\.\)(?:, \(\.\.\.\))+")
+
+
+@functools.lru_cache(maxsize=2048)
+def impressao(statement):
+    """(fingerprint, normalized SQL): the same statement with other literals or IN list sizes shares a fingerprint."""
+    sql = _LITERAIS.sub('?', ' '.join(statement.split()))
+    sql = _LISTAS_REPETIDAS.sub('(...)', _LISTAS.sub('(...)', sql))
+    return hashlib.sha1(sql.encode()).hexdigest()[:12], sql
+
+
+def _rotulos(nomes, valores):
+    def escapar(valor):
+        return str(valor).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+    return ','.join(f'{nome}="{escapar(valor)}"' for nome, valor in zip(nomes, valores))
+
+
+class Histograma:
+    def __init__(self, nome, ajuda, rotulos, buckets):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = rotulos
+        self.buckets = buckets
+        self.series = {}  # label values -> [count per bucket..., +Inf count, sum]
+
+    def observar(self, valores, valor):
+        serie = self.series.get(valores)
+        if serie is None:
+            serie = self.series[valores] = [0] * (len(self.buckets) + 1) + [0.0]
+        serie[bisect.bisect_left(self.buckets, valor)] += 1
+        serie[-1] += valor
+
+    def exportar(self):
+        linhas = [f'# HELP {self.nome} {self.ajuda}', f'# TYPE {self.nome} histogram']
+        for valores, serie in sorted(self.series.items()):
+            rotulos = _rotulos(self.rotulos, valores)
+            acumulado = 0
+            for limite, quantidade in zip(self.buckets + ('+Inf',), serie):
+                acumulado += quantidade
+                linhas.append(f'{self.nome}_bucket{{{rotulos},le="{limite}"}} {acumulado}')
+            linhas.append(f'{self.nome}_sum{{{rotulos}}} {serie[-1]:.6f}')
+            linhas.append(f'{self.nome}_count{{{rotulos}}} {acumulado}')
+        return linhas
+
+
+class Registro:
+    """Every histogram of one app. Observations may come from any thread."""
+
+    def __init__(self, max_consultas=500):
+        self.max_consultas = max_consultas
+        self.lock = threading.Lock()
+        self.requisicoes = Histograma('pericias_http_request_duration_seconds', 'Request latency.',
+                                      ('method', 'route', 'status'), BUCKETS_SEGUNDOS)
+        self.sql_por_rota = Histograma('pericias_http_request_sql_statements', 'SQL statements per request.',
+                                       ('route',), BUCKETS_CONTAGEM)
+        self.tempo_sql_por_rota = Histograma('pericias_http_request_sql_seconds', 'Time spent in SQL per request.',
+                                             ('route',), BUCKETS_SEGUNDOS)
+        self.linhas_por_rota = Histograma('pericias_http_request_sql_rows', 'Rows returned or changed by SQL per request.',
+                                          ('route',), BUCKETS_CONTAGEM)
+        self.templates = Histograma('pericias_template_render_seconds', 'Template render time.',
+                                    ('template',), BUCKETS_SEGUNDOS)
+        self.consultas = Histograma('pericias_sql_statement_duration_seconds', 'SQL statement latency by fingerprint.',
+                                    ('fingerprint',), BUCKETS_SQL)
+        self.sql = {}    # fingerprint -> normalized SQL
+        self.lentas = {}  # fingerprint -> statements over SLOW_QUERY_MS
+
+    def observar_consulta(self, statement, duracao, lenta):
+        fingerprint, sql = impressao(statement)
+        with self.lock:
+            if fingerprint not in self.sql:
+                # Keeps the label set bounded when statements are built dynamically
+                if len(self.sql) >= self.max_consultas:
+                    fingerprint, sql = 'outras', '(outras consultas)'
+                self.sql.setdefault(fingerprint, sql)
+            self.consultas.observar((fingerprint,), duracao)
+            if lenta:
+                self.lentas[fingerprint] = self.lentas.get(fingerprint, 0) + 1
+        return fingerprint
+
+    def observar_requisicao(self, metodo, rota, status, duracao, sql):
+        with self.lock:
+            self.requisicoes.observar((metodo, rota, str(status)), duracao)
+            self.sql_por_rota.observar((rota,), sql['consultas'])
+            self.tempo_sql_por_rota.observar((rota,), sql['tempo'])
+            self.linhas_por_rota.observar((rota,), sql['linhas'])
+
+    def observar_template(self, nome, duracao):
+        with self.lock:
+            self.templates.observar((nome,), duracao)
+
+    def exportar(self):
+        with self.lock:
+            linhas = []
+            for histograma in (self.requisicoes, self.sql_por_rota, self.tempo_sql_por_rota, self.linhas_por_rota,
+                               self.templates, self.consultas):
+                linhas += histograma.exportar()
+            linhas += ['# HELP pericias_sql_statement_info Normalized SQL of each fingerprint.',
+                       '# TYPE pericias_sql_statement_info gauge']
+            linhas += [f'pericias_sql_statement_info{{{_rotulos(("fingerprint", "sql"), item)}}} 1'
+                       for item in sorted(self.sql.items())]
+            linhas += ['# HELP pericias_sql_slow_statements_total Statements slower than SLOW_QUERY_MS.',
+                       '# TYPE pericias_sql_slow_statements_total counter']
+            linhas += [f'pericias_sql_slow_statements_total{{{_rotulos(("fingerprint",), (fingerprint,))}}} {quantidade}'
+                       for fingerprint, quantidade in sorted(self.lentas.items())]
+        return '\n'.join(linhas) + '\n'
+
+
+def _medindo():
+    return has_request_context() and 'metricas' in g
+
+
+def _contar_linhas(estado):
+    # Buffers ORM SELECT results to count their rows (the DB-API reports no rowcount for a SELECT);
+    # streamed (yield_per) queries are left alone. Costs a copy of every result, hence opt-in.
+    if not estado.is_select or not _medindo() or not current_app.config['METRICS_COUNT_SELECT_ROWS']:
+        return None
+    if estado.execution_options.get('yield_per') or estado.execution_options.get('stream_results'):
+        return None
+    resultado = estado.invoke_statement().freeze()
+    g.metricas['linhas'] += len(resultado.data)
+    return resultado()
+
+
+def instrumentar(app, engine, sessao, registro):
+    """Hooks the request, template and SQL events of one app and engine into the registro."""
+    limite_lenta = app.config['SLOW_QUERY_MS'] / 1000
+
+    @app.before_request
+    def _iniciar():
+        g.metricas = {'inicio': time.perf_counter(), 'consultas': 0, 'tempo': 0.0, 'linhas': 0}
+
+    @app.after_request
+    def _registrar(response):
+        if 'metricas' in g:
+            rota = request.url_rule.rule if request.url_rule else '(sem rota)'
+            duracao = time.perf_counter() - g.metricas['inicio']
+            registro.observar_requisicao(request.method, rota, response.status_code, duracao, g.metricas)
+        return response
+
+    def _antes_template(sender, template, context, **extra):
+        if has_request_context():
+            g.metricas_template = time.perf_counter()
+
+    def _template_renderizado(sender, template, context, **extra):
+        if has_request_context() and 'metricas_template' in g:
+            registro.observar_template(template.name, time.perf_counter() - g.pop('metricas_template'))
+
+    # weak=False: the receivers are closures that would otherwise be collected right away
+    before_render_template.connect(_antes_template, app, weak=False)
+    template_rendered.connect(_template_renderizado, app, weak=False)
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _antes(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metricas_inicio', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _depois(conn, cursor, statement, parameters, context, executemany):
+        duracao = time.perf_counter() - conn.info['metricas_inicio'].pop()
+        lenta = duracao >= limite_lenta
+        fingerprint = registro.observar_consulta(statement, duracao, lenta)
+        if lenta:
+            app.logger.warning("SQL lenta (%.1f ms, %s): %s | parâmetros: %.1000r",
+                               duracao * 1000, fingerprint, ' '.join(statement.split()), parameters)
+        if _medindo():
+            g.metricas['consultas'] += 1
+            g.metricas['tempo'] += duracao
+            if cursor.rowcount > 0 and statement.lstrip()[:6].upper() not in ('SELECT', 'PRAGMA'):
+                g.metricas['linhas'] += cursor.rowcount
+
+    @event.listens_for(engine, 'handle_error')
+    def _erro(contexto):
+        if contexto.connection is not None and contexto.connection.info.get('metricas_inicio'):
+            contexto.connection.info['metricas_inicio'].pop()
+
+    # The session class is shared by every app: hook it once
+    if app.config['METRICS_COUNT_SELECT_ROWS'] and not event.contains(sessao, 'do_orm_execute', _contar_linhas):
+        event.listen(sessao, 'do_orm_execute', _contar_linhas)
@@ -1,59 +1,17 @@
-import sqlite3
-import os
-
-DB_PATH = 'backend/instance/database.db'
-# Handle if run from root or backend dir
-if not os.path.exists(DB_PATH):
-    if os.path.exists('instance/database.db'):
-        DB_PATH = 'instance/database.db'
-    elif os.path.exists('backend/database.db'):
-        DB_PATH = 'backend/database.db'
-    elif os.path.exists('database.db'):
-        DB_PATH = 'database.db'
-
-print(f"Checking database at: {DB_PATH}")
-
-if not os.path.exists(DB_PATH):
-    print("Database not found. Skipping migration (app.py will create it).")
-    exit(0)
+"""
+Upgrades the configured database (DATABASE_URL, default instance/database.db)
+to the latest schema. Same as `flask --app app migrar`; see migrations.py.
 
-conn = sqlite3.connect(DB_PATH)
-cursor = conn.cursor()
-
-# Get existing columns
-cursor.execute("PRAGMA table_info(pericia)")
-columns = [info[1] for info in cursor.fetchall()]
-
-# Define new columns
-new_columns = {
-    'tipo_acao': 'VARCHAR(50)',
-    'cpf': 'VARCHAR(14)',
-    'rg': 'VARCHAR(20)',
-    'data_nascimento': 'DATETIME',
-    'escolaridade': 'VARCHAR(50)',
-    'profissao': 'VARCHAR(100)',
-    'estado_civil': 'VARCHAR(20)',
-    'endereco_cep': 'VARCHAR(10)',
-    'endereco_cidade': 'VARCHAR(100)',
-    'endereco_uf': 'VARCHAR(2)',
-    'objetivo': 'TEXT',
-    'metodologia': 'TEXT',
-    'antecedentes': 'TEXT',
-    'discussao': 'TEXT',
-    'quesitos': 'TEXT',
-    'bibliografia': 'TEXT'
-}
+    python migrate.py [--dry-run] [--lote 5000] [--pausa 0.1]
+"""
+import os
+import sys
 
-print("Migrating database...")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-for col_name, col_type in new_columns.items():
-    if col_name not in columns:
-        print(f"Adding column: {col_name}")
-        try:
-            cursor.execute(f"ALTER TABLE pericia ADD COLUMN {col_name} {col_type}")
-        except Exception as e:
-            print(f"Error adding {col_name}: {e}")
+from app import create_app, migrar_command
 
-conn.commit()
-conn.close()
-print("Migration complete.")
+if __name__ == '__main__':
+    app = create_app()
+    with app.app_context():
+        migrar_command.main(standalone_mode=True, prog_name='migrate.py')
@@ -0,0 +1,429 @@
+"""
+Versioned schema migrations.
+
+Each migration is a function that declares its steps on a Plano:
+
+  - ddl: new tables and columns (and plain statements that fill them); the
+    whole DDL of a migration runs in one transaction, so it is applied
+    completely or not at all
+  - backfills: data fixes run in short batched transactions, keyed by id, so
+    the app keeps writing between batches. They select only rows that still
+    need the fix, so an interrupted run resumes where it stopped
+  - indices: built after the backfills; on PostgreSQL with CREATE INDEX
+    CONCURRENTLY, outside any transaction. Columns whose data a backfill
+    moved elsewhere are dropped in this last phase too
+
+The version is recorded in schema_version only after every step succeeded.
+New databases are created from the models and stamped at the latest version.
+
+    flask --app app migrar [--dry-run] [--lote 5000] [--pausa 0.1]
+"""
+import json
+import time
+import uuid
+import zlib
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Text, bindparam, inspect, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.schema import CreateTable
+
+MIGRACOES = []
+
+
+def migracao(versao, nome):
+    def registrar(fn):
+        MIGRACOES.append((versao, nome, fn))
+        MIGRACOES.sort(key=lambda m: m[0])
+        return fn
+    return registrar
+
+
+class Plano:
+    """Steps declared by one migration, in the order they will run."""
+
+    def __init__(self, conn, metadata):
+        self.conn = conn
+        self.metadata = metadata
+        self.dialect = conn.dialect
+        self.ddl = []
+        self.backfills = []
+        self.indices = []
+
+    def _colunas(self, tabela):
+        insp = inspect(self.conn)
+        if not insp.has_table(tabela):
+            return None
+        return {c['name'] for c in insp.get_columns(tabela)}
+
+    def tipo(self, tabela, coluna):
+        return self.metadata.tables[tabela].c[coluna].type
+
+    def criar_tabela(self, nome):
+        # Whole new tables come from the models, indexes included
+        if self._colunas(nome) is None:
+            tabela = self.metadata.tables[nome]
+            self.ddl.append((f"CREATE TABLE {nome}", lambda conn: tabela.create(conn, checkfirst=True)))
+
+    def autoincrement(self, nome, minimo=None):
+        """
+        SQLite: rebuilds the table from its model as INTEGER PRIMARY KEY AUTOINCREMENT,
+        so ids of deleted rows are never handed out again. minimo(conn) gives the
+        lowest value the id sequence may restart from (ids still in use elsewhere).
+        PostgreSQL sequences never go back, so there is nothing to do there.
+        """
+        if self.dialect.name != 'sqlite':
+            return
+        existente = self.conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :n"),
+                                      {'n': nome}).scalar()
+        if existente is None or 'AUTOINCREMENT' in existente.upper():
+            return
+        tabela = self.metadata.tables[nome]
+        copia = MetaData()
+        for outra in self.metadata.sorted_tables:
+            outra.to_metadata(copia)  # Foreign keys of the new table resolve against these
+        nova = tabela.to_metadata(copia, name=f'{nome}_nova')
+        colunas = ', '.join(c for c in tabela.columns.keys() if c in self._colunas(nome))
+
+        def recriar(conn):
+            conn.execute(CreateTable(nova))
+            conn.execute(text(f"INSERT INTO {nome}_nova ({colunas}) SELECT {colunas} FROM {nome}"))
+            # Indexes go with the old table; other tables keep referencing the name
+            conn.execute(text(f"DROP TABLE {nome}"))
+            conn.execute(text(f"ALTER TABLE {nome}_nova RENAME TO {nome}"))
+            for indice in tabela.indexes:
+                indice.create(conn)
+            inicio = max(conn.execute(text(f"SELECT coalesce(max(id), 0) FROM {nome}")).scalar_one(),
+                         minimo(conn) if minimo else 0)
+            conn.execute(text("DELETE FROM sqlite_sequence WHERE name = :n"), {'n': nome})
+            conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES (:n, :s)"), {'n': nome, 's': inicio})
+
+        self.ddl.append((f"RECREATE TABLE {nome} (id INTEGER PRIMARY KEY AUTOINCREMENT)", recriar))
+
+    def adicionar_coluna(self, tabela, coluna):
+        existentes = self._colunas(tabela)
+        if existentes is None or coluna.name in existentes:
+            return
+        sql = f"ALTER TABLE {tabela} ADD COLUMN {coluna.name} {coluna.type.compile(dialect=self.dialect)}"
+        if not coluna.nullable:
+            sql += " NOT NULL"
+        if coluna.server_default is not None:
+            sql += f" DEFAULT {coluna.server_default.arg}"
+        self.ddl.append((sql, lambda conn: conn.execute(text(sql))))
+
+    def sql(self, sql):
+        """A plain statement (e.g. filling a new table) run with the DDL, in the same transaction."""
+        self.ddl.append((sql, lambda conn: conn.execute(text(sql))))
+
+    def _concorrente(self):
+        return 'CONCURRENTLY ' if self.dialect.name == 'postgresql' else ''
+
+    def indice(self, nome, tabela, colunas, unique=False, where=None):
+        unico = 'UNIQUE ' if unique else ''
+        sql = f"CREATE {unico}INDEX {self._concorrente()}IF NOT EXISTS {nome} ON {tabela} ({', '.join(colunas)})"
+        if where:
+            sql += f" WHERE {where}"
+        self.indices.append((sql, lambda conn: conn.execute(text(sql))))
+
+    def remover_indice(self, nome):
+        sql = f"DROP INDEX {self._concorrente()}IF EXISTS {nome}"
+        self.indices.append((sql, lambda conn: conn.execute(text(sql))))
+
+    def remover_coluna(self, tabela, coluna):
+        # Runs after the backfills, which may still read it
+        existentes = self._colunas(tabela)
+        if existentes is None or coluna not in existentes:
+            return
+        sql = f"ALTER TABLE {tabela} DROP COLUMN {coluna}"
+        self.indices.append((sql, lambda conn: conn.execute(text(sql))))
+
+    def backfill(self, descricao, tabela, pendente, atualizar):
+        """pendente: SQL condition matching rows still to fix; atualizar(conn, ids) fixes one batch."""
+        self.backfills.append((descricao, tabela, pendente, atualizar))
+
+
+def _criar_tabela_versao(engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_version ("
+            "versao INTEGER PRIMARY KEY, nome VARCHAR(100) NOT NULL, "
+            "aplicada_em TIMESTAMP NOT NULL, duracao_ms INTEGER)"
+        ))
+
+
+def _registrar(conn, versao, nome, duracao):
+    conn.execute(
+        text("INSERT INTO schema_version (versao, nome, aplicada_em, duracao_ms) VALUES (:v, :n, :a, :d)"),
+        {'v': versao, 'n': nome, 'a': datetime.utcnow(), 'd': duracao}
+    )
+
+
+def versao_atual(conn):
+    if not inspect(conn).has_table('schema_version'):
+        return 0
+    return conn.execute(text("SELECT coalesce(max(versao), 0) FROM schema_version")).scalar_one()
+
+
+def pendentes(conn):
+    atual = versao_atual(conn)
+    return [m for m in MIGRACOES if m[0] > atual]
+
+
+def preparar(engine, metadata):
+    """Creates a new database straight at the latest version. Returns the migrations pending on an existing one."""
+    with engine.connect() as conn:
+        if inspect(conn).has_table('pericia'):
+            return pendentes(conn)
+
+    metadata.create_all(engine)
+    _criar_tabela_versao(engine)
+    with engine.begin() as conn:
+        for versao, nome, _ in pendentes(conn):
+            _registrar(conn, versao, nome, 0)
+    return []
+
+
+def _cronometrar(log, descricao, fn):
+    inicio = time.perf_counter()
+    resultado = fn()
+    log(f"    {descricao} ({(time.perf_counter() - inicio) * 1000:.1f} ms)")
+    return resultado
+
+
+def _executar_backfill(engine, log, tabela, pendente, atualizar, lote, pausa):
+    ultimo, total = 0, 0
+    while True:
+        with engine.begin() as conn:
+            ids = conn.execute(
+                text(f"SELECT id FROM {tabela} WHERE id > :ultimo AND ({pendente}) ORDER BY id LIMIT :lote"),
+                {'ultimo': ultimo, 'lote': lote}
+            ).scalars().all()
+            if not ids:
+                return total
+            atualizar(conn, ids)
+        ultimo = ids[-1]
+        total += len(ids)
+        log(f"      {total} linhas (id <= {ultimo})")
+        if pausa:
+            time.sleep(pausa)  # Let application writers in between batches
+
+
+def migrar(engine, metadata, dry_run=False, lote=5000, pausa=0.0, log=print):
+    """Applies pending migrations. Returns the versions applied (or that would be, with dry_run)."""
+    if not dry_run:
+        _criar_tabela_versao(engine)
+
+    with engine.connect() as conn:
+        fila = pendentes(conn)
+        log(f"Versão atual do schema: {versao_atual(conn)}; {len(fila)} migração(ões) pendente(s).")
+
+    aplicadas = []
+    for versao, nome, fn in fila:
+        log(f"[{versao:03d}] {nome}")
+        inicio = time.perf_counter()
+
+        with engine.connect() as conn:
+            plano = Plano(conn, metadata)
+            fn(plano)
+            if dry_run:
+                for sql, _ in plano.ddl + plano.indices:
+                    log(f"    {sql}")
+                for descricao, tabela, pendente, _ in plano.backfills:
+                    try:
+                        quantidade = conn.execute(text(f"SELECT count(*) FROM {tabela} WHERE {pendente}")).scalar_one()
+                    except DBAPIError:
+                        # The condition uses a column this migration adds: every row
+                        conn.rollback()
+                        quantidade = conn.execute(text(f"SELECT count(*) FROM {tabela}")).scalar_one()
+                    log(f"    backfill: {descricao} ({quantidade} linhas)")
+                aplicadas.append(versao)
+                continue
+
+        with engine.begin() as conn:
+            if conn.dialect.name == 'sqlite':
+                # pysqlite runs DDL in autocommit mode unless a transaction is already open
+                conn.exec_driver_sql('BEGIN IMMEDIATE')
+            for sql, executar in plano.ddl:
+                _cronometrar(log, sql, lambda: executar(conn))
+
+        for descricao, tabela, pendente, atualizar in plano.backfills:
+            quantidade = _cronometrar(log, f"backfill: {descricao}",
+                                      lambda: _executar_backfill(engine, log, tabela, pendente, atualizar, lote, pausa))
+            log(f"    {quantidade} linhas atualizadas")
+
+        for sql, executar in plano.indices:
+            if engine.dialect.name == 'postgresql':
+                with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                    _cronometrar(log, sql, lambda: executar(conn))
+            else:
+                with engine.begin() as conn:
+                    _cronometrar(log, sql, lambda: executar(conn))
+
+        duracao = int((time.perf_counter() - inicio) * 1000)
+        with engine.begin() as conn:
+            _registrar(conn, versao, nome, duracao)
+        log(f"    concluída em {duracao} ms")
+        aplicadas.append(versao)
+
+    return aplicadas
+
+
+def _reservar_sequencia(conn, nome, quantidade):
+    # Same counter as app._reservar_sequencia, in plain SQL
+    if not conn.execute(text("UPDATE contador SET valor = valor + :q WHERE nome = :n"), {'q': quantidade, 'n': nome}).rowcount:
+        conn.execute(text("INSERT INTO contador (nome, valor) VALUES (:n, :q)"), {'q': quantidade, 'n': nome})
+    return conn.execute(text("SELECT valor FROM contador WHERE nome = :n"), {'n': nome}).scalar_one()
+
+
+# --- Migrations ---
+
+@migracao(1, 'tabelas iniciais')
+def _tabelas_iniciais(plano):
+    for tabela in ('pericia', 'documento', 'macro'):
+        plano.criar_tabela(tabela)
+
+
+@migracao(2, 'dados pessoais e seções do laudo')
+def _dados_laudo(plano):
+    for nome in ('tipo_acao', 'cpf', 'rg', 'data_nascimento', 'escolaridade', 'profissao', 'estado_civil',
+                 'endereco_cep', 'endereco_cidade', 'endereco_uf'):
+        plano.adicionar_coluna('pericia', Column(nome, plano.tipo('pericia', nome)))
+    # Moved to laudo_secao by migration 9
+    for nome in ('objetivo', 'metodologia', 'antecedentes', 'discussao', 'quesitos', 'bibliografia'):
+        plano.adicionar_coluna('pericia', Column(nome, Text))
+
+
+@migracao(3, 'índices do painel')
+def _indices_painel(plano):
+    plano.indice('ix_pericia_status', 'pericia', ['status'])
+    plano.indice('ix_pericia_status_pagamento', 'pericia', ['status_pagamento'])
+    plano.indice('ix_pericia_created_at', 'pericia', ['created_at'])
+
+
+@migracao(4, 'armazenamento por conteúdo')
+def _blobs(plano):
+    plano.criar_tabela('blob')
+    plano.adicionar_coluna('documento', Column('blob_id', Integer))
+
+
+@migracao(5, 'sincronização com o PWA')
+def _sincronizacao(plano):
+    plano.criar_tabela('pericia_removida')
+    plano.criar_tabela('contador')
+    plano.adicionar_coluna('pericia', Column('uid', String(64)))
+    plano.adicionar_coluna('pericia', Column('versao', Integer, nullable=False, server_default='1'))
+    plano.adicionar_coluna('pericia', Column('sync_seq', Integer))
+    plano.adicionar_coluna('pericia', Column('atualizado_em', DateTime))
+    plano.adicionar_coluna('pericia', Column('extras', Text))
+
+    def gerar_uids(conn, ids):
+        conn.execute(text("UPDATE pericia SET uid = :uid WHERE id = :id"),
+                     [{'uid': uuid.uuid4().hex, 'id': pk} for pk in ids])
+
+    def numerar(conn, ids):
+        # Rows that predate the change feed go after everything already in it
+        ultimo = _reservar_sequencia(conn, 'sync', len(ids))
+        conn.execute(text("UPDATE pericia SET sync_seq = :seq WHERE id = :id"),
+                     [{'seq': seq, 'id': pk} for seq, pk in enumerate(ids, start=ultimo - len(ids) + 1)])
+
+    plano.backfill('pericia.uid', 'pericia', 'uid IS NULL', gerar_uids)
+    plano.backfill('pericia.sync_seq', 'pericia', 'sync_seq IS NULL', numerar)
+    plano.indice('ix_pericia_uid', 'pericia', ['uid'], unique=True)
+    plano.indice('ix_pericia_sync_seq', 'pericia', ['sync_seq'])
+
+
+@migracao(6, 'índices compostos e de cobertura')
+def _indices_compostos(plano):
+    plano.indice('ix_pericia_status_created_at', 'pericia', ['status', 'created_at'])
+    plano.indice('ix_pericia_resumo', 'pericia', ['status', 'status_pagamento', 'valor_honorarios'])
+    plano.remover_indice('ix_pericia_status')  # Prefix of both indexes above
+    plano.indice('ix_documento_pericia_id', 'documento', ['pericia_id'])
+    plano.indice('ix_macro_categoria', 'macro', ['categoria'])
+    plano.indice('ix_blob_orfao', 'blob', ['ref_count'], where='ref_count <= 0')
+
+
+@migracao(7, 'fila de tarefas')
+def _fila_tarefas(plano):
+    plano.criar_tabela('tarefa')
+
+
+@migracao(8, 'resumo financeiro mensal')
+def _resumo_mensal(plano):
+    plano.criar_tabela('resumo_mensal')
+    data = 'coalesce(data_pericia, created_at)'
+    mes = f"to_char({data}, 'YYYY-MM')" if plano.dialect.name == 'postgresql' else f"strftime('%Y-%m', {data})"
+    plano.sql(
+        "INSERT INTO resumo_mensal (mes, tipo_acao, status_pagamento, quantidade, total) "
+        f"SELECT {mes}, coalesce(tipo_acao, ''), coalesce(status_pagamento, 'Pendente'), count(id), "
+        "coalesce(sum(valor_honorarios), 0) FROM pericia "
+        f"GROUP BY {mes}, coalesce(tipo_acao, ''), coalesce(status_pagamento, 'Pendente')"
+    )
+
+
+@migracao(9, 'seções do laudo em laudo_secao')
+def _secoes_laudo(plano):
+    plano.criar_tabela('laudo_secao')
+    secoes = [nome for nome in ('objetivo', 'metodologia', 'anamnese', 'antecedentes', 'exame_fisico', 'discussao',
+                                'conclusao', 'quesitos', 'bibliografia') if nome in (plano._colunas('pericia') or ())]
+    if not secoes:
+        return
+
+    def mover(conn, ids):
+        # Same format as app._codificar_secao with the default LAUDO_COMPRESS_MIN_BYTES
+        linhas = []
+        rows = conn.execute(text(f"SELECT id, {', '.join(secoes)} FROM pericia WHERE id IN :ids")
+                            .bindparams(bindparam('ids', expanding=True)), {'ids': ids})
+        for row in rows:
+            for secao, valor in zip(secoes, row[1:]):
+                if not valor:
+                    continue
+                dados, compressao = valor.encode('utf-8'), None
+                comprimido = zlib.compress(dados) if len(dados) >= 1024 else dados
+                if len(comprimido) < len(dados):
+                    dados, compressao = comprimido, 'zlib'
+                linhas.append({'pericia_id': row[0], 'secao': secao, 'conteudo': dados, 'compressao': compressao})
+        if linhas:
+            conn.execute(text("INSERT INTO laudo_secao (pericia_id, secao, conteudo, compressao) "
+                              "VALUES (:pericia_id, :secao, :conteudo, :compressao)"), linhas)
+        # Emptied in the same batch: the drops below then rewrite small rows, and a rerun skips moved ones
+        conn.execute(text(f"UPDATE pericia SET {', '.join(f'{secao} = NULL' for secao in secoes)} WHERE id IN :ids")
+                     .bindparams(bindparam('ids', expanding=True)), {'ids': ids})
+
+    plano.backfill('pericia -> laudo_secao', 'pericia', ' OR '.join(f"{secao} <> ''" for secao in secoes), mover)
+    for secao in secoes:
+        plano.remover_coluna('pericia', secao)
+
+
+@migracao(10, 'índice da agenda')
+def _indice_agenda(plano):
+    plano.indice('ix_pericia_data_pericia', 'pericia', ['data_pericia'])
+
+
+@migracao(11, 'arquivo de perícias concluídas')
+def _arquivo(plano):
+    plano.criar_tabela('pericia_arquivada')
+
+
+@migracao(12, 'ids sem reuso')
+def _ids_sem_reuso(plano):
+    # An archived pericia (migration 11) comes back under its old ids, so they must never be handed out again
+
+    def pericias_arquivadas(conn):
+        return conn.execute(text("SELECT coalesce(max(id), 0) FROM pericia_arquivada")).scalar_one()
+
+    def documentos_arquivados(conn):
+        # Same payload as app._codificar_arquivo
+        ids = [0]
+        for dados, in conn.execute(text("SELECT dados FROM pericia_arquivada")):
+            ids += [doc['id'] for doc in json.loads(zlib.decompress(dados))['documentos']]
+        return max(ids)
+
+    plano.autoincrement('pericia', pericias_arquivadas)
+    plano.autoincrement('documento', documentos_arquivados)
+
+
+@migracao(13, 'índices do arquivo')
+def _indices_arquivo(plano):
+    # Filtered dashboard totals aggregate the archive too
+    plano.indice('ix_pericia_arquivada_status_created_at', 'pericia_arquivada', ['status', 'created_at'])
+    plano.indice('ix_pericia_arquivada_resumo', 'pericia_arquivada', ['status', 'status_pagamento', 'valor_honorarios'])
@@ -0,0 +1,79 @@
+"""
+Thumbnail and first-page preview generation for uploaded documents.
+
+These functions run inside worker processes, so they only deal with file
+paths and never touch the Flask app or the database. Derived images are
+written next to the original as <original>.thumb<size>.jpg.
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; without it no thumbnails are produced
+    Image = None
+
+TAMANHOS = (128, 256, 512)
+
+EXTENSOES_IMAGEM = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tif', '.tiff', '.webp'}
+
+
+def caminho_miniatura(caminho_origem, tamanho):
+    return f"{caminho_origem}.thumb{tamanho}.jpg"
+
+
+def suporta(caminho_origem):
+    if Image is None:
+        return False
+    extensao = os.path.splitext(caminho_origem)[1].lower()
+    if extensao == '.pdf':
+        return shutil.which('pdftoppm') is not None
+    return extensao in EXTENSOES_IMAGEM
+
+
+def _renderizar_primeira_pagina(caminho_pdf, destino_dir):
+    prefixo = os.path.join(destino_dir, 'pagina')
+    subprocess.run(
+        ['pdftoppm', '-f', '1', '-l', '1', '-singlefile', '-png', '-scale-to', str(max(TAMANHOS)), caminho_pdf, prefixo],
+        check=True, capture_output=True, timeout=60
+    )
+    return prefixo + '.png'
+
+
+def gerar_miniaturas(caminho_origem, tamanhos=TAMANHOS):
+    """Writes one JPEG per size that does not exist yet. Returns the sizes written."""
+    if not suporta(caminho_origem):
+        return []
+
+    pendentes = [t for t in tamanhos if not os.path.exists(caminho_miniatura(caminho_origem, t))]
+    if not pendentes:
+        return []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fonte = caminho_origem
+        if caminho_origem.lower().endswith('.pdf'):
+            fonte = _renderizar_primeira_pagina(caminho_origem, tmp)
+
+        with Image.open(fonte) as original:
+            original.seek(0)  # First frame of multi-page TIFF/GIF
+            base = original.convert('RGB')
+
+        # Largest first, so each smaller size is resampled from a smaller image
+        for tamanho in sorted(pendentes, reverse=True):
+            base.thumbnail((tamanho, tamanho))
+            destino = caminho_miniatura(caminho_origem, tamanho)
+            parcial = destino + '.tmp'
+            base.save(parcial, 'JPEG', quality=80, optimize=True)
+            os.replace(parcial, destino)
+
+    return pendentes
+
+
+def remover_miniaturas(caminho_origem):
+    for tamanho in TAMANHOS:
+        try:
+            os.remove(caminho_miniatura(caminho_origem, tamanho))
+        except OSError:
+            pass
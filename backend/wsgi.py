@@ -0,0 +1,10 @@
+"""
+WSGI entry point for production servers, e.g.
+
+    gunicorn --workers 4 --preload wsgi:app
+
+--preload creates the tables and the search index once, before forking.
+"""
+from app import create_app
+
+app = create_app()
@@ -1,5 +1,5 @@
 
-const CACHE_NAME = 'pericia-web-v3';
+const CACHE_NAME = 'pericia-web-v4';
 const ASSETS = [
     './',
     './index.html',
@@ -17,6 +17,7 @@ const ASSETS = [
     './static/js/modules/finance.js',
     './static/js/modules/ui.js',
     './static/js/modules/macros.js',
+    './static/js/modules/sync.js',
     './static/js/modules/default_data.js',
     './static/js/cid_data.js',
     './static/css/toast.css',
@@ -7,6 +7,7 @@ import { DashboardController } from './modules/dashboard.js';
 import { MacrosController } from './modules/macros.js';
 import { TemplatesController } from './modules/templates.js';
 import { UI } from './modules/ui.js';
+import { Sync } from './modules/sync.js';
 
 /**
  * Main Application Controller.
@@ -52,6 +53,34 @@ const MainController = {
 
         const inputImport = document.getElementById('input-import-backup');
         if(inputImport) inputImport.addEventListener('change', (e) => this.handleImport(e));
+
+        const btnSync = document.getElementById('btn-sync');
+        if(btnSync) btnSync.addEventListener('click', () => this.handleSync());
+    },
+
+    /**
+     * Handles incremental sync with the backend configured in Settings.
+     */
+    async handleSync() {
+        const { servidor } = Storage.getSettings();
+        if (!servidor) {
+            UI.Toast.show('Configure o servidor de sincronização em Configurações.', 'error');
+            return;
+        }
+
+        UI.Loading.show();
+        try {
+            const { pushed, pulled, conflicts } = await Sync.run(servidor);
+            UI.Toast.show(`Sincronizado: ${pushed} enviados, ${pulled} recebidos.`, 'success');
+            if (conflicts.length) {
+                UI.Toast.show(`${conflicts.length} registro(s) alterados no servidor foram mantidos na versão do servidor.`, 'info', 8000);
+            }
+            setTimeout(() => location.reload(), 1500);
+        } catch (e) {
+            UI.Toast.show(`Falha na sincronização: ${e.message}`, 'error');
+        } finally {
+            UI.Loading.hide();
+        }
     },
 
     /**
@@ -9,6 +9,62 @@ export const CalendarController = {
     /** @type {Object|null} FullCalendar instance */
     calendar: null,
 
+    /**
+     * Pericias scheduled inside the visible window, in the camelCase shape of local records.
+     * With a backend configured, asks `/api/agenda` (an indexed range query); offline, or
+     * without a server, filters the local caseload to the same window.
+     * @param {{start: Date, end: Date, startStr: string, endStr: string}} fetchInfo
+     * @returns {Promise<Array<Object>>}
+     */
+    async fetchWindow(fetchInfo) {
+        const { servidor } = Storage.getSettings();
+        if (servidor && navigator.onLine !== false) {
+            try {
+                const params = new URLSearchParams({ start: fetchInfo.startStr, end: fetchInfo.endStr });
+                const response = await fetch(`${servidor.replace(/\/+$/, '')}/api/agenda?${params}`);
+                if (response.ok) {
+                    // The server's uid is the local record id
+                    return (await response.json()).map(p => ({
+                        id: p.uid || p.id,
+                        numeroProcesso: p.numero_processo,
+                        nomeAutor: p.nome_autor,
+                        dataPericia: p.data_pericia,
+                        status: p.status
+                    }));
+                }
+            } catch (e) {
+                // Unreachable server: use the local records
+            }
+        }
+        return Storage.getPericias().filter(p => {
+            if (!p.dataPericia) return false;
+            const data = new Date(p.dataPericia);
+            return data >= fetchInfo.start && data < fetchInfo.end;
+        });
+    },
+
+    /**
+     * FullCalendar event for a pericia record.
+     * @param {Object} p
+     */
+    toEvent(p) {
+        let color = '#F59E0B'; // Default/Pending (Yellow)
+        if (p.status === STATUS.DONE) color = '#10B981'; // Green
+        else if (p.status === STATUS.SCHEDULED) color = '#3B82F6'; // Blue
+        else if (p.status === STATUS.IN_PROGRESS) color = '#6366f1'; // Indigo
+
+        return {
+            id: p.id,
+            title: `${p.numeroProcesso || ''} - ${p.nomeAutor || 'Sem Nome'}`,
+            start: p.dataPericia,
+            url: '#editar/' + p.id,
+            color: color,
+            extendedProps: {
+                status: p.status
+            }
+        };
+    },
+
     /**
      * Renders or refreshes the calendar.
      */
@@ -40,29 +96,9 @@ export const CalendarController = {
                     day: 'Dia',
                     list: 'Lista'
                 },
-                events: (fetchInfo, successCallback, failureCallback) => {
+                events: async (fetchInfo, successCallback, failureCallback) => {
                     try {
-                        const pericias = Storage.getPericias();
-                        const events = pericias
-                            .filter(p => p.dataPericia) // camelCase
-                            .map(p => {
-                                let color = '#F59E0B'; // Default/Pending (Yellow)
-                                if (p.status === STATUS.DONE) color = '#10B981'; // Green
-                                else if (p.status === STATUS.SCHEDULED) color = '#3B82F6'; // Blue
-                                else if (p.status === STATUS.IN_PROGRESS) color = '#6366f1'; // Indigo
-
-                                return {
-                                    id: p.id,
-                                    title: `${p.numeroProcesso || ''} - ${p.nomeAutor || 'Sem Nome'}`,
-                                    start: p.dataPericia,
-                                    url: '#editar/' + p.id,
-                                    color: color,
-                                    extendedProps: {
-                                        status: p.status
-                                    }
-                                };
-                            });
-                        successCallback(events);
+                        successCallback((await this.fetchWindow(fetchInfo)).map(p => this.toEvent(p)));
                     } catch (error) {
                         console.error('CalendarController: Fetch error', error);
                         if(failureCallback) failureCallback(error);
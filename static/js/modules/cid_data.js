@@ -1,11 +1,37 @@
 
-/* Simple CID-10 Mock Data for Autocomplete - Expanded */
+import { Storage } from './storage.js';
+
+/**
+ * CID-10 autocomplete. With a backend configured, queries its full in-memory
+ * index (`/api/cid`, ranked, accent- and typo-tolerant); offline, or without
+ * a server, falls back to the small list below.
+ */
 export const CID10 = {
-    search(query) {
+    /**
+     * @param {string} query - What was typed: a code ("M54.5") or words of the description.
+     * @returns {Promise<Array<{code: string, desc: string}>>}
+     */
+    async search(query) {
+        if (!query || query.length < 2) return [];
+        const { servidor } = Storage.getSettings();
+        if (servidor && navigator.onLine !== false) {
+            try {
+                const response = await fetch(`${servidor.replace(/\/+$/, '')}/api/cid?q=${encodeURIComponent(query)}`);
+                if (response.ok) {
+                    return (await response.json()).map(item => ({ code: item.codigo, desc: item.descricao }));
+                }
+            } catch (e) {
+                // Unreachable server: use the offline list
+            }
+        }
+        return this.searchLocal(query);
+    },
+
+    searchLocal(query) {
         if (!query || query.length < 3) return [];
         query = query.toLowerCase();
 
-        // This is a small subset. Real app would load a full JSON or fetch from API.
+        // Offline subset; the backend serves the full table
         const data = [
             {code: "M54.4", desc: "Lumbago com ciática"},
             {code: "M54.5", desc: "Dor lombar baixa (Lombalgia)"},
@@ -3,7 +3,8 @@ export const DB_KEYS = {
     MACROS: 'pericia_sys_macros',
     SETTINGS: 'pericia_sys_settings',
     TEMPLATES: 'pericia_sys_templates',
-    DRAFT: 'pericia_draft'
+    DRAFT: 'pericia_draft',
+    SYNC: 'pericia_sync_state'
 };
 
 export const STATUS = {
@@ -191,9 +191,12 @@ export const FormController = {
         }
     },
 
-    handleCIDSearch(e) {
+    async handleCIDSearch(e) {
         const query = e.target.value;
-        const results = CID10.search(query);
+        const seq = this.cidSearchSeq = (this.cidSearchSeq || 0) + 1;
+        const results = await CID10.search(query);
+        // A slower answer to an earlier keystroke must not replace the current list
+        if (seq !== this.cidSearchSeq) return;
         const ul = document.getElementById('cid-suggestions');
         if(!ul) return;
 
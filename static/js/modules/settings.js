@@ -50,11 +50,13 @@ export const SettingsController = {
         const elCrm = document.getElementById('s-crm');
         const elEndereco = document.getElementById('s-endereco');
         const elTelefone = document.getElementById('s-telefone');
+        const elServidor = document.getElementById('s-servidor');
 
         if(elNome) elNome.value = s.nome || '';
         if(elCrm) elCrm.value = s.crm || '';
         if(elEndereco) elEndereco.value = s.endereco || '';
         if(elTelefone) elTelefone.value = s.telefone || '';
+        if(elServidor) elServidor.value = s.servidor || '';
 
         // Render signature preview
         const container = document.querySelector('#view-settings .max-w-2xl');
@@ -79,12 +81,14 @@ export const SettingsController = {
         const elCrm = document.getElementById('s-crm');
         const elEndereco = document.getElementById('s-endereco');
         const elTelefone = document.getElementById('s-telefone');
+        const elServidor = document.getElementById('s-servidor');
 
         const settings = {
             nome: elNome ? elNome.value : '',
             crm: elCrm ? elCrm.value : '',
             endereco: elEndereco ? elEndereco.value : '',
             telefone: elTelefone ? elTelefone.value : '',
+            servidor: elServidor ? elServidor.value.trim() : '',
             signature: Storage.getSettings().signature // preserve signature
         };
         Storage.saveSettings(settings);
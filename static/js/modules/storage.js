@@ -130,6 +130,7 @@ export const Storage = {
             console.error('Storage: Save failed', e);
             throw new Error('Failed to save pericia');
         }
+        this.markChanged(model.id);
         return model;
     },
 
@@ -142,6 +143,66 @@ export const Storage = {
         // eslint-disable-next-line eqeqeq
         pericias = pericias.filter(p => p.id != id);
         localStorage.setItem(DB_KEYS.PERICIAS, JSON.stringify(pericias));
+        this.markDeleted(id);
+    },
+
+    // --- Sync Tracking ---
+
+    /**
+     * Retrieves the sync bookkeeping: server cursor, last known server
+     * version per pericia and the local changes not pushed yet.
+     * @returns {{cursor: number, versions: Object, pending: Object, deleted: Object}}
+     */
+    getSyncState() {
+        const state = JSONUtils.parse(localStorage.getItem(DB_KEYS.SYNC), {}, 'sync');
+        return {
+            cursor: state.cursor || 0,
+            versions: state.versions || {},
+            pending: state.pending || {},
+            deleted: state.deleted || {}
+        };
+    },
+
+    /**
+     * Saves the sync bookkeeping.
+     * @param {Object} state - The sync state.
+     */
+    saveSyncState(state) {
+        localStorage.setItem(DB_KEYS.SYNC, JSON.stringify(state));
+    },
+
+    /**
+     * Flags a pericia as changed locally so the next sync pushes it.
+     * @param {number|string} id - The ID of the pericia.
+     */
+    markChanged(id) {
+        const state = this.getSyncState();
+        state.pending[id] = true;
+        delete state.deleted[id];
+        this.saveSyncState(state);
+    },
+
+    /**
+     * Flags a pericia as deleted locally so the next sync pushes the delete.
+     * @param {number|string} id - The ID of the pericia.
+     */
+    markDeleted(id) {
+        const state = this.getSyncState();
+        delete state.pending[id];
+        state.deleted[id] = true;
+        this.saveSyncState(state);
+    },
+
+    /**
+     * Applies records pulled from the server without flagging them as local changes.
+     * @param {Array} changes - Server records (their `id` is the PWA id).
+     * @param {Array} deletedIds - IDs removed on the server.
+     */
+    applyRemote(changes, deletedIds) {
+        const byId = new Map(this.getPericias().map(p => [String(p.id), p]));
+        changes.forEach(record => byId.set(String(record.id), new Pericia(record)));
+        deletedIds.forEach(id => byId.delete(String(id)));
+        localStorage.setItem(DB_KEYS.PERICIAS, JSON.stringify([...byId.values()]));
     },
 
     // --- Macros ---
@@ -0,0 +1,109 @@
+import { Storage } from './storage.js';
+
+/** Records sent per push request. */
+const PUSH_BATCH = 100;
+
+/**
+ * Incremental two-way sync with the Flask backend (`/api/sync`).
+ * Only records changed since the last run travel in either direction.
+ */
+export const Sync = {
+    /**
+     * Pushes local changes, then pulls everything changed on the server.
+     * @param {string} serverUrl - Base URL of the backend, e.g. "http://localhost:5000".
+     * @returns {Promise<{pushed: number, pulled: number, conflicts: Array}>} Summary of the run.
+     */
+    async run(serverUrl) {
+        const base = serverUrl.replace(/\/+$/, '');
+        const { pushed, conflicts } = await this.push(base);
+        const pulled = await this.pull(base);
+        return { pushed, pulled, conflicts };
+    },
+
+    /**
+     * Sends pending local changes and deletes in batches.
+     * Conflicts are resolved in favour of the server copy.
+     * @param {string} base - Backend base URL.
+     * @returns {Promise<{pushed: number, conflicts: Array}>}
+     */
+    async push(base) {
+        const state = Storage.getSyncState();
+        const pericias = Storage.getPericias().filter(p => state.pending[p.id]);
+        const changes = pericias.map(p => ({ ...p, versao: state.versions[p.id] ?? null }));
+        const deleted = Object.keys(state.deleted).map(id => ({ id, versao: state.versions[id] ?? null }));
+
+        let pushed = 0;
+        const conflicts = [];
+        const serverWins = [];
+
+        const batches = [];
+        for (let i = 0; i < changes.length; i += PUSH_BATCH) {
+            batches.push({ changes: changes.slice(i, i + PUSH_BATCH), deleted: [] });
+        }
+        for (let i = 0; i < deleted.length; i += PUSH_BATCH) {
+            batches.push({ changes: [], deleted: deleted.slice(i, i + PUSH_BATCH) });
+        }
+
+        for (const body of batches) {
+            const response = await fetch(`${base}/api/sync`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify(body)
+            });
+            if (!response.ok) throw new Error(`Sync push failed (${response.status})`);
+            const result = await response.json();
+
+            result.applied.forEach(({ id, versao }) => {
+                delete state.pending[id];
+                delete state.deleted[id];
+                if (versao === null) delete state.versions[id];
+                else state.versions[id] = versao;
+                pushed++;
+            });
+            result.conflicts.forEach(conflict => {
+                delete state.pending[conflict.id];
+                delete state.deleted[conflict.id];
+                if (conflict.servidor) {
+                    state.versions[conflict.id] = conflict.servidor.versao;
+                    serverWins.push(conflict.servidor);
+                }
+                conflicts.push(conflict);
+            });
+        }
+
+        Storage.saveSyncState(state);
+        if (serverWins.length) Storage.applyRemote(serverWins, []);
+        return { pushed, conflicts };
+    },
+
+    /**
+     * Pulls server changes after the stored cursor, page by page.
+     * Records with unpushed local edits are left alone until the next push.
+     * @param {string} base - Backend base URL.
+     * @returns {Promise<number>} Number of records received.
+     */
+    async pull(base) {
+        let pulled = 0;
+        let hasMore = true;
+
+        while (hasMore) {
+            const state = Storage.getSyncState();
+            const response = await fetch(`${base}/api/sync?since=${state.cursor}`);
+            if (!response.ok) throw new Error(`Sync pull failed (${response.status})`);
+            const page = await response.json();
+
+            const changes = page.changes.filter(record => !state.pending[record.id]);
+            const deletedIds = page.deleted.filter(id => !state.pending[id]);
+            changes.forEach(record => { state.versions[record.id] = record.versao; });
+            deletedIds.forEach(id => { delete state.versions[id]; });
+
+            Storage.applyRemote(changes, deletedIds);
+            state.cursor = page.cursor;
+            Storage.saveSyncState(state);
+
+            pulled += page.changes.length + page.deleted.length;
+            hasMore = page.has_more;
+        }
+        return pulled;
+    }
+};
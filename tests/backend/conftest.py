@@ -0,0 +1,101 @@
+"""
+Fixtures for the Flask backend tests. They run without a browser:
+
+    python -m pytest tests/backend
+"""
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'backend'))
+
+import app as backend  # noqa: E402
+
+STATUS = ('Aguardando', 'Agendado', 'Em Andamento', 'Concluido')
+CATEGORIAS = ('anamnese', 'exame_fisico', 'conclusao')
+
+
+def criar_app(tmp_path, **config):
+    return backend.create_app(dict({
+        'TESTING': True,
+        'QUERY_BUDGET_STRICT': True,
+        'JOBS_WORKERS': 0,  # Tests run queued jobs explicitly
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'test.db'),
+        'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+        'LAUDO_CACHE_FOLDER': str(tmp_path / 'laudos'),
+        'BACKUP_FOLDER': str(tmp_path / 'backups'),
+        'COMPRESS_FOLDER': str(tmp_path / 'compressed'),
+    }, **config))
+
+
+def semear(quantidade=20000, seed=1):
+    """Fills the database through bulk inserts (no per-row events), then rebuilds the search index and rollups."""
+    rng = random.Random(seed)
+    db = backend.db
+    inicio = datetime(2020, 1, 1)
+
+    db.session.execute(db.insert(backend.Pericia), [{
+        'numero_processo': f'{i:07d}-{rng.randint(10, 99)}.2023.8.26.0100',
+        'nome_autor': f'Autor {rng.choice(["Silva", "Souza", "Oliveira", "Costa"])} {i}',
+        'status': rng.choice(STATUS),
+        'status_pagamento': rng.choice(('Pendente', 'Pago')),
+        'valor_honorarios': rng.choice((350.0, 500.0, 1200.0)),
+        'created_at': inicio + timedelta(minutes=rng.randint(0, 3 * 365 * 24 * 60)),
+        'data_pericia': inicio + timedelta(days=rng.randint(0, 3 * 365)),
+        'uid': f'{i:032x}',
+        'sync_seq': i + 1,
+        'versao': 1,
+    } for i in range(quantidade)])
+    db.session.execute(db.insert(backend.LaudoSecao), [linha for i in range(1, quantidade + 1) for linha in backend._linhas_secoes(i, {
+        'anamnese': '<p>Refere lombalgia crônica há anos.</p>',
+        'conclusao': '<p>Incapacidade parcial e permanente.</p>',
+    })])
+    db.session.add(backend.Contador(nome='sync', valor=quantidade))
+    db.session.add(backend.Contador(nome='resumo', valor=1))
+
+    db.session.execute(db.insert(backend.Blob), [{
+        'sha256': f'{i:064x}', 'filename': f'{i:064x}.pdf', 'size': 1024, 'ref_count': 1,
+    } for i in range(1, quantidade // 4 + 1)])
+    db.session.execute(db.insert(backend.Documento), [{
+        'filename': f'{i:064x}.pdf', 'original_name': f'exame_{i}.pdf',
+        'pericia_id': rng.randint(1, quantidade), 'blob_id': i,
+    } for i in range(1, quantidade // 4 + 1)])
+    db.session.execute(db.insert(backend.Macro), [{
+        'titulo': f'Macro {i}', 'conteudo': '<p>Texto padrão.</p>', 'categoria': rng.choice(CATEGORIAS),
+    } for i in range(300)])
+    db.session.execute(db.insert(backend.PericiaRemovida), [{
+        'uid': f'removida{i}', 'sync_seq': quantidade + i,
+    } for i in range(1, 500)])
+    db.session.commit()
+
+    with db.engine.begin() as conn:
+        backend._reindexar_busca(conn)
+        backend._recalcular_resumo_mensal(conn)
+
+
+@pytest.fixture
+def app(tmp_path):
+    return criar_app(tmp_path)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def contar_consultas(app):
+    """Returns a callable giving the number of SQL statements run since the fixture started."""
+    consultas = []
+    with app.app_context():
+        engine = backend.db.engine
+
+    def _contar(conn, cursor, statement, parameters, context, executemany):
+        consultas.append(statement)
+
+    backend.db.event.listen(engine, 'before_cursor_execute', _contar)
+    yield lambda: len(consultas)
+    backend.db.event.remove(engine, 'before_cursor_execute', _contar)
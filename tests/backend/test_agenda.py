@@ -0,0 +1,126 @@
+"""
+Agenda: /api/agenda answers the calendar's visible window from the
+data_pericia index, and agenda.ics is cached per worker, revalidated with an
+ETag and re-rendered only for the pericias that changed.
+"""
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import inspect, text
+
+import app as backend
+import migrations
+from conftest import criar_app
+
+HOJE = date.today()
+
+
+def _nova(client, numero, dia, nome='Autor'):
+    client.post('/nova', data={'numero_processo': numero, 'nome_autor': nome, 'data_pericia': dia.isoformat()})
+
+
+def test_api_devolve_so_a_janela(client):
+    _nova(client, '0001', date(2024, 3, 5))
+    _nova(client, '0002', date(2024, 3, 31))
+    _nova(client, '0003', date(2024, 4, 1))
+    client.post('/nova', data={'numero_processo': '0004', 'nome_autor': 'Sem data'})
+
+    eventos = client.get('/api/agenda?start=2024-03-01T00:00:00-03:00&end=2024-04-01T00:00:00-03:00').get_json()
+    assert [e['numero_processo'] for e in eventos] == ['0001', '0002']
+    assert set(eventos[0]) == {'id', 'uid', 'numero_processo', 'nome_autor', 'data_pericia', 'status'}
+    assert eventos[0]['data_pericia'] == '2024-03-05T00:00:00'
+    assert eventos[0]['status'] == 'Agendado'
+
+
+def test_api_aceita_o_pwa_de_outra_origem(app, client):
+    url = '/api/agenda?start=2024-03-01&end=2024-04-01'
+    app.config['SYNC_ALLOWED_ORIGIN'] = 'https://pwa.example'
+    response = client.get(url, headers={'Origin': 'https://pwa.example'})
+    assert response.headers['Access-Control-Allow-Origin'] == 'https://pwa.example'
+    assert client.get('/api/agenda', headers={'Origin': 'https://pwa.example'}).headers['Access-Control-Allow-Origin']
+    app.config['SYNC_ALLOWED_ORIGIN'] = None
+    assert 'Access-Control-Allow-Origin' not in client.get(url).headers
+
+
+@pytest.mark.parametrize('query', ['', 'start=2024-03-01', 'start=ontem&end=2024-04-01',
+                                   'start=2024-04-01&end=2024-03-01', 'start=2020-01-01&end=2024-01-01'])
+def test_api_valida_a_janela(client, query):
+    response = client.get(f'/api/agenda?{query}')
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_ics_com_etag(client):
+    _nova(client, '0001', HOJE + timedelta(days=3), nome='José da Silva, Jr.')
+    _nova(client, '0002', HOJE + timedelta(days=2 * 365))  # Outside the feed
+
+    response = client.get('/agenda.ics')
+    assert response.mimetype == 'text/calendar'
+    corpo = response.data.decode()
+    assert corpo.startswith('BEGIN:VCALENDAR\r\n') and corpo.endswith('END:VCALENDAR\r\n')
+    assert corpo.count('BEGIN:VEVENT') == 1
+    assert f"DTSTART;VALUE=DATE:{HOJE + timedelta(days=3):%Y%m%d}" in corpo
+    assert 'SUMMARY:0001 - José da Silva\\, Jr.' in corpo
+
+    repetida = client.get('/agenda.ics', headers={'If-None-Match': response.headers['ETag']})
+    assert repetida.status_code == 304
+
+    client.post('/pericia/1', data={'numero_processo': '0001', 'nome_autor': 'José da Silva',
+                                    'data_pericia': (HOJE + timedelta(days=4)).isoformat()})
+    alterada = client.get('/agenda.ics', headers={'If-None-Match': response.headers['ETag']})
+    assert alterada.status_code == 200
+    assert f"DTSTART;VALUE=DATE:{HOJE + timedelta(days=4):%Y%m%d}" in alterada.data.decode()
+
+
+def test_laudo_nao_invalida_a_agenda(app, client, contar_consultas):
+    _nova(client, '0001', HOJE)
+    etag = client.get('/agenda.ics').headers['ETag']
+    with app.app_context():
+        versao = backend.db.session.get(backend.Pericia, 1).versao
+    assert client.patch('/api/pericia/1', json={'versao': versao, 'anamnese': '<p>Lombalgia.</p>'}).status_code == 200
+
+    antes = contar_consultas()
+    assert client.get('/agenda.ics', headers={'If-None-Match': etag}).status_code == 304
+    assert contar_consultas() - antes == 1  # Only the counter
+
+
+def test_regenera_so_os_eventos_alterados(app, client):
+    _nova(client, '0001', HOJE)
+    _nova(client, '0002', HOJE)
+    client.get('/agenda.ics')
+    with app.app_context():
+        eventos = dict(backend._estado()['agenda']['eventos'])
+
+    client.post('/pericia/2', data={'numero_processo': '0002', 'nome_autor': 'Outro Autor'})
+    assert 'Outro Autor' in client.get('/agenda.ics').data.decode()
+    with app.app_context():
+        novos = backend._estado()['agenda']['eventos']
+    assert novos[1] is eventos[1]
+    assert novos[2] is not eventos[2]
+
+
+def test_linhas_longas_sao_dobradas(client):
+    _nova(client, '0001', HOJE, nome='Maria ' + 'Conceição ' * 20)
+    for linha in client.get('/agenda.ics').data.split(b'\r\n'):
+        assert len(linha) <= 75
+        linha.decode('utf-8')  # Never split inside a character
+
+
+def test_alteracao_em_outro_worker(tmp_path):
+    leitor = criar_app(tmp_path)
+    escritor = criar_app(tmp_path)
+    assert 'BEGIN:VEVENT' not in leitor.test_client().get('/agenda.ics').data.decode()
+    _nova(escritor.test_client(), '0001', HOJE)
+    assert 'BEGIN:VEVENT' in leitor.test_client().get('/agenda.ics').data.decode()
+
+
+def test_migracao_cria_o_indice(app):
+    with app.app_context():
+        engine = backend.db.engine
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX ix_pericia_data_pericia"))
+        conn.execute(text("DELETE FROM schema_version WHERE versao >= 10"))
+
+    assert migrations.migrar(engine, backend.db.metadata, log=lambda m: None)[0] == 10
+    with app.app_context():
+        assert 'ix_pericia_data_pericia' in {i['name'] for i in inspect(engine).get_indexes('pericia')}
@@ -0,0 +1,273 @@
+"""
+Archive of concluded, paid pericias (pericia_arquivada): moved out of the hot
+tables with their laudo compressed, read through by the edit form, the laudo,
+search and the agenda, and brought back by any write.
+"""
+import io
+import zlib
+
+import pytest
+from sqlalchemy import inspect, text
+
+import app as backend
+import migrations
+from conftest import semear
+
+PERICIAS = 2000
+
+
+def semear_antigas(quantidade):
+    """semear(), with every pericia last touched when it was created (years ago)."""
+    semear(quantidade)
+    with backend.db.engine.begin() as conn:
+        conn.execute(text('UPDATE pericia SET atualizado_em = created_at'))
+
+
+@pytest.fixture
+def arquivado(app):
+    with app.app_context():
+        semear_antigas(PERICIAS)
+    resultado = app.test_cli_runner().invoke(args=['arquivar'])
+    assert resultado.exit_code == 0, resultado.output
+    return app
+
+
+def _arquivada(app, com_documentos=False):
+    with app.app_context():
+        query = backend.PericiaArquivada.query
+        if com_documentos:
+            query = query.filter(backend.PericiaArquivada.num_documentos > 0)
+        return query.order_by(backend.PericiaArquivada.id).first()
+
+
+def test_arquivar_move_concluidas_e_pagas(app, client):
+    with app.app_context():
+        semear_antigas(PERICIAS)
+        elegiveis = backend.Pericia.query.filter_by(status='Concluido', status_pagamento='Pago').count()
+        refs = backend.db.session.scalar(text('SELECT sum(ref_count) FROM blob'))
+    resumo, financeiro = client.get('/api/pericias/resumo').get_json(), client.get('/api/financeiro?de=2020-01&ate=2023-12').get_json()
+    filtrados = {url: client.get(url).get_json() for url in (
+        '/api/pericias/resumo?status=Concluido', '/api/pericias/resumo?search=Silva')}
+
+    resultado = app.test_cli_runner().invoke(args=['arquivar', '--lote', '100'])
+    assert resultado.exit_code == 0, resultado.output
+
+    with app.app_context():
+        arquivadas = backend.PericiaArquivada.query.count()
+        ids = [a.id for a in backend.PericiaArquivada.query]
+        assert arquivadas == elegiveis
+        assert f'{arquivadas} perícia(s)' in resultado.output
+        assert backend.Pericia.query.count() == PERICIAS - arquivadas
+        assert backend.LaudoSecao.query.filter(backend.LaudoSecao.pericia_id.in_(ids)).count() == 0
+        assert backend.Documento.query.filter(backend.Documento.pericia_id.in_(ids)).count() == 0
+        assert backend.db.session.scalar(text('SELECT sum(ref_count) FROM blob')) == refs  # Still referenced
+
+        arquivada = backend.db.session.get(backend.PericiaArquivada, ids[0])
+        assert b'lombalgia' not in arquivada.dados
+        assert 'Refere lombalgia' in zlib.decompress(arquivada.dados).decode()
+
+    # Totals and rollups still count the archived pericias; the dashboard lists only the active ones
+    assert client.get('/api/pericias/resumo').get_json() == resumo
+    assert {url: client.get(url).get_json() for url in filtrados} == filtrados  # Filtered ones too
+    assert client.get('/api/financeiro?de=2020-01&ate=2023-12').get_json() == financeiro
+    ativas = client.get('/api/pericias?per_page=200').get_json()['items']
+    assert not {p['id'] for p in ativas} & set(ids)
+    pagina = client.get('/api/pericias?arquivo=1&per_page=200').get_json()
+    assert {p['id'] for p in pagina['items']} <= set(ids) and pagina['next_cursor']
+    assert client.get('/api/pericias/resumo?arquivo=1').get_json()['quantidade'] == arquivadas
+    assert client.get('/?arquivo=1').status_code == 200
+
+    # Nothing left to archive
+    assert '0 perícia(s)' in app.test_cli_runner().invoke(args=['arquivar']).output
+
+
+def test_leitura_atravessa_o_arquivo(arquivado, client):
+    arquivada = _arquivada(arquivado, com_documentos=True)
+
+    formulario = client.get(f'/pericia/{arquivada.id}')
+    assert formulario.status_code == 200
+    assert 'Perícia arquivada' in formulario.data.decode()
+    assert b'Refere lombalgia' in formulario.data and b'exame_' in formulario.data
+    assert b'/thumb/' not in formulario.data  # Thumbnails are served by documento row, gone while archived
+
+    laudo = client.get(f'/pericia/{arquivada.id}/ver')
+    assert laudo.status_code == 200 and 'Incapacidade parcial'.encode() in laudo.data
+    assert client.get(f'/pericia/{arquivada.id}/ver', headers={'If-None-Match': laudo.headers['ETag']}).status_code == 304
+
+    [resultado] = client.get(f'/api/search?q={arquivada.numero_processo[:7]}').get_json()
+    assert resultado['id'] == arquivada.id and resultado['arquivada'] is True
+    assert client.get(f'/?arquivo=1&search={arquivada.numero_processo[:7]}').data.count(arquivada.nome_autor.encode()) == 1
+
+    inicio = arquivada.data_pericia.date().isoformat()
+    agenda = client.get(f'/api/agenda?start={inicio}&end={inicio}T23:59:59').get_json()
+    assert arquivada.id in [evento['id'] for evento in agenda]
+
+    with arquivado.app_context():
+        assert backend.db.session.get(backend.Pericia, arquivada.id) is None  # Reading did not bring it back
+
+    # A rebuilt search index still finds it
+    with arquivado.app_context(), backend.db.engine.begin() as conn:
+        backend._reindexar_busca(conn)
+    assert [r['id'] for r in client.get(f'/api/search?q={arquivada.numero_processo[:7]}').get_json()] == [arquivada.id]
+
+
+def test_edicao_traz_de_volta(arquivado, client):
+    arquivada = _arquivada(arquivado, com_documentos=True)
+    with arquivado.app_context():
+        sync = backend.db.session.scalar(text("SELECT valor FROM contador WHERE nome = 'sync'"))
+
+    response = client.post(f'/pericia/{arquivada.id}', data={
+        'numero_processo': arquivada.numero_processo, 'nome_autor': arquivada.nome_autor, 'finalizar': '1',
+        'status_pagamento': 'Pago', 'conclusao': '<p>Revisada após arquivamento.</p>',
+    })
+    assert response.status_code == 302
+
+    with arquivado.app_context():
+        assert backend.db.session.get(backend.PericiaArquivada, arquivada.id) is None
+        pericia = backend.db.session.get(backend.Pericia, arquivada.id)
+        assert pericia.uid == arquivada.uid and pericia.versao == arquivada.versao + 1
+        assert pericia.anamnese == '<p>Refere lombalgia crônica há anos.</p>'
+        assert pericia.conclusao == '<p>Revisada após arquivamento.</p>'
+        assert len(pericia.documents) == arquivada.num_documentos
+        assert pericia.sync_seq > sync
+    assert client.get(f'/pericia/{arquivada.id}/ver').data.count('Revisada após arquivamento'.encode()) == 1
+
+
+def test_autosave_sync_e_exclusao_trazem_de_volta(arquivado, client):
+    with arquivado.app_context():
+        primeira, segunda, terceira = backend.PericiaArquivada.query.order_by(backend.PericiaArquivada.id).limit(3)
+        removidas = backend.PericiaRemovida.query.count()
+
+    response = client.patch(f'/api/pericia/{primeira.id}', json={'versao': primeira.versao, 'conclusao': '<p>Nova.</p>'})
+    assert response.status_code == 200
+
+    response = client.post('/api/sync', json={'changes': [{
+        'id': segunda.uid, 'versao': segunda.versao, 'numeroProcesso': segunda.numero_processo, 'nomeAutor': 'Editado'}]})
+    assert response.get_json()['applied'] == [{'id': segunda.uid, 'versao': segunda.versao + 1}]
+
+    assert client.get(f'/pericia/{terceira.id}/delete').status_code == 302
+    with arquivado.app_context():
+        assert backend.db.session.get(backend.Pericia, primeira.id).conclusao == '<p>Nova.</p>'
+        assert backend.db.session.get(backend.Pericia, segunda.id).nome_autor == 'Editado'
+        assert backend.db.session.get(backend.Pericia, terceira.id) is None
+        assert backend.PericiaArquivada.query.filter(
+            backend.PericiaArquivada.id.in_([primeira.id, segunda.id, terceira.id])).count() == 0
+        assert backend.PericiaRemovida.query.count() == removidas + 1  # Sync clients learn about the delete
+    assert terceira.id not in [r['id'] for r in client.get(f'/api/search?q={terceira.numero_processo[:7]}').get_json()]
+
+
+def test_recalcular_financeiro_conta_o_arquivo(arquivado, client):
+    relatorio = client.get('/api/financeiro?de=2020-01&ate=2023-12').get_json()
+    assert relatorio['total'] > 0
+
+    resultado = arquivado.test_cli_runner().invoke(args=['recalcular-financeiro'])
+    assert resultado.exit_code == 0, resultado.output
+    assert client.get('/api/financeiro?de=2020-01&ate=2023-12').get_json() == relatorio
+
+
+def test_recentes_e_ativas_ficam(app, client):
+    with app.app_context():
+        semear_antigas(200)
+    client.post('/nova', data={'numero_processo': 'recente', 'nome_autor': 'Autor'})
+    client.post('/pericia/201', data={'numero_processo': 'recente', 'nome_autor': 'Autor', 'finalizar': '1',
+                                      'status_pagamento': 'Pago'})
+
+    with app.app_context():
+        assert backend.arquivar() > 0
+        restantes = {p.id for p in backend.Pericia.query.filter_by(status='Concluido', status_pagamento='Pago')}
+        assert restantes == {201}  # Touched today
+        assert backend.arquivar(dias=0) == 1
+
+
+def test_ids_arquivados_nao_sao_reusados(app, client):
+    with app.app_context():
+        semear_antigas(200)
+        # The highest pericia ids and the newest documento all go to the archive
+        with backend.db.engine.begin() as conn:
+            conn.execute(text("UPDATE pericia SET status = 'Concluido', status_pagamento = 'Pago' WHERE id >= 199"))
+            conn.execute(text('UPDATE documento SET pericia_id = 200 WHERE id = (SELECT max(id) FROM documento)'))
+        ultimo_documento = backend.db.session.scalar(text('SELECT max(id) FROM documento'))
+    client.post('/nova', data={'numero_processo': 'ativa', 'nome_autor': 'Autor'})
+    with app.app_context():
+        assert backend.arquivar() > 0
+        dona = backend.db.session.get(backend.PericiaArquivada, 200)
+        assert backend.db.session.get(backend.PericiaArquivada, 199) and dona.num_documentos > 0
+
+    # With the newest active pericia deleted too, SQLite would hand out old ids again without AUTOINCREMENT
+    assert client.get('/pericia/201/delete').status_code == 302
+    client.post('/nova', data={'numero_processo': 'nova', 'nome_autor': 'Autor'})
+    response = client.post('/api/pericia/202/upload', data={'upload_document': (io.BytesIO(b'novo'), 'novo.pdf')})
+    assert response.get_json()['id'] > ultimo_documento
+
+    assert 'Perícia arquivada' in client.get('/pericia/200').data.decode()
+    [resultado] = client.get(f'/api/search?q={dona.numero_processo[:7]}').get_json()
+    assert resultado['id'] == 200 and resultado['arquivada'] is True
+
+    # Bringing it back finds its pericia and documento ids free
+    response = client.post('/api/sync', json={'changes': [{
+        'id': dona.uid, 'versao': dona.versao, 'numeroProcesso': dona.numero_processo, 'nomeAutor': 'Editado'}]})
+    assert response.status_code == 200
+    with app.app_context():
+        pericia = backend.db.session.get(backend.Pericia, 200)
+        assert pericia.nome_autor == 'Editado' and len(pericia.documents) == dona.num_documentos
+        assert backend.db.session.get(backend.Pericia, 202).numero_processo == 'nova'
+
+
+def test_api_enfileira_o_arquivamento(arquivado, client):
+    response = client.post('/api/arquivar')
+    assert response.status_code == 202
+    with arquivado.app_context():
+        assert arquivado.extensions['tarefas'].executar_pendentes() == 1
+    assert client.get(f"/api/tarefas/{response.get_json()['id']}").get_json()['status'] == 'concluida'
+
+
+def test_migracao_cria_a_tabela(app):
+    with app.app_context():
+        engine = backend.db.engine
+        with engine.begin() as conn:
+            conn.execute(text('DROP TABLE pericia_arquivada'))
+            conn.execute(text('DELETE FROM schema_version WHERE versao >= 11'))
+
+        assert migrations.migrar(engine, backend.db.metadata, log=lambda m: None)[0] == 11
+        indices = {i['name'] for i in inspect(engine).get_indexes('pericia_arquivada')}
+        assert {'ix_pericia_arquivada_data_pericia', 'ix_pericia_arquivada_resumo'} <= indices
+
+
+def test_migracao_torna_os_ids_sem_reuso(app, tmp_path):
+    # A database from before migration 12: pericia and documento reuse the ids of deleted rows
+    metadata = backend.db.MetaData()
+    for tabela in backend.db.metadata.sorted_tables:
+        tabela.to_metadata(metadata).dialect_kwargs['sqlite_autoincrement'] = False
+    engine = backend.db.create_engine('sqlite:///' + str(tmp_path / 'antigo.db'))
+    metadata.create_all(engine)
+    migrations._criar_tabela_versao(engine)
+    with engine.begin() as conn:
+        for versao, nome, _ in migrations.MIGRACOES[:11]:
+            migrations._registrar(conn, versao, nome, 0)
+        conn.execute(text("INSERT INTO pericia (id, numero_processo, nome_autor, status, status_pagamento, uid, versao) "
+                          "VALUES (1, '1', 'A', 'Concluido', 'Pago', 'a', 1), (2, '2', 'B', 'Concluido', 'Pago', 'b', 1)"))
+        conn.execute(text("INSERT INTO documento (id, filename, original_name, pericia_id) VALUES (1, 'x.pdf', 'x.pdf', 1)"))
+    with app.app_context(), engine.begin() as conn:
+        # Pericia 3 and documento 5 only live in the archive now
+        conn.execute(backend.db.insert(backend.PericiaArquivada), [{
+            'id': 3, 'uid': 'c', 'numero_processo': '3', 'nome_autor': 'C', 'status': 'Concluido', 'status_pagamento': 'Pago',
+            'versao': 1, 'dados': backend._codificar_arquivo({'id': 3}, {}, [{'id': 5, 'pericia_id': 3}])}])
+
+    assert migrations.migrar(engine, backend.db.metadata, log=lambda m: None)[0] == 12
+
+    with engine.begin() as conn:
+        assert 'AUTOINCREMENT' in conn.execute(text("SELECT sql FROM sqlite_master WHERE name = 'pericia'")).scalar()
+        assert conn.execute(text('SELECT count(*) FROM pericia')).scalar() == 2
+        assert 'ix_pericia_created_at' in {i['name'] for i in inspect(conn).get_indexes('pericia')}
+        conn.execute(text('DELETE FROM pericia WHERE id = 2'))
+        conn.execute(text('DELETE FROM documento'))
+        conn.execute(text("INSERT INTO pericia (numero_processo, nome_autor, status, status_pagamento, versao) "
+                          "VALUES ('4', 'D', 'Aguardando', 'Pendente', 1)"))
+        conn.execute(text("INSERT INTO documento (filename, original_name, pericia_id) VALUES ('y.pdf', 'y.pdf', 1)"))
+        assert conn.execute(text('SELECT max(id) FROM pericia')).scalar() == 4
+        assert conn.execute(text('SELECT max(id) FROM documento')).scalar() == 6
+
+    # Already done: nothing to rebuild on a rerun
+    with engine.begin() as conn:
+        conn.execute(text('DELETE FROM schema_version WHERE versao >= 12'))
+    assert migrations.migrar(engine, backend.db.metadata, log=lambda m: None)[0] == 12
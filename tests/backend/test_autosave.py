@@ -0,0 +1,81 @@
+"""
+PATCH /api/pericia/<id>: autosave writes only the fields sent and refuses
+edits made against an outdated versao.
+"""
+import pytest
+
+import app as backend
+
+
+@pytest.fixture
+def pericia(app, client):
+    client.post('/nova', data={'numero_processo': '0001', 'nome_autor': 'Autor'})
+    client.post('/pericia/1', data={'numero_processo': '0001', 'nome_autor': 'Autor',
+                                    'anamnese': '<p>Lombalgia.</p>', 'conclusao': '<p>Apto.</p>'})
+    with app.app_context():
+        return backend.db.session.get(backend.Pericia, 1).versao
+
+
+@pytest.fixture
+def sql(app):
+    with app.app_context():
+        engine = backend.db.engine
+    comandos = []
+
+    def _registrar(conn, cursor, statement, parameters, context, executemany):
+        comandos.append(' '.join(statement.split()))
+
+    backend.db.event.listen(engine, 'before_cursor_execute', _registrar)
+    yield comandos
+    backend.db.event.remove(engine, 'before_cursor_execute', _registrar)
+
+
+def test_patch_atualiza_so_o_campo_enviado(app, client, pericia, sql):
+    response = client.patch('/api/pericia/1', json={'versao': pericia, 'anamnese': '<p>Lombalgia há 3 anos.</p>'})
+    assert response.status_code == 200
+    assert response.get_json() == {'id': 1, 'versao': pericia + 1}
+
+    updates = [s for s in sql if s.startswith('UPDATE pericia ') or s.startswith('UPDATE laudo_secao ')]
+    assert updates == [
+        'UPDATE pericia SET versao=?, sync_seq=?, atualizado_em=? WHERE pericia.id = ? AND pericia.versao = ?',
+        'UPDATE laudo_secao SET conteudo=? WHERE laudo_secao.pericia_id = ? AND laudo_secao.secao = ?',
+    ]
+    with app.app_context():
+        atualizada = backend.db.session.get(backend.Pericia, 1)
+        assert (atualizada.anamnese, atualizada.conclusao) == ('<p>Lombalgia há 3 anos.</p>', '<p>Apto.</p>')
+    assert [p['id'] for p in client.get('/api/search?q=anos').get_json()] == [1]
+
+
+def test_patch_com_versao_antiga_e_conflito(app, client, pericia):
+    assert client.patch('/api/pericia/1', json={'versao': pericia, 'conclusao': '<p>Inapto.</p>'}).status_code == 200
+
+    response = client.patch('/api/pericia/1', json={'versao': pericia, 'conclusao': '<p>Apto.</p>'})
+    assert response.status_code == 409
+    assert response.get_json()['versao'] == pericia + 1
+    assert response.get_json()['servidor']['conclusao'] == '<p>Inapto.</p>'
+
+
+def test_patch_sem_alteracao_nao_grava(app, client, pericia, sql):
+    response = client.patch('/api/pericia/1', json={'versao': pericia, 'nomeAutor': 'Autor'})
+    assert response.get_json() == {'id': 1, 'versao': pericia}
+    assert not [s for s in sql if not s.startswith('SELECT')]
+
+
+@pytest.mark.parametrize('corpo, erro', [
+    ({'anamnese': '<p>x</p>'}, 'versao is required'),
+    ({'versao': 1, 'campo_inexistente': 1}, 'Campo desconhecido: campo_inexistente'),
+    ({'versao': 1, 'nome_autor': ''}, 'Campo obrigatório: nome_autor'),
+    ({'versao': 1, 'data_pericia': 'amanhã'}, "Valor inválido para data_pericia: 'amanhã'"),
+])
+def test_patch_invalido(client, pericia, corpo, erro):
+    response = client.patch('/api/pericia/1', json=corpo)
+    assert response.status_code == 400
+    assert response.get_json()['error'] == erro
+
+
+def test_formulario_preserva_secoes_que_nao_exibe(app, client, pericia):
+    client.patch('/api/pericia/1', json={'versao': pericia, 'quesitos': '<p>1) Sim.</p>'})
+    client.post('/pericia/1', data={'numero_processo': '0001', 'nome_autor': 'Autor', 'anamnese': '<p>Nova.</p>'})
+    with app.app_context():
+        atualizada = backend.db.session.get(backend.Pericia, 1)
+        assert (atualizada.anamnese, atualizada.quesitos) == ('<p>Nova.</p>', '<p>1) Sim.</p>')
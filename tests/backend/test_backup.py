@@ -0,0 +1,180 @@
+"""
+Online backup (backup.py): consistent database copies taken while the app
+writes, uploads stored once by content across snapshots, and a restore that
+is verified before it touches anything.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import app as backend
+import backup
+from conftest import semear
+
+PERICIAS = 2000
+
+
+@pytest.fixture
+def semeado(app):
+    with app.app_context():
+        semear(PERICIAS)
+        blobs = [b.filename for b in backend.Blob.query.order_by(backend.Blob.id).limit(20)]
+    uploads = app.config['UPLOAD_FOLDER']
+    for i, nome in enumerate(blobs):
+        with open(os.path.join(uploads, nome), 'wb') as f:
+            f.write(os.urandom(4096) + bytes([i]))
+    with open(os.path.join(uploads, 'legado.pdf'), 'wb') as f:
+        f.write(b'%PDF-1.4 enviado antes do armazenamento por conteudo')
+    with open(os.path.join(uploads, f'{blobs[0]}.thumb128.jpg'), 'wb') as f:
+        f.write(b'miniatura')
+    with open(os.path.join(uploads, '.partial', 'envio'), 'wb') as f:
+        f.write(b'pela metade')
+    return app
+
+
+def _backup(app):
+    resultado = app.test_cli_runner().invoke(args=['backup'])
+    assert resultado.exit_code == 0, resultado.output
+    return backup.listar(app.config['BACKUP_FOLDER'])[-1]['nome']
+
+
+def _manifesto(app, nome):
+    return backup.ler_manifesto(app.config['BACKUP_FOLDER'], nome)
+
+
+def _conteudos(pasta):
+    return {nome: open(os.path.join(pasta, nome), 'rb').read()
+            for nome in os.listdir(pasta) if os.path.isfile(os.path.join(pasta, nome))}
+
+
+def test_backup_e_restauracao(semeado, client):
+    app = semeado
+    uploads = app.config['UPLOAD_FOLDER']
+    originais = _conteudos(uploads)
+    nome = _backup(app)
+
+    manifesto = _manifesto(app, nome)
+    assert set(manifesto['uploads']) == {n for n in originais if '.thumb' not in n}
+    assert manifesto['estatisticas']['objetos_novos'] == 21
+    assert backup.verificar(app.config['BACKUP_FOLDER'], nome) == []
+
+    # Changes after the snapshot: a new case, a removed case, a lost file
+    client.post('/nova', data={'numero_processo': 'depois', 'nome_autor': 'Autor'})
+    client.get('/pericia/1/delete')
+    os.remove(os.path.join(uploads, 'legado.pdf'))
+    with open(os.path.join(uploads, sorted(originais)[0]), 'wb') as f:
+        f.write(b'sobrescrito')
+
+    resultado = app.test_cli_runner().invoke(args=['restaurar', nome])
+    assert resultado.exit_code == 0, resultado.output
+    assert '2 de 21' in resultado.output
+
+    with app.app_context():
+        assert backend.Pericia.query.count() == PERICIAS
+        assert backend.db.session.get(backend.Pericia, 1) is not None
+        assert backend.Pericia.query.filter_by(numero_processo='depois').count() == 0
+        assert backend.db.session.get(backend.Pericia, 1).anamnese == '<p>Refere lombalgia crônica há anos.</p>'
+    assert _conteudos(uploads) == originais
+    assert client.get('/api/search?q=lombalgia').status_code == 200
+
+
+def test_segundo_backup_so_copia_o_que_mudou(semeado, monkeypatch):
+    app = semeado
+    _backup(app)
+
+    lidos = []
+    sha256 = backup._sha256
+    monkeypatch.setattr(backup, '_sha256', lambda caminho: lidos.append(caminho) or sha256(caminho))
+    with open(os.path.join(app.config['UPLOAD_FOLDER'], 'novo.pdf'), 'wb') as f:
+        f.write(b'%PDF-1.4 exame novo')
+    manifesto = _manifesto(app, _backup(app))
+
+    assert manifesto['estatisticas']['objetos_novos'] == 1
+    assert manifesto['estatisticas']['bytes_copiados'] == len(b'%PDF-1.4 exame novo')
+    assert lidos == [os.path.join(app.config['BACKUP_FOLDER'], 'snapshots', f".{manifesto['nome']}.tmp", 'database.db')]
+    assert len(manifesto['uploads']) == 22
+
+
+def test_escritas_continuam_durante_o_backup(semeado, tmp_path):
+    app = semeado
+    with app.app_context():
+        banco = backend._caminho_banco()
+    esperas, parar = [], threading.Event()
+
+    def escrever():
+        conexao = sqlite3.connect(banco, timeout=5)
+        i = 0
+        while not parar.is_set() and i < 200:
+            inicio = time.monotonic()
+            with conexao:
+                conexao.execute("INSERT INTO pericia (numero_processo, nome_autor, versao) VALUES (?, 'Durante', 1)", (f'd{i}',))
+            esperas.append(time.monotonic() - inicio)
+            i += 1
+            time.sleep(0.002)
+        conexao.close()
+
+    escritor = threading.Thread(target=escrever)
+    escritor.start()
+    try:
+        backup.copiar_banco(banco, str(tmp_path / 'copia.db'), paginas=16, pausa=0.001)
+    finally:
+        parar.set()
+        escritor.join()
+
+    assert esperas and max(esperas) < 1
+    copia = sqlite3.connect(str(tmp_path / 'copia.db'))
+    assert copia.execute('PRAGMA integrity_check').fetchone() == ('ok',)
+    assert copia.execute('PRAGMA journal_mode').fetchone() == ('delete',)
+    total = copia.execute('SELECT count(*) FROM pericia').fetchone()[0]
+    assert PERICIAS <= total <= PERICIAS + len(esperas)
+
+
+def test_restauracao_recusa_snapshot_corrompido(semeado, client):
+    app = semeado
+    destino = app.config['BACKUP_FOLDER']
+    nome = _backup(app)
+    sha256 = _manifesto(app, nome)['uploads']['legado.pdf']['sha256']
+    with open(backup._objeto(destino, sha256), 'ab') as f:
+        f.write(b'bit rot')
+    client.post('/nova', data={'numero_processo': 'depois', 'nome_autor': 'Autor'})
+
+    assert backup.verificar(destino, nome) == [f'legado.pdf: objeto {sha256} corrompido']
+    resultado = app.test_cli_runner().invoke(args=['restaurar', nome])
+    assert resultado.exit_code != 0
+    assert 'corrompido' in resultado.output
+    with app.app_context():
+        assert backend.Pericia.query.count() == PERICIAS + 1  # Untouched
+
+
+def test_poda_snapshots_e_objetos_antigos(semeado):
+    app = semeado
+    app.config['BACKUP_KEEP'] = 2
+    uploads = app.config['UPLOAD_FOLDER']
+    primeiro = _backup(app)
+    sha256 = _manifesto(app, primeiro)['uploads']['legado.pdf']['sha256']
+    os.remove(os.path.join(uploads, 'legado.pdf'))
+    _backup(app)
+    assert os.path.exists(backup._objeto(app.config['BACKUP_FOLDER'], sha256))  # Still held by the first
+    _backup(app)
+
+    snapshots = [s['nome'] for s in backup.listar(app.config['BACKUP_FOLDER'])]
+    assert len(snapshots) == 2 and primeiro not in snapshots
+    assert not os.path.exists(backup._objeto(app.config['BACKUP_FOLDER'], sha256))
+
+
+def test_api_enfileira_o_backup(semeado, client):
+    app = semeado
+    response = client.post('/api/backup')
+    assert response.status_code == 202
+    assert client.post('/api/backup').get_json()['id'] == response.get_json()['id']  # Still waiting: not queued twice
+    assert client.get('/api/backups').get_json() == []
+
+    with app.app_context():
+        assert app.extensions['tarefas'].executar_pendentes() == 1
+    assert client.get(f"/api/tarefas/{response.get_json()['id']}").get_json()['status'] == 'concluida'
+    [snapshot] = client.get('/api/backups').get_json()
+    assert snapshot['estatisticas']['arquivos'] == 21
+    assert 'uploads' not in snapshot
@@ -0,0 +1,60 @@
+"""
+/api/cid: CID-10 typeahead over the in-memory index in cid10.py, by code
+prefix and by accent-folded description words, tolerating one typo per word.
+"""
+import cid10
+from conftest import criar_app
+
+
+def _codigos(client, q, **params):
+    return [r['codigo'] for r in client.get('/api/cid', query_string={'q': q, **params}).get_json()]
+
+
+def test_busca_por_codigo(client):
+    assert _codigos(client, 'M54.5')[0] == 'M54.5'
+    assert _codigos(client, 'm545')[0] == 'M54.5'
+    assert set(_codigos(client, 'M54')) >= {'M54', 'M54.4', 'M54.5'}
+    assert _codigos(client, 'M54')[0] == 'M54'  # The exact code first
+
+
+def test_busca_por_descricao_sem_acentos_e_com_erro(client):
+    assert 'M54.5' in _codigos(client, 'lombar')
+    assert 'M75.1' in _codigos(client, 'sindrome manguito')
+    assert 'M75.1' in _codigos(client, 'Síndrome do Manguito')
+    assert _codigos(client, 'esquisofrenia')[0] == 'F20'
+    assert 'M54.5' in _codigos(client, 'dor lonbar')
+    assert _codigos(client, 'xyzw') == []
+    assert _codigos(client, '') == []
+
+
+def test_limite_cache_e_cors(app, client):
+    assert len(_codigos(client, 'transtorno', limit=3)) == 3
+    assert len(_codigos(client, 'transtorno', limit=1000)) <= 50
+
+    response = client.get('/api/cid?q=lombar')
+    assert response.cache_control.public and response.cache_control.max_age == 3600
+    app.config['SYNC_ALLOWED_ORIGIN'] = 'https://pwa.example'
+    assert client.get('/api/cid?q=lombar').headers['Access-Control-Allow-Origin'] == 'https://pwa.example'
+
+
+def test_le_tabelas_do_datasus(tmp_path):
+    categorias = tmp_path / 'CID-10-CATEGORIAS.CSV'
+    categorias.write_bytes('CAT;CLASSIF;DESCRICAO;DESCRABREV;REFER;EXCLUIDOS;\n'
+                           'M54;;Dorsalgia;M54 Dorsalgia;;;\n'.encode('latin-1'))
+    subcategorias = tmp_path / 'CID-10-SUBCATEGORIAS.CSV'
+    subcategorias.write_bytes('SUBCAT;CLASSIF;RESTRSEXO;CAUSAOBITO;DESCRICAO;DESCRABREV;REFER;EXCLUIDOS;\n'
+                              'M545;;;;Dor lombar baixa;M54.5 Dor lombar baixa;;;\n'
+                              'G560;;;;Síndrome do túnel do carpo;G56.0 S do tunel do carpo;;;\n'.encode('latin-1'))
+
+    indice = cid10.carregar([str(categorias), str(subcategorias)])
+    assert len(indice) == 3
+    assert indice.buscar('tunel')[0] == {'codigo': 'G56.0', 'descricao': 'Síndrome do túnel do carpo'}
+    assert [r['codigo'] for r in indice.buscar('M54')] == ['M54', 'M54.5']
+
+
+def test_avisa_quando_so_ha_a_amostra(tmp_path, caplog):
+    criar_app(tmp_path / 'amostra')
+    assert 'só a amostra' in caplog.text
+    caplog.clear()
+    criar_app(tmp_path / 'datasus', CID10_FILES=[str(tmp_path / 'CID-10-CATEGORIAS.CSV')])
+    assert 'só a amostra' not in caplog.text
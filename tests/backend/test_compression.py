@@ -0,0 +1,114 @@
+"""
+Response compression (compression.py): negotiated per request, skipped for
+small or binary bodies, cached by ETag, precompressed once for finalized
+laudos and static files, and streamed for the exports.
+"""
+import gzip
+import json
+import os
+
+import pytest
+
+import compression
+from conftest import semear
+
+GZIP = {'Accept-Encoding': 'gzip, deflate'}
+
+
+@pytest.fixture
+def semeado(app):
+    with app.app_context():
+        semear(200)
+    return app
+
+
+def test_painel_comprimido_quando_aceito(semeado, client):
+    identidade = client.get('/')
+    comprimido = client.get('/', headers=GZIP)
+
+    assert 'Content-Encoding' not in identidade.headers
+    assert comprimido.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in comprimido.headers['Vary']
+    assert gzip.decompress(comprimido.data) == identidade.data
+    assert len(comprimido.data) < len(identidade.data) / 4
+
+
+def test_corpo_pequeno_ou_recusado_vai_sem_compressao(client):
+    pequeno = client.get('/api/cid?q=M54.5', headers=GZIP)
+    assert len(pequeno.data) < 1024
+    assert 'Content-Encoding' not in pequeno.headers
+
+    client.post('/macros/nova', data={'titulo': 'Longa', 'categoria': 'anamnese', 'conteudo': '<p>texto</p>' * 200})
+    recusado = client.get('/api/macros/anamnese', headers={'Accept-Encoding': 'gzip;q=0, identity'})
+    assert 'Content-Encoding' not in recusado.headers
+    assert 'Accept-Encoding' in recusado.headers['Vary']
+
+
+def test_macros_com_etag_e_304(client):
+    client.post('/macros/nova', data={'titulo': 'Longa', 'categoria': 'anamnese', 'conteudo': '<p>texto</p>' * 200})
+    primeira = client.get('/api/macros/anamnese', headers=GZIP)
+    assert primeira.headers['Content-Encoding'] == 'gzip'
+    assert primeira.headers['ETag'].startswith('W/')
+    assert json.loads(gzip.decompress(primeira.data))[0]['titulo'] == 'Longa'
+
+    repetida = client.get('/api/macros/anamnese', headers={**GZIP, 'If-None-Match': primeira.headers['ETag']})
+    assert repetida.status_code == 304
+    assert client.get('/api/macros/anamnese', headers=GZIP).data == primeira.data  # From the variant cache
+
+
+def test_laudo_finalizado_precomprimido(app, client):
+    client.post('/nova', data={'numero_processo': '0001', 'nome_autor': 'Autor'})
+    client.post('/pericia/1', data={'numero_processo': '0001', 'nome_autor': 'Autor', 'finalizar': '1',
+                                    'anamnese': '<p>Refere dor lombar há anos.</p>' * 100})
+    identidade = client.get('/pericia/1/ver')
+    comprimido = client.get('/pericia/1/ver', headers=GZIP)
+
+    assert comprimido.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(comprimido.data) == identidade.data
+    assert comprimido.headers['ETag'] != identidade.headers['ETag']
+    assert client.get('/pericia/1/ver', headers={**GZIP, 'If-None-Match': comprimido.headers['ETag']}).status_code == 304
+    cache = os.path.join(app.config['LAUDO_CACHE_FOLDER'], '1')
+    assert [nome for nome in os.listdir(cache) if nome.endswith('.gz')] == [nome + '.gz' for nome in os.listdir(cache) if nome.endswith('.html')]
+
+    # A new version drops the old files, precompressed one included
+    client.post('/pericia/1', data={'numero_processo': '0001', 'nome_autor': 'Autor', 'finalizar': '1',
+                                    'anamnese': '<p>Revisado.</p>' * 100})
+    with app.app_context():
+        app.extensions['tarefas'].executar_pendentes()
+    assert not [nome for nome in os.listdir(cache) if nome.endswith('.gz')]
+    assert b'Revisado.' in gzip.decompress(client.get('/pericia/1/ver', headers=GZIP).data)
+
+
+def test_exportacao_comprimida_em_fluxo(semeado, client):
+    identidade = client.get('/api/pericias/export')
+    comprimido = client.get('/api/pericias/export', headers=GZIP)
+    assert comprimido.is_streamed
+    assert comprimido.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(comprimido.data) == identidade.data
+
+
+def test_arquivo_estatico_precomprimido(app, client, tmp_path):
+    app.static_folder = str(tmp_path / 'static')
+    os.makedirs(app.static_folder)
+    with open(os.path.join(app.static_folder, 'app.css'), 'w') as f:
+        f.write('.painel { display: flex; }\n' * 200)
+
+    response = client.get('/static/app.css', headers=GZIP)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == b'.painel { display: flex; }\n' * 200
+    assert len(os.listdir(app.config['COMPRESS_FOLDER'])) == 1
+    assert 'Content-Encoding' not in client.get('/static/app.css').headers
+    assert client.get('/static/ausente.css', headers=GZIP).status_code == 404
+
+
+@pytest.mark.skipif(compression.brotli is None, reason='brotli not installed')
+def test_brotli_preferido_quando_instalado(semeado, client):
+    response = client.get('/', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert compression.brotli.decompress(response.data) == client.get('/').data
+
+
+def test_templates_sem_indentacao(client):
+    html = client.get('/').data.decode()
+    assert not [linha for linha in html.splitlines() if linha.startswith((' ', '\t'))]
+    assert '\n\n\n' not in html
@@ -0,0 +1,64 @@
+"""
+Serving uploads: strong ETags (the blob's sha256), immutable caching,
+If-None-Match -> 304, Range -> 206 and hand-off to nginx via X-Accel-Redirect.
+"""
+import hashlib
+import io
+
+import pytest
+
+CONTEUDO = bytes(range(256)) * 8  # 2 KiB
+SHA256 = hashlib.sha256(CONTEUDO).hexdigest()
+
+
+@pytest.fixture
+def url(client):
+    client.post('/nova', data={'numero_processo': '0001', 'nome_autor': 'Autor'})
+    response = client.post('/api/pericia/1/upload', data={'upload_document': (io.BytesIO(CONTEUDO), 'exame.bin')})
+    return response.get_json()['url']
+
+
+def test_etag_forte_e_cache_imutavel(client, url):
+    response = client.get(url)
+    assert response.data == CONTEUDO
+    assert response.headers['ETag'] == f'"{SHA256}"'
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert {'public', 'immutable', f'max-age={365 * 24 * 3600}'} <= set(response.headers['Cache-Control'].split(', '))
+
+
+def test_if_none_match_responde_304(client, url):
+    response = client.get(url, headers={'If-None-Match': f'"{SHA256}"'})
+    assert response.status_code == 304 and response.data == b''
+    assert client.get(url, headers={'If-None-Match': '"outro"'}).status_code == 200
+
+
+def test_range_responde_206(client, url):
+    parcial = client.get(url, headers={'Range': 'bytes=100-199'})
+    assert parcial.status_code == 206
+    assert parcial.data == CONTEUDO[100:200]
+    assert parcial.headers['Content-Range'] == f'bytes 100-199/{len(CONTEUDO)}'
+
+    final = client.get(url, headers={'Range': 'bytes=-16'})
+    assert final.status_code == 206 and final.data == CONTEUDO[-16:]
+
+    # If-Range with a stale ETag: the whole file again
+    inteiro = client.get(url, headers={'Range': 'bytes=0-9', 'If-Range': '"outro"'})
+    assert inteiro.status_code == 200 and inteiro.data == CONTEUDO
+
+    assert client.get(url, headers={'Range': f'bytes={len(CONTEUDO)}-'}).status_code == 416
+
+
+def test_x_accel_redirect_deixa_os_bytes_para_o_proxy(app, client, url):
+    app.config['UPLOADS_ACCEL_REDIRECT'] = '/_uploads/'
+    response = client.get(url)
+    assert response.status_code == 200 and response.data == b''
+    assert response.headers['X-Accel-Redirect'] == f'/_uploads/{SHA256}.bin'
+    assert response.headers['ETag'] == f'"{SHA256}"'
+    assert 'immutable' in response.headers['Cache-Control']
+    assert client.get(url, headers={'If-None-Match': f'"{SHA256}"'}).status_code == 304
+
+
+def test_fora_da_pasta_de_uploads(client, url):
+    assert client.get('/uploads/ausente.pdf').status_code == 404
+    assert client.get('/uploads/.partial').status_code == 404
+    assert client.get('/uploads/..%2Fapp.py').status_code == 404
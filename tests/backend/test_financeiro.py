@@ -0,0 +1,103 @@
+"""
+Financial rollups: every write path keeps resumo_mensal equal to a full
+recount, and /api/financeiro answers from it.
+"""
+import json
+from datetime import datetime
+
+import app as backend
+
+
+def _resumos(app):
+    with app.app_context():
+        return {(r.mes, r.tipo_acao, r.status_pagamento): (r.quantidade, round(r.total, 2))
+                for r in backend.ResumoMensal.query if r.quantidade}
+
+
+def _recontado(app):
+    with app.app_context():
+        with backend.db.engine.begin() as conn:
+            backend._recalcular_resumo_mensal(conn)
+    return _resumos(app)
+
+
+def _nova(client, data, valor):
+    return client.post('/nova', data={'numero_processo': '0001', 'nome_autor': 'Autor', 'data_pericia': data,
+                                      'valor_honorarios': str(valor)})
+
+
+def test_rollups_acompanham_todas_as_escritas(app, client):
+    _nova(client, '2024-01-10', 500)
+    _nova(client, '2024-01-20', 350)
+    _nova(client, '2024-02-05', 1200)
+    # Edit: new month, tipo_acao and payment status for the same fee
+    client.post('/pericia/1', data={'numero_processo': '0001', 'nome_autor': 'Autor', 'data_pericia': '2024-03-01',
+                                    'tipo_acao': 'BPC/LOAS', 'valor_honorarios': '800', 'status_pagamento': 'Pago'})
+    client.get('/pericia/2/delete')
+    client.post('/api/pericias/bulk', content_type='application/x-ndjson', data='\n'.join(json.dumps(r) for r in [
+        {'numeroProcesso': 'B1', 'nomeAutor': 'Bulk', 'dataPericia': '2024-02-15', 'valorHonorarios': 300},
+        {'numeroProcesso': 'B2', 'nomeAutor': 'Bulk', 'dataPericia': '2024-03-15', 'valorHonorarios': 450,
+         'statusPagamento': 'Pago', 'tipoAcao': 'BPC/LOAS'},
+    ]))
+    # The oldest change in the feed is the untouched February pericia (1200)
+    registro = client.get('/api/sync?since=0').get_json()['changes'][0]
+    client.post('/api/sync', json={'changes': [dict(registro, valor_honorarios=900.0)]})
+
+    incremental = _resumos(app)
+    assert incremental == _recontado(app)
+    assert incremental[('2024-02', '', 'Pendente')] == (2, 1200.0)
+    assert incremental[('2024-03', 'BPC/LOAS', 'Pago')] == (2, 1250.0)
+
+
+def test_relatorio_por_mes_tipo_e_pagamento(client):
+    _nova(client, '2024-01-10', 500)
+    _nova(client, '2024-03-10', 350)
+    client.post('/pericia/2', data={'numero_processo': '0001', 'nome_autor': 'Autor', 'data_pericia': '2024-03-10',
+                                    'tipo_acao': 'Indenizatória', 'valor_honorarios': '350', 'status_pagamento': 'Pago'})
+
+    relatorio = client.get('/api/financeiro?de=2024-01&ate=2024-03').get_json()
+    assert [(m['mes'], m['total'], m['pago'], m['pendente']) for m in relatorio['meses']] == [
+        ('2024-01', 500.0, 0.0, 500.0), ('2024-02', 0.0, 0.0, 0.0), ('2024-03', 350.0, 350.0, 0.0)]
+    assert relatorio['total'] == 850.0 and relatorio['quantidade'] == 2
+    assert relatorio['por_tipo_acao'] == {'Não informado': {'quantidade': 1, 'total': 500.0},
+                                         'Indenizatória': {'quantidade': 1, 'total': 350.0}}
+    assert relatorio['por_pagamento']['Pago'] == {'quantidade': 1, 'total': 350.0}
+
+    so_pendentes = client.get('/api/financeiro?de=2024-01&ate=2024-03&status_pagamento=Pendente').get_json()
+    assert so_pendentes['total'] == 500.0
+
+
+def test_atraso_dos_pendentes(client):
+    hoje = datetime.utcnow()
+    _nova(client, hoje.strftime('%Y-%m-01'), 100)
+    _nova(client, f'{hoje.year - 1}-{hoje.month:02d}-01', 200)
+    _nova(client, f'{hoje.year + 1}-{hoje.month:02d}-01', 300)
+    atraso = client.get('/api/financeiro').get_json()['atraso_pendentes']
+    assert atraso['0-30']['total'] == 100.0
+    assert atraso['90+']['total'] == 200.0
+    assert atraso['a_vencer']['total'] == 300.0
+
+
+def test_parametros_invalidos(client):
+    assert client.get('/api/financeiro?de=2024-13').status_code == 400
+    assert client.get('/api/financeiro?de=2024-05&ate=2024-01').status_code == 400
+    assert client.get('/api/financeiro?ate=ontem').status_code == 400
+
+
+def test_laudo_nao_invalida_o_resumo(app, client, contar_consultas):
+    _nova(client, '2024-01-10', 500)
+    client.get('/api/pericias/resumo')
+    with app.app_context():
+        cache = backend._estado()['resumo']
+        versao = backend.db.session.get(backend.Pericia, 1).versao
+    assert client.patch('/api/pericia/1', json={'versao': versao, 'anamnese': '<p>Lombalgia.</p>'}).status_code == 200
+
+    antes = contar_consultas()
+    assert client.get('/api/pericias/resumo').get_json()['total'] == 500.0
+    assert contar_consultas() - antes == 1  # Only the counters
+    with app.app_context():
+        assert backend._estado()['resumo'] is cache
+
+    # A fee change does move the totals
+    client.post('/pericia/1', data={'numero_processo': '0001', 'nome_autor': 'Autor', 'valor_honorarios': '800'})
+    assert client.get('/api/pericias/resumo').get_json()['total'] == 800.0
@@ -0,0 +1,90 @@
+"""
+Bulk import (/api/pericias/bulk) of NDJSON and CSV: per-line error reports,
+pt-BR spreadsheets, the row-by-row retry of a failed batch, and the
+streamed export (/api/pericias/export).
+"""
+import csv
+import io
+import json
+
+import pytest
+
+import app as backend
+from conftest import criar_app
+
+
+@pytest.fixture
+def app(tmp_path):
+    return criar_app(tmp_path, BULK_BATCH_SIZE=3)
+
+
+def _importar(client, registros):
+    corpo = '\n'.join(r if isinstance(r, str) else json.dumps(r) for r in registros)
+    response = client.post('/api/pericias/bulk', content_type='application/x-ndjson', data=corpo)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def _pericias(app):
+    with app.app_context():
+        return {p.numero_processo: p for p in backend.Pericia.query}
+
+
+def test_erros_por_linha(app, client):
+    resultado = _importar(client, [
+        {'numeroProcesso': '0001', 'nomeAutor': 'Autor'},
+        '{"numeroProcesso": "0002", ',
+        {'numeroProcesso': '0003'},
+        {'numeroProcesso': '0004', 'nomeAutor': 'Autor', 'dataPericia': '31/02/2024'},
+        {'numeroProcesso': '0005', 'nomeAutor': 'Autor', 'dataPericia': '10/03/2024'},
+    ])
+    assert resultado['inseridos'] == 2
+    assert [e['linha'] for e in resultado['erros']] == [2, 3, 4]
+    assert resultado['erros'][0]['erro'].startswith('JSON inválido')
+    assert resultado['erros'][1]['erro'] == 'Campo obrigatório ausente: nome_autor'
+    assert resultado['erros'][2]['erro'].startswith('Valor inválido para data_pericia')
+    assert sorted(_pericias(app)) == ['0001', '0005']
+
+
+def test_csv_de_planilha_brasileira(app, client):
+    corpo = ('numeroProcesso;nomeAutor;dataPericia;valorHonorarios;statusPagamento\n'
+             '0001;José da Silva;10/03/2024;1.234,56;Pago\n'
+             '0002;Maria;;R$ 350,00;\n')
+    response = client.post('/api/pericias/bulk', content_type='text/csv', data=corpo.encode('utf-8-sig'))
+    assert response.get_json() == {'inseridos': 2, 'erros': []}
+
+    pericias = _pericias(app)
+    assert pericias['0001'].nome_autor == 'José da Silva' and pericias['0001'].valor_honorarios == 1234.56
+    assert pericias['0001'].data_pericia.date().isoformat() == '2024-03-10' and pericias['0001'].status == 'Agendado'
+    assert pericias['0002'].valor_honorarios == 350.0 and pericias['0002'].status_pagamento == 'Pendente'
+
+
+def test_lote_com_falha_e_refeito_linha_a_linha(app, client):
+    # The second batch (lines 4-5) breaks the unique uid; its valid line still goes in
+    resultado = _importar(client, [
+        {'numeroProcesso': f'000{i}', 'nomeAutor': 'Autor', 'uid': 'repetido' if i in (2, 5) else f'uid-{i}'}
+        for i in range(1, 6)
+    ])
+    assert resultado['inseridos'] == 4
+    [erro] = resultado['erros']
+    assert erro['linha'] == 5 and 'UNIQUE' in erro['erro']
+    assert sorted(_pericias(app)) == ['0001', '0002', '0003', '0004']
+    assert client.get('/api/pericias/resumo').get_json()['quantidade'] == 4
+
+
+def test_exportacao_em_fluxo(app, client):
+    _importar(client, [{'numeroProcesso': f'000{i}', 'nomeAutor': f'Autor {i}', 'anamnese': '<p>Refere dor.</p>'}
+                       for i in range(1, 5)])
+
+    ndjson = client.get('/api/pericias/export')
+    assert ndjson.is_streamed and ndjson.mimetype == 'application/x-ndjson'
+    registros = [json.loads(linha) for linha in ndjson.data.decode().splitlines()]
+    assert [r['numero_processo'] for r in registros] == ['0001', '0002', '0003', '0004']
+    assert registros[0]['nome_autor'] == 'Autor 1' and registros[0]['anamnese'] == '<p>Refere dor.</p>'
+
+    exportado = client.get('/api/pericias/export?format=csv')
+    assert exportado.is_streamed and exportado.mimetype == 'text/csv'
+    assert exportado.headers['Content-Disposition'] == 'attachment; filename=pericias.csv'
+    linhas = list(csv.reader(io.StringIO(exportado.data.decode())))
+    assert linhas[0] == [c.name for c in backend.Pericia.__table__.columns] + list(backend.SECOES_LAUDO)
+    assert len(linhas) == 5 and linhas[1][linhas[0].index('numero_processo')] == '0001'
@@ -0,0 +1,110 @@
+"""
+Background job queue: jobs commit with the change that needs them, run by
+priority, retry with backoff and are visible on /api/tarefas.
+"""
+import io
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as backend
+import jobs
+from conftest import criar_app
+
+execucoes = []
+
+
+@jobs.tarefa('teste_registrar')
+def _registrar(payload):
+    execucoes.append(payload['n'])
+
+
+@jobs.tarefa('teste_falhar')
+def _falhar(payload):
+    raise OSError('disco indisponível')
+
+
+@pytest.fixture(autouse=True)
+def _limpar():
+    execucoes.clear()
+
+
+def _enfileirar(app, tipo, **kwargs):
+    with app.app_context():
+        tarefa = app.extensions['tarefas'].enfileirar(tipo, **kwargs)
+        backend.db.session.commit()
+        return tarefa.id
+
+
+def test_remocao_de_documento_roda_em_segundo_plano(app, client):
+    client.post('/nova', data={'numero_processo': '0001', 'nome_autor': 'Autor'})
+    doc = client.post('/api/pericia/1/upload', data={'upload_document': (io.BytesIO(b'%PDF-1.4'), 'exame.pdf')},
+                      content_type='multipart/form-data').get_json()
+    caminho = os.path.join(app.config['UPLOAD_FOLDER'], doc['url'].rsplit('/', 1)[1])
+
+    client.get(doc['delete_url'])
+    assert os.path.exists(caminho)  # Only queued so far
+    assert [t['tipo'] for t in client.get('/api/tarefas?status=pendente').get_json()] == ['remover_blobs_orfaos']
+
+    assert app.extensions['tarefas'].executar_pendentes() == 1
+    assert not os.path.exists(caminho)
+
+
+def test_prioridade_e_ordem_de_chegada(app):
+    _enfileirar(app, 'teste_registrar', payload={'n': 1}, prioridade=jobs.PRIORIDADE_BAIXA)
+    _enfileirar(app, 'teste_registrar', payload={'n': 2})
+    _enfileirar(app, 'teste_registrar', payload={'n': 3}, prioridade=jobs.PRIORIDADE_ALTA)
+    _enfileirar(app, 'teste_registrar', payload={'n': 4})
+    app.extensions['tarefas'].executar_pendentes()
+    assert execucoes == [3, 2, 4, 1]
+
+
+def test_chave_evita_duplicatas_pendentes(app):
+    primeira = _enfileirar(app, 'teste_registrar', payload={'n': 1}, chave='x')
+    assert _enfileirar(app, 'teste_registrar', payload={'n': 1}, chave='x') == primeira
+    app.extensions['tarefas'].executar_pendentes()
+    assert _enfileirar(app, 'teste_registrar', payload={'n': 1}, chave='x') != primeira
+
+
+def test_falha_tenta_de_novo_e_depois_desiste(app, client):
+    id = _enfileirar(app, 'teste_falhar', max_tentativas=2)
+    fila = app.extensions['tarefas']
+
+    assert fila.executar_pendentes() == 1
+    estado = client.get(f'/api/tarefas/{id}').get_json()
+    assert estado['status'] == 'pendente' and estado['tentativas'] == 1
+    assert 'disco indisponível' in estado['erro']
+    assert fila.executar_pendentes() == 0  # Backing off
+
+    with app.app_context():
+        backend.db.session.get(backend.Tarefa, id).disponivel_em = datetime.utcnow()
+        backend.db.session.commit()
+    fila.executar_pendentes()
+    assert client.get(f'/api/tarefas/{id}').get_json()['status'] == 'falhou'
+
+
+def test_tarefa_de_worker_morto_volta_para_a_fila(app):
+    id = _enfileirar(app, 'teste_registrar', payload={'n': 1})
+    fila = app.extensions['tarefas']
+    assert fila.reservar()[0] == id  # Claimed, then the worker "dies"
+    assert fila.executar_pendentes() == 0
+
+    with app.app_context():
+        backend.db.session.get(backend.Tarefa, id).iniciada_em = datetime.utcnow() - timedelta(hours=1)
+        backend.db.session.commit()
+    fila._ultima_manutencao = 0
+    assert fila.executar_pendentes() == 1
+    assert execucoes == [1]
+
+
+def test_threads_do_processo_executam_a_fila(tmp_path):
+    app = criar_app(tmp_path, JOBS_WORKERS=1)
+    app.test_client().get('/')  # First request starts the workers
+    _enfileirar(app, 'teste_registrar', payload={'n': 7})
+    for _ in range(50):
+        if execucoes:
+            break
+        time.sleep(0.05)
+    assert execucoes == [7]
@@ -0,0 +1,102 @@
+"""
+Laudo sections live in laudo_secao, zlib-compressed when large: listings
+never read them, every write path still sees them as Pericia attributes,
+and migration 9 moves them out of an existing pericia table.
+"""
+import json
+import zlib
+
+from sqlalchemy import inspect, text
+
+import app as backend
+import migrations
+
+GRANDE = '<p>' + 'Refere dor lombar com irradiação para o membro inferior. ' * 100 + '</p>'
+
+
+def _nova(client):
+    client.post('/nova', data={'numero_processo': '0001', 'nome_autor': 'Autor'})
+    return 1
+
+
+def _secoes(app, pericia_id):
+    with app.app_context():
+        return {s.secao: s for s in backend.LaudoSecao.query.filter_by(pericia_id=pericia_id)}
+
+
+def test_secoes_gravadas_fora_da_pericia_e_comprimidas(app, client):
+    pericia_id = _nova(client)
+    client.post(f'/pericia/{pericia_id}', data={'numero_processo': '0001', 'nome_autor': 'Autor',
+                                                 'anamnese': GRANDE, 'conclusao': '<p>Apto.</p>'})
+
+    secoes = _secoes(app, pericia_id)
+    assert set(secoes) == {'anamnese', 'conclusao'}
+    assert secoes['anamnese'].compressao == 'zlib'
+    assert len(secoes['anamnese'].conteudo) < len(GRANDE) // 10
+    assert zlib.decompress(secoes['anamnese'].conteudo).decode() == GRANDE
+    assert secoes['conclusao'].compressao is None  # Too small to be worth it
+    with app.app_context():
+        assert not set(backend.SECOES_LAUDO) & {c['name'] for c in inspect(backend.db.engine).get_columns('pericia')}
+
+    assert GRANDE.encode() in client.get(f'/pericia/{pericia_id}').data
+    assert b'Apto.' in client.get(f'/pericia/{pericia_id}/ver').data
+
+
+def test_editar_so_o_laudo_muda_versao_e_busca(app, client):
+    pericia_id = _nova(client)
+    with app.app_context():
+        versao = backend.db.session.get(backend.Pericia, pericia_id).versao
+    client.post(f'/pericia/{pericia_id}', data={'numero_processo': '0001', 'nome_autor': 'Autor',
+                                                 'conclusao': '<p>Espondiloartrose</p>'})
+    with app.app_context():
+        assert backend.db.session.get(backend.Pericia, pericia_id).versao > versao
+    assert [p['id'] for p in client.get('/api/search?q=espondiloartrose').get_json()] == [pericia_id]
+
+    # Clearing a section removes its row and its search terms
+    client.post(f'/pericia/{pericia_id}', data={'numero_processo': '0001', 'nome_autor': 'Autor', 'conclusao': ''})
+    assert _secoes(app, pericia_id) == {}
+    assert client.get('/api/search?q=espondiloartrose').get_json() == []
+
+
+def test_importacao_exportacao_e_sync_levam_as_secoes(app, client):
+    client.post('/api/pericias/bulk', content_type='application/x-ndjson', data=json.dumps(
+        {'numeroProcesso': 'B1', 'nomeAutor': 'Bulk', 'anamnese': GRANDE, 'exameFisico': '<p>Lasègue +</p>'}))
+
+    exportado = json.loads(client.get('/api/pericias/export').data.decode().splitlines()[0])
+    assert exportado['anamnese'] == GRANDE
+    assert exportado['exame_fisico'] == '<p>Lasègue +</p>'
+    assert exportado['discussao'] is None
+
+    registro = client.get('/api/sync').get_json()['changes'][0]
+    assert registro['anamnese'] == GRANDE
+    assert 'anamnese' not in json.loads(exportado['extras'] or '{}')
+
+    registro['exame_fisico'] = '<p>Lasègue negativo</p>'
+    assert client.post('/api/sync', json={'changes': [registro]}).get_json()['applied']
+    assert client.get('/api/sync').get_json()['changes'][0]['exame_fisico'] == '<p>Lasègue negativo</p>'
+    assert [p['numero_processo'] for p in client.get('/api/search?q=lombar').get_json()] == ['B1']
+
+
+def test_migracao_move_secoes_de_banco_existente(app):
+    with app.app_context():
+        engine = backend.db.engine
+    # Back to version 8: the sections as pericia columns
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE laudo_secao"))
+        conn.execute(text("DELETE FROM schema_version WHERE versao >= 9"))
+        for secao in backend.SECOES_LAUDO:
+            conn.execute(text(f"ALTER TABLE pericia ADD COLUMN {secao} TEXT"))
+        conn.execute(text(
+            "INSERT INTO pericia (id, numero_processo, nome_autor, versao, anamnese, conclusao, quesitos) VALUES "
+            "(1, '1', 'A', 1, :grande, '<p>Apto.</p>', ''), (2, '2', 'B', 1, NULL, NULL, NULL)"
+        ), {'grande': GRANDE})
+
+    assert migrations.migrar(engine, backend.db.metadata, lote=1, log=lambda m: None)[0] == 9
+
+    with app.app_context():
+        assert not set(backend.SECOES_LAUDO) & {c['name'] for c in inspect(engine).get_columns('pericia')}
+        assert set(_secoes(app, 1)) == {'anamnese', 'conclusao'}
+        assert _secoes(app, 1)['anamnese'].compressao == 'zlib'
+        pericia = backend.db.session.get(backend.Pericia, 1)
+        assert (pericia.anamnese, pericia.conclusao, pericia.quesitos) == (GRANDE, '<p>Apto.</p>', None)
+        assert _secoes(app, 2) == {}
@@ -0,0 +1,71 @@
+"""
+Keyset pagination of the dashboard and /api/pericias over (created_at, id),
+newest first: no row repeated or skipped, even across ties in created_at.
+"""
+import html
+import re
+from datetime import datetime
+
+import pytest
+
+import app as backend
+
+MOMENTOS = (datetime(2023, 5, 1, 9), datetime(2023, 5, 1, 10), datetime(2023, 5, 2, 9))
+
+
+@pytest.fixture
+def empatadas(app):
+    # 25 pericias sharing three created_at values, statuses alternating
+    with app.app_context():
+        backend.db.session.execute(backend.db.insert(backend.Pericia), [{
+            'numero_processo': f'{i:04d}', 'nome_autor': f'Autor {i}', 'created_at': MOMENTOS[i % 3],
+            'status': 'Concluido' if i % 2 else 'Aguardando', 'status_pagamento': 'Pendente', 'versao': 1,
+        } for i in range(25)])
+        backend.db.session.commit()
+        return [(p.id, p.status) for p in backend.Pericia.query.order_by(
+            backend.Pericia.created_at.desc(), backend.Pericia.id.desc())]
+
+
+def _paginas(client, url):
+    ids, cursor, paginas = [], None, 0
+    while True:
+        pagina = client.get(url + (f'&cursor={cursor}' if cursor else '')).get_json()
+        ids += [item['id'] for item in pagina['items']]
+        paginas += 1
+        cursor = pagina['next_cursor']
+        if not cursor:
+            return ids, paginas
+
+
+def test_paginas_cobrem_empates_sem_repetir(empatadas, client):
+    ids, paginas = _paginas(client, '/api/pericias?per_page=4')
+    assert ids == [pk for pk, _ in empatadas]
+    assert paginas == 7
+
+
+def test_paginas_com_filtro(empatadas, client):
+    ids, _ = _paginas(client, '/api/pericias?per_page=3&status=Concluido')
+    assert ids == [pk for pk, status in empatadas if status == 'Concluido']
+
+
+def test_ultima_pagina_exata_nao_tem_cursor(empatadas, client):
+    pagina = client.get('/api/pericias?per_page=25').get_json()
+    assert len(pagina['items']) == 25 and pagina['next_cursor'] is None
+
+
+def test_cursor_invalido(client):
+    response = client.get('/api/pericias?cursor=ontem')
+    assert response.status_code == 400 and response.get_json() == {'error': 'Invalid cursor'}
+    assert client.get('/?cursor=ontem').status_code == 200  # The dashboard falls back to the first page
+
+
+def test_painel_segue_o_cursor(empatadas, client):
+    def autores(pagina):
+        return re.findall(r'>(Autor \d+)</p>', pagina)
+
+    primeira = client.get('/?per_page=10').data.decode()
+    [link] = re.findall(r'href="(/\?[^"]*cursor=[^"]+)"', primeira)
+    segunda = client.get(html.unescape(link)).data.decode()
+
+    todas = autores(client.get('/?per_page=25').data.decode())
+    assert autores(primeira) + autores(segunda) == todas[:20]
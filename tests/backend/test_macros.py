@@ -0,0 +1,55 @@
+"""
+Macro cache: built once per version of the 'macros' counter, invalidated by
+the write routes (from any worker), and served with ETags.
+"""
+import app as backend
+from conftest import criar_app
+
+
+def _nova(client, titulo, categoria='anamnese'):
+    return client.post('/macros/nova', data={'titulo': titulo, 'categoria': categoria, 'conteudo': f'<p>{titulo}</p>'})
+
+
+def test_api_responde_304_enquanto_a_categoria_nao_muda(client):
+    _nova(client, 'Coluna')
+    primeira = client.get('/api/macros/anamnese')
+    assert [m['titulo'] for m in primeira.get_json()] == ['Coluna']
+    etag = primeira.headers['ETag']
+
+    repetida = client.get('/api/macros/anamnese', headers={'If-None-Match': etag})
+    assert repetida.status_code == 304
+    assert repetida.data == b''
+
+    _nova(client, 'Joelho')
+    alterada = client.get('/api/macros/anamnese', headers={'If-None-Match': etag})
+    assert alterada.status_code == 200
+    assert [m['titulo'] for m in alterada.get_json()] == ['Coluna', 'Joelho']
+
+
+def test_categoria_vazia(client):
+    response = client.get('/api/macros/conclusao')
+    assert response.status_code == 200
+    assert response.get_json() == []
+    assert response.headers['ETag']
+
+
+def test_cache_evita_consultas_e_remocao_invalida(app, client, contar_consultas):
+    _nova(client, 'Coluna')
+    client.get('/api/macros/anamnese')
+    antes = contar_consultas()
+    client.get('/api/macros/anamnese')
+    assert contar_consultas() - antes == 1  # Only the version check
+
+    with app.app_context():
+        macro_id = backend.Macro.query.one().id
+    client.get(f'/macros/{macro_id}/delete')
+    assert client.get('/api/macros/anamnese').get_json() == []
+
+
+def test_escrita_em_outro_worker_invalida_o_cache(tmp_path):
+    # Two apps on one database stand in for two worker processes
+    leitor = criar_app(tmp_path)
+    escritor = criar_app(tmp_path)
+    assert leitor.test_client().get('/api/macros/anamnese').get_json() == []
+    _nova(escritor.test_client(), 'Coluna')
+    assert [m['titulo'] for m in leitor.test_client().get('/api/macros/anamnese').get_json()] == ['Coluna']
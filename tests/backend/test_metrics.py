@@ -0,0 +1,77 @@
+"""
+Instrumentation: per-route and per-statement histograms on /metrics, and the
+slow-query log.
+"""
+import logging
+import re
+
+import metrics
+from conftest import criar_app
+
+
+def _serie(texto, nome, **rotulos):
+    """Value of the sample whose labels include the given ones."""
+    for linha in texto.splitlines():
+        if linha.startswith(nome + '{') and all(f'{k}="{v}"' in linha for k, v in rotulos.items()):
+            return float(linha.rsplit(' ', 1)[1])
+    return None
+
+
+def test_metricas_por_rota(client):
+    for i in range(3):
+        client.post('/nova', data={'numero_processo': f'000{i}', 'nome_autor': 'Autor'})
+    assert client.get('/api/pericias').status_code == 200
+    texto = client.get('/metrics').get_data(as_text=True)
+
+    assert _serie(texto, 'pericias_http_request_duration_seconds_count', method='GET', route='/api/pericias', status='200') == 1
+    assert _serie(texto, 'pericias_http_request_duration_seconds_count', method='POST', route='/nova', status='302') == 3
+    assert _serie(texto, 'pericias_http_request_sql_statements_sum', route='/api/pericias') >= 1
+    assert _serie(texto, 'pericias_http_request_sql_rows_sum', route='/nova') >= 3  # Rows inserted
+    assert _serie(texto, 'pericias_http_request_sql_rows_sum', route='/api/pericias') == 0  # Reads are not buffered
+    assert '# TYPE pericias_sql_statement_duration_seconds histogram' in texto
+
+
+def test_linhas_lidas_com_contagem_ligada(tmp_path):
+    client = criar_app(tmp_path, METRICS_COUNT_SELECT_ROWS=True).test_client()
+    for i in range(3):
+        client.post('/nova', data={'numero_processo': f'000{i}', 'nome_autor': 'Autor'})
+    assert len(client.get('/api/pericias').get_json()['items']) == 3
+    texto = client.get('/metrics').get_data(as_text=True)
+    assert _serie(texto, 'pericias_http_request_sql_rows_sum', route='/api/pericias') >= 3
+
+
+def test_tempo_de_template(client):
+    client.get('/')
+    texto = client.get('/metrics').get_data(as_text=True)
+    assert _serie(texto, 'pericias_template_render_seconds_count', template='index.html') == 1
+
+
+def test_impressao_agrupa_literais_e_listas():
+    a = metrics.impressao("SELECT * FROM pericia WHERE id IN (?, ?, ?) AND status = 'Agendado' LIMIT 50")
+    b = metrics.impressao("SELECT *  FROM pericia WHERE id IN (?, ?) AND status = 'Concluido' LIMIT 10")
+    assert a == b
+    assert a[1] == "SELECT * FROM pericia WHERE id IN (...) AND status = ? LIMIT ?"
+
+
+def test_buckets_sao_cumulativos():
+    histograma = metrics.Histograma('teste', 'Teste.', ('rota',), (1, 5))
+    for valor in (0.5, 1, 3, 10):
+        histograma.observar(('/',), valor)
+    linhas = histograma.exportar()
+    assert 'teste_bucket{rota="/",le="1"} 2' in linhas
+    assert 'teste_bucket{rota="/",le="5"} 3' in linhas
+    assert 'teste_bucket{rota="/",le="+Inf"} 4' in linhas
+    assert 'teste_sum{rota="/"} 14.500000' in linhas
+
+
+def test_consulta_lenta_registra_sql_e_parametros(tmp_path, caplog):
+    client = criar_app(tmp_path, SLOW_QUERY_MS=0).test_client()
+    with caplog.at_level(logging.WARNING):
+        client.get('/api/pericias?status=Concluido')
+    assert re.search(r"SQL lenta .*FROM pericia.*parâmetros: .*'Concluido'", caplog.text)
+    texto = client.get('/metrics').get_data(as_text=True)
+    assert 'pericias_sql_slow_statements_total{fingerprint=' in texto
+
+
+def test_desligado(tmp_path):
+    assert criar_app(tmp_path, METRICS_ENABLED=False).test_client().get('/metrics').status_code == 404
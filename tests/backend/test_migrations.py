@@ -0,0 +1,121 @@
+"""
+Versioned migrations (migrations.py) run on a database created by the
+original app, before any of them existed: --dry-run only reports, a real run
+brings it to the latest schema with its data intact, and a rerun is a no-op.
+"""
+import sqlite3
+
+import pytest
+from sqlalchemy import inspect, text
+
+import app as backend
+import migrations
+from conftest import criar_app
+
+BASELINE = """
+CREATE TABLE pericia (
+    id INTEGER NOT NULL, numero_processo VARCHAR(50) NOT NULL, nome_autor VARCHAR(100) NOT NULL,
+    data_pericia DATETIME, status VARCHAR(20), tipo_acao VARCHAR(50), cpf VARCHAR(14), rg VARCHAR(20),
+    data_nascimento DATETIME, escolaridade VARCHAR(50), profissao VARCHAR(100), estado_civil VARCHAR(20),
+    endereco_cep VARCHAR(10), endereco_cidade VARCHAR(100), endereco_uf VARCHAR(2),
+    objetivo TEXT, metodologia TEXT, anamnese TEXT, antecedentes TEXT, exame_fisico TEXT, discussao TEXT,
+    conclusao TEXT, quesitos TEXT, bibliografia TEXT,
+    valor_honorarios FLOAT, status_pagamento VARCHAR(20), created_at DATETIME, PRIMARY KEY (id)
+);
+CREATE INDEX ix_pericia_status ON pericia (status);
+CREATE INDEX ix_pericia_status_pagamento ON pericia (status_pagamento);
+CREATE INDEX ix_pericia_created_at ON pericia (created_at);
+CREATE TABLE documento (
+    id INTEGER NOT NULL, filename VARCHAR(255) NOT NULL, original_name VARCHAR(255) NOT NULL,
+    upload_date DATETIME, pericia_id INTEGER NOT NULL, PRIMARY KEY (id), FOREIGN KEY(pericia_id) REFERENCES pericia (id)
+);
+CREATE TABLE macro (
+    id INTEGER NOT NULL, titulo VARCHAR(100) NOT NULL, conteudo TEXT NOT NULL, categoria VARCHAR(50) NOT NULL,
+    PRIMARY KEY (id)
+);
+"""
+
+LONGA = '<p>Paciente refere lombalgia crônica, com irradiação para o membro inferior.</p>' * 40
+
+
+@pytest.fixture
+def app(tmp_path):
+    banco = sqlite3.connect(tmp_path / 'test.db')
+    banco.executescript(BASELINE)
+    banco.executemany(
+        "INSERT INTO pericia (numero_processo, nome_autor, status, anamnese, conclusao, valor_honorarios, "
+        "status_pagamento, data_pericia, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [(f'{i:04d}', f'Autor {i}', 'Concluido', LONGA if i == 1 else '<p>Curta.</p>', '<p>Apto.</p>', 500.0,
+          'Pago' if i % 2 else 'Pendente', '2023-0%d-10 09:00:00.000000' % (i % 3 + 1), '2023-01-01 08:00:00.000000')
+         for i in range(1, 8)])
+    banco.execute("INSERT INTO documento (filename, original_name, pericia_id) VALUES ('antigo.pdf', 'antigo.pdf', 1)")
+    banco.execute("INSERT INTO macro (titulo, conteudo, categoria) VALUES ('Normal', '<p>Sem alterações.</p>', 'exame_fisico')")
+    banco.commit()
+    banco.close()
+    return criar_app(tmp_path)
+
+
+def _migrar(app, *args):
+    resultado = app.test_cli_runner().invoke(args=['migrar', '--lote', '3', *args])
+    assert resultado.exit_code == 0, resultado.output
+    return resultado.output
+
+
+def _colunas(app, tabela):
+    with app.app_context():
+        return {c['name'] for c in inspect(backend.db.engine).get_columns(tabela)}
+
+
+def test_dry_run_so_relata(app):
+    saida = _migrar(app, '--dry-run')
+
+    assert 'Versão atual do schema: 0' in saida
+    assert f'{len(migrations.MIGRACOES)} migração(ões) pendente(s)' in saida
+    assert 'ALTER TABLE pericia ADD COLUMN uid VARCHAR(64)' in saida
+    assert 'backfill: pericia -> laudo_secao (7 linhas)' in saida
+    assert 'CREATE TABLE laudo_secao' in saida
+    # Nothing was touched
+    assert 'uid' not in _colunas(app, 'pericia') and 'anamnese' in _colunas(app, 'pericia')
+    with app.app_context():
+        assert not inspect(backend.db.engine).has_table('schema_version')
+
+
+def test_migra_a_base_original(app, client):
+    saida = _migrar(app)
+    assert f'[{migrations.MIGRACOES[-1][0]:03d}]' in saida
+
+    with app.app_context():
+        engine = backend.db.engine
+        with engine.connect() as conn:
+            assert migrations.versao_atual(conn) == migrations.MIGRACOES[-1][0]
+            assert migrations.pendentes(conn) == []
+        # Schema: the laudo left pericia for laudo_secao; new tables and indexes are there
+        colunas = _colunas(app, 'pericia')
+        assert {'uid', 'versao', 'sync_seq'} <= colunas and not colunas & set(backend.SECOES_LAUDO)
+        assert 'blob_id' in _colunas(app, 'documento')
+        indices = {i['name'] for i in inspect(engine).get_indexes('pericia')}
+        assert {'ix_pericia_status_created_at', 'ix_pericia_resumo', 'ix_pericia_data_pericia'} <= indices
+        assert 'ix_pericia_status' not in indices
+
+        # Data: every row kept, filled in by the backfills
+        pericias = backend.Pericia.query.order_by(backend.Pericia.id).all()
+        assert len(pericias) == 7
+        assert len({p.uid for p in pericias}) == 7 and [p.sync_seq for p in pericias] == list(range(1, 8))
+        assert pericias[0].anamnese == LONGA and pericias[0].secoes['anamnese'].compressao == 'zlib'
+        assert pericias[1].conclusao == '<p>Apto.</p>'
+        assert [d.original_name for d in pericias[0].documents] == ['antigo.pdf']
+        assert backend.db.session.scalar(text('SELECT sum(quantidade) FROM resumo_mensal')) == 7
+
+    # The app works on it, search index included
+    assert client.get('/').status_code == 200
+    assert [r['id'] for r in client.get('/api/search?q=irradiacao').get_json()] == [1]
+    assert client.get('/api/pericias/resumo').get_json()['quantidade'] == 7
+
+    # A rerun has nothing to do
+    assert '0 migração(ões) pendente(s)' in _migrar(app)
+
+
+def test_app_avisa_migracoes_pendentes(tmp_path, caplog):
+    sqlite3.connect(tmp_path / 'test.db').executescript(BASELINE)
+    criar_app(tmp_path)
+    assert 'migração(ões) pendente(s)' in caplog.text
@@ -0,0 +1,57 @@
+"""
+Thumbnails of uploaded images: generated by a background job, answered with
+202 and Retry-After until then, and served as JPEG with an ETag per size.
+"""
+import io
+
+import pytest
+
+import thumbnails
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def _imagem():
+    saida = io.BytesIO()
+    Image.new('RGB', (800, 600), (200, 40, 40)).save(saida, 'PNG')
+    return saida.getvalue()
+
+
+@pytest.fixture
+def pericia(client):
+    client.post('/nova', data={'numero_processo': '0001', 'nome_autor': 'Autor'})
+    return 1
+
+
+def _enviar(client, pericia, conteudo, nome):
+    response = client.post(f'/api/pericia/{pericia}/upload', data={'upload_document': (io.BytesIO(conteudo), nome)})
+    return response.get_json()['id']
+
+
+def test_miniatura_gerada_em_segundo_plano(app, client, pericia):
+    doc = _enviar(client, pericia, _imagem(), 'raio-x.png')
+    tamanho = thumbnails.TAMANHOS[0]
+
+    pendente = client.get(f'/uploads/{doc}/thumb/{tamanho}')
+    assert pendente.status_code == 202 and pendente.headers['Retry-After']
+
+    with app.app_context():
+        assert app.extensions['tarefas'].executar_pendentes() == 1
+    for size in thumbnails.TAMANHOS:
+        response = client.get(f'/uploads/{doc}/thumb/{size}')
+        assert response.status_code == 200 and response.mimetype == 'image/jpeg'
+        assert response.headers['ETag'].endswith(f'-{size}"')
+        with Image.open(io.BytesIO(response.data)) as miniatura:
+            assert max(miniatura.size) <= size
+
+    etag = client.get(f'/uploads/{doc}/thumb/{tamanho}').headers['ETag']
+    assert client.get(f'/uploads/{doc}/thumb/{tamanho}', headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_tamanho_ou_documento_sem_miniatura(client, pericia):
+    imagem = _enviar(client, pericia, _imagem(), 'raio-x.png')
+    assert client.get(f'/uploads/{imagem}/thumb/100').status_code == 404
+
+    texto = _enviar(client, pericia, b'Relatorio medico', 'relatorio.txt')
+    assert client.get(f'/uploads/{texto}/thumb/{thumbnails.TAMANHOS[0]}').status_code == 404
+    assert client.get(f'/uploads/99/thumb/{thumbnails.TAMANHOS[0]}').status_code == 404
@@ -0,0 +1,79 @@
+"""
+Query counts per route: they must not grow with the number of documents or
+macros, and QUERY_BUDGET is enforced (strict in these tests).
+"""
+import logging
+
+import pytest
+
+import app as backend
+from conftest import criar_app
+
+
+def _pericia_com_documentos(quantidade):
+    db = backend.db
+    pericia = backend.Pericia(numero_processo='0001', nome_autor='Autor')
+    db.session.add(pericia)
+    db.session.flush()
+    for i in range(quantidade):
+        db.session.add(backend.Documento(filename=f'doc{i}.pdf', original_name=f'doc{i}.pdf', pericia_id=pericia.id))
+    for i in range(quantidade):
+        db.session.add(backend.Macro(titulo=f'Macro {i}', conteudo='<p>x</p>', categoria='anamnese'))
+    db.session.commit()
+    return pericia.id
+
+
+@pytest.mark.parametrize('url', ['/pericia/{id}', '/', '/api/pericias'])
+def test_consultas_nao_crescem_com_documentos(app, client, contar_consultas, url):
+    contagens = []
+    for quantidade in (1, 30):
+        with app.app_context():
+            pericia_id = _pericia_com_documentos(quantidade)
+        antes = contar_consultas()
+        assert client.get(url.format(id=pericia_id)).status_code == 200
+        contagens.append(contar_consultas() - antes)
+    assert contagens[0] == contagens[1], contagens
+
+
+def test_edicao_carrega_tudo_em_quatro_consultas(app, client, contar_consultas):
+    with app.app_context():
+        pericia_id = _pericia_com_documentos(20)
+    client.get(f'/pericia/{pericia_id}')  # Warms the macro cache
+    antes = contar_consultas()
+    response = client.get(f'/pericia/{pericia_id}')
+    assert contar_consultas() - antes == 4  # pericia, its documents, its laudo sections, macro cache version
+    assert response.data.count(b'doc19.pdf') > 0
+
+
+def test_salvar_edicao_cabe_no_orcamento(app, client):
+    with app.app_context():
+        pericia_id = _pericia_com_documentos(3)
+    # Every section written and the fee moved to a month with no rollup yet: the most statements a save sends
+    response = client.post(f'/pericia/{pericia_id}', data={
+        'numero_processo': '0002', 'nome_autor': 'Outro', 'data_pericia': '2031-05-01', 'valor_honorarios': '700',
+        **{secao: f'<p>{secao}</p>' for secao in backend.SECOES_LAUDO},
+    })
+    assert response.status_code == 302
+
+
+def test_listagem_traz_contagem_de_documentos(app, client):
+    with app.app_context():
+        pericia_id = _pericia_com_documentos(4)
+        backend.db.session.add(backend.Pericia(numero_processo='0002', nome_autor='Sem anexos'))
+        backend.db.session.commit()
+    itens = {item['id']: item for item in client.get('/api/pericias').get_json()['items']}
+    assert itens[pericia_id]['documentos'] == 4
+    assert [item['documentos'] for item in itens.values() if item['id'] != pericia_id] == [0]
+
+
+def test_orcamento_estourado_falha_em_modo_estrito(tmp_path):
+    client = criar_app(tmp_path, QUERY_BUDGET=1).test_client()
+    with pytest.raises(RuntimeError, match='orçamento: 1'):
+        client.get('/')
+
+
+def test_orcamento_estourado_so_registra_fora_do_modo_estrito(tmp_path, caplog):
+    client = criar_app(tmp_path, QUERY_BUDGET=1, QUERY_BUDGET_STRICT=False).test_client()
+    with caplog.at_level(logging.WARNING):
+        assert client.get('/').status_code == 200
+    assert 'main.index fez' in caplog.text
@@ -0,0 +1,129 @@
+"""
+Query-plan regression tests: every statement a route runs against a large
+seeded database goes through EXPLAIN QUERY PLAN, and the test fails when a
+filtered query scans a whole table, or a paginated query sorts its full
+result in a temp b-tree or never seeks into an index.
+"""
+import re
+
+import pytest
+
+import app as backend
+from conftest import criar_app, semear
+
+PERICIAS = 20000
+
+# {placeholders} are filled from the seeded rows; destructive routes come last
+ROTAS = [
+    ('GET', '/'),
+    ('GET', '/?status=Concluido'),
+    ('GET', '/?cursor={cursor}'),
+    ('GET', '/?status=Agendado&cursor={cursor}'),
+    ('GET', '/?search=Silva'),
+    ('GET', '/?arquivo=1&cursor={cursor}'),
+    ('GET', '/api/pericias?status=Em+Andamento&per_page=100'),
+    ('GET', '/api/pericias?cursor={cursor}'),
+    ('GET', '/api/pericias/resumo'),
+    ('GET', '/api/pericias/resumo?status=Concluido'),
+    ('GET', '/api/search?q=lombalgia'),
+    ('GET', '/api/financeiro'),
+    ('GET', '/api/financeiro?de=2021-01&ate=2022-06&status_pagamento=Pendente'),
+    ('GET', '/api/pericias/export?status=Concluido'),
+    ('GET', '/pericia/{pericia}'),
+    ('GET', '/pericia/{pericia}/ver'),
+    ('GET', '/api/agenda?start=2022-03-01T00:00:00-03:00&end=2022-04-12T00:00:00-03:00'),
+    ('GET', '/agenda.ics'),
+    ('GET', '/api/sync?since={since}'),
+    ('POST', '/api/sync'),
+    ('GET', '/uploads/{blob}'),
+    ('GET', '/uploads/{documento}/thumb/128'),
+    ('GET', '/macros'),
+    ('GET', '/api/macros/anamnese'),
+    ('GET', '/pericia/{outra}/documento/{documento}/delete'),
+    ('GET', '/pericia/{outra}/delete'),
+]
+
+
+@pytest.fixture(scope='module')
+def ambiente(tmp_path_factory):
+    app = criar_app(tmp_path_factory.mktemp('planos'))
+    with app.app_context():
+        semear(PERICIAS)
+        pericia = backend.Pericia.query.order_by(backend.Pericia.created_at.desc()).offset(100).first()
+        documento = backend.Documento.query.first()
+        with open(f"{app.config['UPLOAD_FOLDER']}/{documento.filename}", 'wb') as f:
+            f.write(b'%PDF-1.4 teste')
+        valores = {
+            'pericia': pericia.id,
+            'cursor': backend._encode_cursor(pericia),
+            'since': PERICIAS - 50,
+            'blob': documento.filename,
+            'documento': documento.id,
+            'outra': documento.pericia_id,
+            'uid': pericia.uid,
+        }
+
+        consultas = []
+
+        @backend.db.event.listens_for(backend.db.engine, 'before_cursor_execute')
+        def _capturar(conn, cursor, statement, parameters, context, executemany):
+            if not executemany and re.match(r'\s*(SELECT|UPDATE|DELETE|WITH)\b', statement, re.I):
+                consultas.append((statement, parameters))
+
+    return app, valores, consultas
+
+
+def _plano(app, statement, parameters):
+    with app.app_context():
+        with backend.db.engine.connect() as conn:
+            return [row[3] for row in conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters)]
+
+
+def _problemas(statement, plano):
+    sql = ' '.join(statement.split()).upper()
+    fts = any('VIRTUAL TABLE' in detalhe for detalhe in plano)
+    problemas = []
+    for detalhe in plano:
+        # Statements without WHERE read the whole table on purpose (export, macro list)
+        if re.fullmatch(r'SCAN \w+', detalhe) and ' WHERE ' in sql:
+            problemas.append(detalhe)
+        # Ranking FTS matches needs a sort; anything else paginated must come ordered from an index
+        if detalhe.startswith('USE TEMP B-TREE FOR ORDER BY') and ' LIMIT ' in sql and not fts:
+            problemas.append(detalhe)
+    # A filtered page that never seeks walks the index from the start (e.g. an OR-ed keyset cursor)
+    if ' WHERE ' in sql and ' LIMIT ' in sql and not fts and not any(d.startswith('SEARCH') for d in plano):
+        problemas.append('no SEARCH step')
+    return problemas
+
+
+@pytest.mark.parametrize('metodo, url', ROTAS)
+def test_rota_sem_full_scan(ambiente, metodo, url):
+    app, valores, consultas = ambiente
+    client = app.test_client()
+    consultas.clear()
+
+    if metodo == 'POST':
+        response = client.post(url, json={'changes': [{'id': valores['uid'], 'versao': 1, 'nomeAutor': 'Editado'}]})
+    else:
+        response = client.get(url.format(**valores))
+    assert response.status_code < 500, response.data
+    assert consultas, 'the route ran no SQL'
+
+    falhas = []
+    for statement, parameters in consultas:
+        plano = _plano(app, statement, parameters)
+        if _problemas(statement, plano):
+            falhas.append(f"{' '.join(statement.split())}\n    -> {plano}")
+    assert not falhas, '\n'.join(falhas)
+
+
+def test_resumo_usa_indice_de_cobertura(ambiente):
+    app, _, _ = ambiente
+    with app.app_context():
+        query = backend.Pericia.query.with_entities(
+            backend.Pericia.status_pagamento, backend.Pericia.status,
+            backend.func.count(backend.Pericia.id), backend.func.sum(backend.Pericia.valor_honorarios)
+        ).group_by(backend.Pericia.status_pagamento, backend.Pericia.status)
+        compilado = query.statement.compile(backend.db.engine)
+        plano = _plano(app, str(compilado), tuple(compilado.params.values()))
+    assert any('COVERING INDEX ix_pericia_resumo' in detalhe for detalhe in plano), plano
@@ -0,0 +1,94 @@
+"""
+Two-way sync with the PWA (/api/sync): pushes checked against the versao the
+client last saw, and a change feed that also carries deletes (tombstones).
+"""
+import app as backend
+
+
+def _enviar(client, changes=(), deleted=()):
+    response = client.post('/api/sync', json={'changes': list(changes), 'deleted': list(deleted)})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def _puxar(client, since=0, **params):
+    return client.get('/api/sync', query_string={'since': since, **params}).get_json()
+
+
+def test_envio_e_recebimento(client):
+    resultado = _enviar(client, [{'id': 'pwa-1', 'numeroProcesso': '0001', 'nomeAutor': 'Autor', 'status': 'Agendado'}])
+    assert resultado == {'applied': [{'id': 'pwa-1', 'versao': 1}], 'conflicts': [], 'errors': []}
+
+    feed = _puxar(client)
+    [registro] = feed['changes']
+    assert registro['id'] == 'pwa-1' and registro['versao'] == 1
+    assert registro['numero_processo'] == '0001' and registro['status'] == 'Agendado'
+    assert feed['deleted'] == [] and feed['has_more'] is False
+    assert _puxar(client, feed['cursor']) == {'changes': [], 'deleted': [], 'cursor': feed['cursor'], 'has_more': False}
+
+    # Applying the change it last saw bumps versao and moves the record to the end of the feed
+    resultado = _enviar(client, [{'id': 'pwa-1', 'versao': 1, 'numeroProcesso': '0001', 'nomeAutor': 'Outro'}])
+    assert resultado['applied'] == [{'id': 'pwa-1', 'versao': 2}]
+    assert [r['nome_autor'] for r in _puxar(client, feed['cursor'])['changes']] == ['Outro']
+
+
+def test_versao_desatualizada_vira_conflito(app, client):
+    _enviar(client, [{'id': 'pwa-1', 'numeroProcesso': '0001', 'nomeAutor': 'Autor'}])
+    # Edited on the server in the meantime
+    client.post('/pericia/1', data={'numero_processo': '0001', 'nome_autor': 'Editado no servidor'})
+
+    resultado = _enviar(client, [{'id': 'pwa-1', 'versao': 1, 'numeroProcesso': '0001', 'nomeAutor': 'Editado no PWA'}])
+    [conflito] = resultado['conflicts']
+    assert resultado['applied'] == []
+    assert conflito['id'] == 'pwa-1' and conflito['motivo'] == 'versao'
+    assert conflito['servidor']['nome_autor'] == 'Editado no servidor' and conflito['servidor']['versao'] == 2
+    with app.app_context():
+        assert backend.db.session.get(backend.Pericia, 1).nome_autor == 'Editado no servidor'
+
+    # Deleting from a stale versao is a conflict too
+    resultado = _enviar(client, deleted=[{'id': 'pwa-1', 'versao': 1}])
+    assert [c['motivo'] for c in resultado['conflicts']] == ['versao']
+    with app.app_context():
+        assert backend.db.session.get(backend.Pericia, 1) is not None
+
+
+def test_remocoes_chegam_pelo_feed(app, client):
+    _enviar(client, [{'id': f'pwa-{i}', 'numeroProcesso': f'000{i}', 'nomeAutor': 'Autor'} for i in range(3)])
+    cursor = _puxar(client)['cursor']
+
+    assert client.get('/pericia/1/delete').status_code == 302  # Deleted on the server
+    assert _enviar(client, deleted=[{'id': 'pwa-1', 'versao': 1}])['applied'] == [{'id': 'pwa-1', 'versao': None}]
+
+    feed = _puxar(client, cursor)
+    assert feed['changes'] == [] and feed['deleted'] == ['pwa-0', 'pwa-1']
+    with app.app_context():
+        assert backend.PericiaRemovida.query.count() == 2
+
+    # Changing a record deleted elsewhere: conflict, not a resurrection
+    resultado = _enviar(client, [{'id': 'pwa-0', 'versao': 1, 'numeroProcesso': '0000', 'nomeAutor': 'Autor'}])
+    assert resultado['conflicts'] == [{'id': 'pwa-0', 'motivo': 'removido', 'servidor': None}]
+    # Deleting it again is a no-op
+    assert _enviar(client, deleted=[{'id': 'pwa-0', 'versao': 1}])['applied'] == [{'id': 'pwa-0', 'versao': None}]
+
+
+def test_feed_paginado_intercala_alteracoes_e_remocoes(client):
+    _enviar(client, [{'id': f'pwa-{i}', 'numeroProcesso': f'000{i}', 'nomeAutor': 'Autor'} for i in range(5)])
+    client.get('/pericia/2/delete')
+    _enviar(client, [{'id': 'pwa-0', 'versao': 1, 'numeroProcesso': '0000', 'nomeAutor': 'Outro'}])
+
+    vistos, cursor = [], 0
+    while True:
+        pagina = _puxar(client, cursor, limit=2)
+        vistos += [('alterado', r['id']) for r in pagina['changes']] + [('removido', uid) for uid in pagina['deleted']]
+        cursor = pagina['cursor']
+        if not pagina['has_more']:
+            break
+    # Each record once, at its latest position
+    assert sorted(vistos) == [('alterado', 'pwa-0'), ('alterado', 'pwa-2'), ('alterado', 'pwa-3'),
+                              ('alterado', 'pwa-4'), ('removido', 'pwa-1')]
+    assert vistos[-1] == ('alterado', 'pwa-0')
+
+
+def test_registros_invalidos_viram_erros(client):
+    resultado = _enviar(client, [{'numeroProcesso': '0001'}, {'id': 'pwa-1', 'nomeAutor': 'Sem processo'}])
+    assert resultado['applied'] == [] and [e['id'] for e in resultado['errors']] == [None, 'pwa-1']
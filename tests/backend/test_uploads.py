@@ -0,0 +1,186 @@
+"""
+Resumable chunked uploads into content-addressed blobs: offsets, resume,
+deduplication by sha256 and reference counts.
+"""
+import hashlib
+import io
+import os
+import time
+
+import pytest
+
+import app as backend
+from conftest import criar_app
+
+CONTEUDO = b'exame de imagem ' * 10  # 160 bytes
+CHUNK = 64
+
+
+@pytest.fixture
+def app(tmp_path):
+    return criar_app(tmp_path, UPLOAD_CHUNK_SIZE=CHUNK)
+
+
+@pytest.fixture
+def pericia(client):
+    client.post('/nova', data={'numero_processo': '0001', 'nome_autor': 'Autor'})
+    return 1
+
+
+def _iniciar(client, pericia, nome='exame.pdf', size=len(CONTEUDO)):
+    response = client.post(f'/api/pericia/{pericia}/uploads', json={'filename': nome, 'size': size})
+    assert response.status_code == 201
+    return response.get_json()
+
+
+def _enviar(client, sessao, offset, dados):
+    return client.put(sessao['upload_url'], data=dados, headers={'Upload-Offset': str(offset)})
+
+
+def _enviar_tudo(client, sessao, conteudo=CONTEUDO):
+    for offset in range(0, len(conteudo), CHUNK):
+        assert _enviar(client, sessao, offset, conteudo[offset:offset + CHUNK]).status_code == 200
+    return client.post(sessao['complete_url']).get_json()
+
+
+def _blob(app, sha256):
+    with app.app_context():
+        return backend.Blob.query.filter_by(sha256=sha256).first()
+
+
+def test_envio_em_partes_e_retomada(app, client, pericia):
+    sessao = _iniciar(client, pericia)
+    assert sessao['chunk_size'] == CHUNK
+    assert sessao['complete_url'] == f"/api/uploads/{sessao['upload_id']}/complete"
+    assert _enviar(client, sessao, 0, CONTEUDO[:CHUNK]).get_json()['offset'] == CHUNK
+
+    # Interrupted: the client asks where to resume
+    status = client.get(sessao['upload_url']).get_json()
+    assert status == {'upload_id': sessao['upload_id'], 'offset': CHUNK, 'size': len(CONTEUDO)}
+
+    # Incomplete uploads are not stored
+    incompleto = client.post(f"/api/uploads/{sessao['upload_id']}/complete")
+    assert incompleto.status_code == 409 and incompleto.get_json()['offset'] == CHUNK
+
+    for offset in range(CHUNK, len(CONTEUDO), CHUNK):
+        _enviar(client, sessao, offset, CONTEUDO[offset:offset + CHUNK])
+    doc = client.post(f"/api/uploads/{sessao['upload_id']}/complete").get_json()
+
+    sha256 = hashlib.sha256(CONTEUDO).hexdigest()
+    assert doc['url'].endswith(f'/uploads/{sha256}.pdf')
+    assert client.get(doc['url']).data == CONTEUDO
+    assert client.get(sessao['upload_url']).status_code == 404  # Session gone
+    assert not [nome for nome in os.listdir(os.path.join(app.config['UPLOAD_FOLDER'], '.partial'))]
+
+
+def test_offset_fora_de_ordem_responde_409(client, pericia):
+    sessao = _iniciar(client, pericia)
+    _enviar(client, sessao, 0, CONTEUDO[:CHUNK])
+
+    repetido = _enviar(client, sessao, 0, CONTEUDO[:CHUNK])  # Retried after a lost reply
+    assert repetido.status_code == 409
+    assert repetido.get_json() == {'error': 'Offset mismatch', 'offset': CHUNK}
+    assert _enviar(client, sessao, 2 * CHUNK, CONTEUDO[2 * CHUNK:]).status_code == 409
+    assert client.get(sessao['upload_url']).get_json()['offset'] == CHUNK
+
+    grande = _enviar(client, sessao, CHUNK, b'x' * (CHUNK + 1))
+    assert grande.status_code == 413 and grande.get_json()['offset'] == CHUNK
+
+
+def test_partes_em_outro_worker_nao_corrompem_o_hash(app, client, pericia):
+    sessao = _iniciar(client, pericia)
+    _enviar(client, sessao, 0, CONTEUDO[:CHUNK])
+
+    # The second chunk reaches a worker without this session's running hash...
+    deste_worker = backend._upload_hashers.pop(sessao['upload_id'])
+    _enviar(client, sessao, CHUNK, CONTEUDO[CHUNK:2 * CHUNK])
+    # ...and the rest comes back to the first one, whose hash missed it
+    backend._upload_hashers[sessao['upload_id']] = deste_worker
+    _enviar(client, sessao, 2 * CHUNK, CONTEUDO[2 * CHUNK:])
+    doc = client.post(f"/api/uploads/{sessao['upload_id']}/complete").get_json()
+
+    sha256 = hashlib.sha256(CONTEUDO).hexdigest()
+    assert doc['url'].endswith(f'/uploads/{sha256}.pdf')
+    assert _blob(app, sha256).size == len(CONTEUDO)
+
+
+def test_mesmo_conteudo_vira_um_blob(app, client, pericia):
+    primeiro = _enviar_tudo(client, _iniciar(client, pericia, 'exame.pdf'))
+    segundo = _enviar_tudo(client, _iniciar(client, pericia, 'copia.PDF'))
+    avulso = client.post(f'/api/pericia/{pericia}/upload',
+                         data={'upload_document': (io.BytesIO(CONTEUDO), 'outro.pdf')}).get_json()
+
+    assert primeiro['id'] != segundo['id'] != avulso['id']
+    assert primeiro['url'] == segundo['url'] == avulso['url']
+    blob = _blob(app, hashlib.sha256(CONTEUDO).hexdigest())
+    assert blob.ref_count == 3
+    assert [nome for nome in os.listdir(app.config['UPLOAD_FOLDER']) if not nome.startswith('.')] == [blob.filename]
+
+
+def test_exclusao_decrementa_referencias_e_remove_orfaos(app, client, pericia):
+    sha256 = hashlib.sha256(CONTEUDO).hexdigest()
+    primeiro = _enviar_tudo(client, _iniciar(client, pericia))
+    segundo = _enviar_tudo(client, _iniciar(client, pericia))
+    caminho = os.path.join(app.config['UPLOAD_FOLDER'], _blob(app, sha256).filename)
+
+    client.get(primeiro['delete_url'])
+    with app.app_context():
+        app.extensions['tarefas'].executar_pendentes()
+    assert _blob(app, sha256).ref_count == 1 and os.path.exists(caminho)  # Still used by the second
+
+    client.get(segundo['delete_url'])
+    with app.app_context():
+        app.extensions['tarefas'].executar_pendentes()
+    assert _blob(app, sha256) is None and not os.path.exists(caminho)
+
+
+def test_cancelar_descarta_a_sessao(app, client, pericia):
+    sessao = _iniciar(client, pericia)
+    _enviar(client, sessao, 0, CONTEUDO[:CHUNK])
+    assert client.delete(sessao['upload_url']).status_code == 200
+    assert client.get(sessao['upload_url']).status_code == 404
+    assert sessao['upload_id'] not in backend._upload_hashers
+    assert client.post('/api/pericia/99/uploads', json={'filename': 'x.pdf'}).status_code == 404
+
+
+def test_envios_simultaneos_do_mesmo_conteudo(app, client, pericia, monkeypatch):
+    substituir = os.replace
+
+    def outro_envio_chega_antes(origem, destino):
+        # The other request stored the same bytes and committed its Blob between our lookup and our insert
+        substituir(origem, destino)
+        with backend.db.engine.begin() as conn:
+            conn.execute(backend.db.insert(backend.Blob).values(
+                sha256=hashlib.sha256(CONTEUDO).hexdigest(), filename=os.path.basename(destino), size=len(CONTEUDO)))
+
+    monkeypatch.setattr(backend.os, 'replace', outro_envio_chega_antes)
+    response = client.post(f'/api/pericia/{pericia}/upload', data={'upload_document': (io.BytesIO(CONTEUDO), 'exame.pdf')})
+    monkeypatch.undo()
+
+    assert response.status_code == 200
+    assert client.get(response.get_json()['url']).data == CONTEUDO
+    assert _blob(app, hashlib.sha256(CONTEUDO).hexdigest()).ref_count == 1
+
+
+def test_sessoes_abandonadas_expiram(app, client, pericia):
+    abandonada, ativa = _iniciar(client, pericia), _iniciar(client, pericia)
+    for sessao in (abandonada, ativa):
+        _enviar(client, sessao, 0, CONTEUDO[:CHUNK])
+    antigo = time.time() - 25 * 3600
+    for nome in (abandonada['upload_id'], abandonada['upload_id'] + '.json'):
+        os.utime(os.path.join(app.config['UPLOAD_FOLDER'], '.partial', nome), (antigo, antigo))
+
+    with app.app_context():
+        # One sweep queued for the two sessions, due once they could have expired
+        [tarefa] = backend.Tarefa.query.filter_by(tipo='expirar_uploads').all()
+        assert tarefa.disponivel_em > backend.datetime.utcnow() + backend.timedelta(hours=23)
+        tarefa.disponivel_em = backend.datetime.utcnow()
+        backend.db.session.commit()
+        assert app.extensions['tarefas'].executar_pendentes() == 1
+
+    assert client.get(abandonada['upload_url']).status_code == 404
+    assert abandonada['upload_id'] not in backend._upload_hashers
+    assert client.get(ativa['upload_url']).get_json()['offset'] == CHUNK
+    with app.app_context():
+        # Sessions remain, so the next sweep is queued
+        assert backend.Tarefa.query.filter_by(tipo='expirar_uploads', status='pendente').count() == 1
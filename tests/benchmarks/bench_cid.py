@@ -0,0 +1,105 @@
+"""
+Latency benchmark for the CID-10 typeahead index behind /api/cid.
+
+Builds the index from the DATASUS tables given with --files or, by default,
+from a synthetic table of --entries codes, then times cid10.Indice.buscar
+for the prefixes a user types key by key (codes, words, typos).
+
+    python tests/benchmarks/bench_cid.py --entries 14000
+    python tests/benchmarks/bench_cid.py --files CID-10-CATEGORIAS.CSV CID-10-SUBCATEGORIAS.CSV
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import statistics
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'backend'))
+
+import cid10
+
+SEMENTE = os.path.join(os.path.dirname(__file__), '..', '..', 'backend', 'data', 'cid10.csv')
+
+CONSULTAS = [
+    'm', 'm5', 'm54', 'm54.', 'm54.5', 'F3', 'S82.1', 'Z02.7',
+    'do', 'dor', 'dor l', 'dor lom', 'dor lombar', 'lombalgia', 'sindrome do tunel',
+    'síndrome', 'transtorno', 'transtorno depressivo', 'fratura perna', 'artrose joelho',
+    'esquisofrenia', 'lonbar', 'depresivo', 'manguito rotadr', 'ansiedade generalizada',
+    'de', 'dor de', 'com',
+]
+
+
+def sintetica(n, rng, palavras=6000):
+    """
+    n codes shaped like the real table: A00..Z99 categories with up to 10
+    subcategories, described by 2-12 words drawn with a Zipf-like skew from a
+    vocabulary of the seed's words plus made-up ones, joined by "de", "do"...
+    """
+    seed = list(cid10.ler_csv(SEMENTE))
+    vocabulario = sorted({p for _, d in seed for p in d.lower().split() if len(p) > 3})
+    silabas = [c + v for c in 'bcdfglmnprstv' for v in 'aeiou']
+    while len(vocabulario) < palavras:
+        vocabulario.append(''.join(rng.choices(silabas, k=rng.randint(2, 5))))
+    pesos = list(itertools.accumulate(1 / (i + 1) for i in range(len(vocabulario))))
+    rng.shuffle(vocabulario)
+    ligacoes = ['de', 'do', 'da', 'dos', 'e', 'com', 'sem', 'em']
+
+    def descricao():
+        palavras = rng.choices(vocabulario, cum_weights=pesos, k=rng.randint(2, 8))
+        for _ in range(rng.randint(0, 4)):
+            palavras.insert(rng.randint(1, len(palavras)), rng.choice(ligacoes))
+        return ' '.join(palavras).capitalize()
+
+    entradas = []
+    for codigo in (f'{letra}{i:02d}' for letra in string.ascii_uppercase for i in range(100)):
+        for sub in [''] + [f'.{s}' for s in range(10)]:
+            entradas.append((codigo + sub, descricao()))
+    rng.shuffle(entradas)
+    return seed + entradas[:max(0, n - len(seed))]
+
+
+def medir(indice, consultas, rounds):
+    tempos = []
+    for _ in range(rounds):
+        for consulta in consultas:
+            start = time.perf_counter()
+            indice.buscar(consulta)
+            tempos.append(time.perf_counter() - start)
+    tempos.sort()
+    return {
+        'queries': len(tempos),
+        'p50_us': round(statistics.median(tempos) * 1e6, 1),
+        'p99_us': round(tempos[int(len(tempos) * 0.99) - 1] * 1e6, 1),
+        'max_us': round(tempos[-1] * 1e6, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--files', nargs='+', help='CID-10 CSV tables (default: synthetic)')
+    parser.add_argument('--entries', type=int, default=14000)
+    parser.add_argument('--rounds', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--max-p99-us', type=float, default=None, help='Exit 1 when p99 is above this')
+    args = parser.parse_args()
+
+    if args.files:
+        entradas = [entrada for caminho in args.files for entrada in cid10.ler_csv(caminho)]
+    else:
+        entradas = sintetica(args.entries, random.Random(args.seed))
+    start = time.perf_counter()
+    indice = cid10.Indice(entradas)
+    resultado = {'entries': len(indice), 'build_ms': round((time.perf_counter() - start) * 1000, 1)}
+    resultado.update(medir(indice, CONSULTAS, args.rounds))
+    print(json.dumps(resultado, indent=2))
+
+    if args.max_p99_us is not None and resultado['p99_us'] > args.max_p99_us:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Bytes and time saved by response compression, per route (see compression.py).
+
+Requests every route once per encoding (identity, gzip and, when the brotli
+package is installed, br) on the synthetic caseload of bench_routes.py, and
+reports for each: the body size, the server time (median of --repeat calls,
+compression included) and the estimated transfer time over a slow link
+(--kbps, --rtt-ms; the defaults are a weak 4G signal). "saved_ms" is what the
+client gains against identity: transfer time saved minus the extra server time.
+
+    python tests/benchmarks/bench_compression.py --scale 10k
+    python tests/benchmarks/bench_compression.py --kbps 400 --rtt-ms 300 --output compressao.json
+"""
+import argparse
+import json
+import random
+import sys
+import time
+
+import bench_routes
+import caseload
+
+import compression
+
+
+def _rotas(client, alvos, rng):
+    """name -> (method, path). Fixed ids, so every encoding gets the same body."""
+    rascunho, concluido = rng.choice(alvos['rascunho']), rng.choice(alvos['concluido'])
+    client.get(f'/pericia/{concluido}/ver')  # Caches the finalized laudo, as in normal use
+    return {
+        'index': '/',
+        'index_search': '/?search=lombalgia',
+        'api_pericias': '/api/pericias?per_page=50',
+        'editar_pericia': f'/pericia/{rascunho}',
+        'ver_laudo_rascunho': f'/pericia/{rascunho}/ver',
+        'ver_laudo_concluido': f'/pericia/{concluido}/ver',
+        'api_macros': '/api/macros/anamnese',
+        'api_agenda': '/api/agenda?start=2022-01-01&end=2022-02-12',
+        'agenda_ics': '/agenda.ics',
+        'export': '/api/pericias/export',
+    }
+
+
+def _medir(client, caminho, codificacao, repeticoes):
+    headers = {'Accept-Encoding': codificacao}
+    tempos = []
+    for _ in range(repeticoes + 1):  # The first call warms the caches (variants, precompressed files)
+        inicio = time.perf_counter()
+        response = client.get(caminho, headers=headers)
+        tamanho = len(response.get_data())  # Drains streamed bodies, so their compression is timed too
+        tempos.append((time.perf_counter() - inicio) * 1000)
+        if response.status_code != 200:
+            raise SystemExit(f'{caminho}: HTTP {response.status_code}')
+    tempos = sorted(tempos[1:])
+    return {'bytes': tamanho, 'encoding': response.headers.get('Content-Encoding', 'identity'),
+            'server_ms': round(tempos[len(tempos) // 2], 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scale', choices=sorted(caseload.SCALES), default='1k')
+    parser.add_argument('--cases', type=int, help='overrides --scale')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--kbps', type=float, default=1000, help='link throughput in kilobits per second')
+    parser.add_argument('--rtt-ms', type=float, default=150, help='round trip time of the link')
+    parser.add_argument('--routes', nargs='+', help='only these routes (default: all)')
+    parser.add_argument('--workdir', default=bench_routes.tempfile.gettempdir(), help='where seeded databases are kept')
+    parser.add_argument('--rebuild', action='store_true', help='reseed even if a database exists')
+    parser.add_argument('--output', help='write the JSON here instead of stdout')
+    args = parser.parse_args()
+    args.cases = args.cases or caseload.SCALES[args.scale]
+
+    app = bench_routes._app(args)
+    rng = random.Random(args.seed)
+    client = app.test_client()
+    rotas = _rotas(client, bench_routes._alvos(app, rng), rng)
+    if args.routes:
+        rotas = {nome: rotas[nome] for nome in args.routes}
+
+    def transferencia(nbytes):
+        # Request and response: one round trip, the slow start of a fresh connection ignored
+        return args.rtt_ms + nbytes * 8 / args.kbps
+
+    resultados = {}
+    for nome, caminho in rotas.items():
+        medidas = {cod: _medir(client, caminho, cod, args.repeat) for cod in ('identity', *compression.codificacoes())}
+        base = medidas['identity']
+        for medida in medidas.values():
+            medida['transfer_ms'] = round(transferencia(medida['bytes']), 1)
+            medida['ratio'] = round(medida['bytes'] / base['bytes'], 3) if base['bytes'] else 1.0
+            medida['saved_bytes'] = base['bytes'] - medida['bytes']
+            medida['saved_ms'] = round(base['transfer_ms'] + base['server_ms']
+                                       - medida['transfer_ms'] - medida['server_ms'], 1)
+        resultados[nome] = medidas
+        melhor = min(medidas.values(), key=lambda m: m['bytes'])
+        print(f"{nome}: {base['bytes']} -> {melhor['bytes']} bytes ({melhor['encoding']}), "
+              f"{melhor['saved_ms']} ms saved", file=sys.stderr)
+
+    relatorio = {
+        'meta': {'cases': args.cases, 'seed': args.seed, 'repeat': args.repeat, 'kbps': args.kbps,
+                 'rtt_ms': args.rtt_ms, 'brotli': compression.brotli is not None, 'commit': bench_routes._commit()},
+        'results': resultados,
+    }
+    saida = json.dumps(relatorio, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(saida + '\n')
+    else:
+        print(saida)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Throughput benchmark for /uploads/<filename> under concurrent downloads.
+
+Serves a temporary upload folder through a threaded werkzeug server and
+measures full downloads, conditional revalidations (304) and Range requests.
+
+    python tests/benchmarks/bench_downloads.py --files 20 --size-kb 2048 --requests 200
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'backend'))
+
+from werkzeug.serving import make_server
+
+
+def run(url, total, concurrency, headers):
+    def fetch(i):
+        req = urllib.request.Request(url(i), headers=headers(i))
+        try:
+            with urllib.request.urlopen(req) as resp:
+                return len(resp.read())
+        except urllib.error.HTTPError as e:
+            if e.code != 304:
+                raise
+            return 0
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        nbytes = sum(pool.map(fetch, range(total)))
+    elapsed = time.perf_counter() - start
+    return {
+        'concurrency': concurrency,
+        'requests': total,
+        'seconds': round(elapsed, 3),
+        'req_per_s': round(total / elapsed, 1),
+        'mb_per_s': round(nbytes / elapsed / 1024 / 1024, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--files', type=int, default=10)
+    parser.add_argument('--size-kb', type=int, default=1024)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    args = parser.parse_args()
+
+    from app import create_app
+
+    tmp = tempfile.mkdtemp(prefix='bench_downloads_')
+    upload_dir = os.path.join(tmp, 'uploads')
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(tmp, 'bench.db'),
+        'UPLOAD_FOLDER': upload_dir,
+        'LAUDO_CACHE_FOLDER': os.path.join(tmp, 'laudos'),
+        'COMPRESS_FOLDER': os.path.join(tmp, 'compressed'),
+        'BACKUP_FOLDER': os.path.join(tmp, 'backups'),
+    })
+    names = []
+    for i in range(args.files):
+        name = f'bench_{i}.pdf'
+        with open(os.path.join(upload_dir, name), 'wb') as f:
+            f.write(os.urandom(args.size_kb * 1024))
+        names.append(name)
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}/uploads/'
+
+    def url(i):
+        return base + names[i % len(names)]
+
+    # Warm up the ETag cache and collect the validators
+    etags = {}
+    for name in names:
+        with urllib.request.urlopen(base + name) as resp:
+            etags[name] = resp.headers['ETag']
+
+    scenarios = {
+        'full': lambda i: {},
+        'if_none_match': lambda i: {'If-None-Match': etags[names[i % len(names)]]},
+        'range_64kb': lambda i: {'Range': 'bytes=0-65535'},
+    }
+
+    results = {}
+    for scenario, headers in scenarios.items():
+        results[scenario] = [run(url, args.requests, c, headers) for c in args.concurrency]
+
+    server.shutdown()
+    print(json.dumps({'files': args.files, 'size_kb': args.size_kb, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
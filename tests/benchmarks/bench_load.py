@@ -0,0 +1,166 @@
+"""
+Mixed read/write load test for the Flask backend, with and without the SQLite tuning.
+
+Starts several server processes (like a multi-worker WSGI server) on a shared
+temporary database, then spreads dashboard reads, API listings and new
+pericias across them. Each profile runs on a fresh database:
+
+  - default: SQLite's default rollback journal (SQLITE_PRAGMAS = {})
+  - tuned:   WAL, synchronous=NORMAL, busy_timeout, mmap (the app default)
+
+    python tests/benchmarks/bench_load.py --workers 4 --requests 2000 --write-ratio 0.1
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND = os.path.join(os.path.dirname(__file__), '..', '..', 'backend')
+sys.path.insert(0, BACKEND)
+
+PROFILES = {
+    'default': {'SQLITE_PRAGMAS': {}},
+    'tuned': {},
+}
+
+
+def serve(config, port, ready):
+    import logging
+    from werkzeug.serving import make_server
+    from app import create_app
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    server = make_server('127.0.0.1', port, create_app(config), threaded=True)
+    ready.set()
+    server.serve_forever()
+
+
+def free_port():
+    import socket
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def seed(base, count):
+    for i in range(count):
+        post(base, i)
+
+
+def post(base, i):
+    data = urllib.parse.urlencode({
+        'numero_processo': f'BENCH-{i}', 'nome_autor': f'Autor {i}', 'valor_honorarios': '350.00'
+    }).encode()
+    # /nova answers with a redirect to the form; don't follow it
+    opener = urllib.request.build_opener(NoRedirect)
+    try:
+        opener.open(base + '/nova', data=data)
+    except urllib.error.HTTPError as e:
+        if e.code != 302:
+            raise
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def run_profile(name, config, args):
+    tmp = tempfile.mkdtemp(prefix=f'bench_load_{name}_')
+    config = dict(config,
+                  SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.join(tmp, 'bench.db'),
+                  UPLOAD_FOLDER=os.path.join(tmp, 'uploads'),
+                  LAUDO_CACHE_FOLDER=os.path.join(tmp, 'laudos'),
+                  COMPRESS_FOLDER=os.path.join(tmp, 'compressed'),
+                  BACKUP_FOLDER=os.path.join(tmp, 'backups'))
+
+    # Create the schema once, as `gunicorn --preload` would
+    from app import create_app
+    create_app(config)
+
+    ctx = multiprocessing.get_context('spawn')
+    servers, bases = [], []
+    for _ in range(args.workers):
+        port, ready = free_port(), ctx.Event()
+        proc = ctx.Process(target=serve, args=(config, port, ready), daemon=True)
+        proc.start()
+        ready.wait(30)
+        servers.append(proc)
+        bases.append(f'http://127.0.0.1:{port}')
+
+    seed(bases[0], args.seed)
+
+    rng = random.Random(42)
+    plan = []
+    for i in range(args.requests):
+        r = rng.random()
+        kind = 'write' if r < args.write_ratio else ('api' if r < args.write_ratio + 0.2 else 'dashboard')
+        plan.append((kind, bases[i % len(bases)], args.seed + i))
+
+    latencies = {'dashboard': [], 'api': [], 'write': []}
+    errors = []
+
+    def request(item):
+        kind, base, i = item
+        start = time.perf_counter()
+        try:
+            if kind == 'write':
+                post(base, i)
+            else:
+                path = '/' if kind == 'dashboard' else '/api/pericias?per_page=50'
+                with urllib.request.urlopen(base + path) as resp:
+                    resp.read()
+        except Exception as e:  # "database is locked" surfaces as a 500 here
+            errors.append(f'{kind}: {e}')
+            return
+        latencies[kind].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(request, plan))
+    elapsed = time.perf_counter() - start
+
+    for proc in servers:
+        proc.terminate()
+        proc.join()
+
+    def p95(values):
+        values = sorted(values)
+        return round(values[int(len(values) * 0.95) - 1] * 1000, 1) if values else None
+
+    return {
+        'requests': args.requests,
+        'errors': len(errors),
+        'seconds': round(elapsed, 3),
+        'req_per_s': round(args.requests / elapsed, 1),
+        'p95_ms': {kind: p95(values) for kind, values in latencies.items()},
+        'sample_errors': errors[:3],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=500, help='pericias created before measuring')
+    parser.add_argument('--write-ratio', type=float, default=0.1)
+    parser.add_argument('--profile', choices=sorted(PROFILES), nargs='+', default=['default', 'tuned'])
+    args = parser.parse_args()
+
+    results = {name: run_profile(name, PROFILES[name], args) for name in args.profile}
+    print(json.dumps({'workers': args.workers, 'concurrency': args.concurrency,
+                      'write_ratio': args.write_ratio, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+"""
+Route latency benchmark on a synthetic caseload (see caseload.py).
+
+Times the key routes through the Flask test client, so the numbers are the
+app's own cost (no network, no WSGI server): dashboard with and without
+search and status filters, the edit form, the laudo view (draft and cached),
+uploads, the macro API and the agenda. The seeded database is kept in the temp dir and
+reused by later runs with the same --cases and --seed.
+
+Results are printed (or written with --output) as JSON. With --baseline, a
+route whose median got slower than the baseline's by more than --threshold
+is reported as a regression and the run exits with status 1.
+
+    python tests/benchmarks/bench_routes.py --scale 100k --output atual.json
+    python tests/benchmarks/bench_routes.py --scale 100k --baseline atual.json --threshold 0.2
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'backend'))
+
+import caseload  # noqa: E402
+
+
+def _app(args):
+    import app as backend
+
+    base = os.path.join(args.workdir, f'pericias_bench_{args.cases}_{args.seed}')
+    os.makedirs(base, exist_ok=True)
+    caminho = os.path.join(base, 'bench.db')
+    novo = args.rebuild or not _semeado(caminho, args.cases)
+    if novo:
+        for sufixo in ('', '-wal', '-shm'):
+            if os.path.exists(caminho + sufixo):
+                os.remove(caminho + sufixo)
+
+    app = backend.create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + caminho,
+        'UPLOAD_FOLDER': os.path.join(base, 'uploads'),
+        'LAUDO_CACHE_FOLDER': tempfile.mkdtemp(prefix='laudos_'),  # Every run starts with a cold laudo cache
+        'COMPRESS_FOLDER': tempfile.mkdtemp(prefix='compressed_'),
+        'BACKUP_FOLDER': os.path.join(base, 'backups'),
+        'METRICS_ENABLED': False,
+    })
+    if novo:
+        print(f'Seeding {args.cases} cases into {caminho}', file=sys.stderr)
+        with app.app_context():
+            caseload.gerar(args.cases, seed=args.seed, log=lambda m: print(m, file=sys.stderr))
+            # Written last: an interrupted seed is redone by the next run
+            backend.db.session.add(backend.Contador(nome='bench_caseload', valor=args.cases))
+            backend.db.session.commit()
+    return app
+
+
+def _semeado(caminho, casos):
+    if not os.path.exists(caminho):
+        return False
+    try:
+        with sqlite3.connect(caminho) as conn:
+            return conn.execute("SELECT valor FROM contador WHERE nome = 'bench_caseload'").fetchone() == (casos,)
+    except sqlite3.Error:
+        return False
+
+
+def _alvos(app, rng):
+    """Ids the routes are called with: a spread of cases per status, so one hot row does not skew the timings."""
+    import app as backend
+
+    with app.app_context():
+        def amostra(status, n=50):
+            query = backend.Pericia.query.with_entities(backend.Pericia.id).filter_by(status=status)
+            ids = [row.id for row in query.order_by(backend.Pericia.created_at.desc()).limit(n * 20)]
+            return rng.sample(ids, min(n, len(ids)))
+        return {'rascunho': amostra('Em Andamento'), 'concluido': amostra('Concluido'),
+                'qualquer': amostra('Agendado') + amostra('Concluido')}
+
+
+def _rotas(client, alvos, rng):
+    """name -> callable making one request. Every callable returns the response."""
+    def ciclo(ids):
+        return lambda: ids[rng.randrange(len(ids))]
+
+    qualquer, rascunho, concluido = ciclo(alvos['qualquer']), ciclo(alvos['rascunho']), ciclo(alvos['concluido'])
+    etag = client.get('/api/macros/anamnese').headers['ETag']
+    etag_agenda = client.get('/agenda.ics').headers['ETag']
+
+    def agenda():
+        # A month view: six weeks somewhere in the caseload's five years
+        inicio = datetime(2020, 2, 1) + timedelta(days=rng.randrange(5 * 365))
+        return client.get(f'/api/agenda?start={inicio.isoformat()}&end={(inicio + timedelta(days=42)).isoformat()}')
+
+    def upload():
+        # Unique bytes every time, so each call stores a new blob
+        dados = {'upload_document': (io.BytesIO(os.urandom(64 * 1024)), 'exame.pdf')}
+        return client.post(f'/api/pericia/{qualquer()}/upload', data=dados, content_type='multipart/form-data')
+
+    return {
+        'index': lambda: client.get('/'),
+        'index_status': lambda: client.get('/?status=Concluido'),
+        'index_search': lambda: client.get('/?search=lombalgia'),
+        'index_search_nome': lambda: client.get(f'/?search={rng.choice(caseload.SOBRENOMES)}'),
+        'index_search_status': lambda: client.get('/?search=radiculopatia&status=Em+Andamento'),
+        'api_pericias': lambda: client.get('/api/pericias?per_page=50'),
+        'editar_pericia': lambda: client.get(f'/pericia/{qualquer()}'),
+        'ver_laudo_rascunho': lambda: client.get(f'/pericia/{rascunho()}/ver'),
+        'ver_laudo_concluido': lambda: client.get(f'/pericia/{concluido()}/ver'),
+        'upload_documento': upload,
+        'api_macros': lambda: client.get(f'/api/macros/{rng.choice(caseload.CATEGORIAS)}'),
+        'api_macros_304': lambda: client.get('/api/macros/anamnese', headers={'If-None-Match': etag}),
+        'api_agenda': agenda,
+        'agenda_ics_304': lambda: client.get('/agenda.ics', headers={'If-None-Match': etag_agenda}),
+    }
+
+
+def _medir(chamada, repeticoes, aquecimento):
+    for _ in range(aquecimento):
+        chamada()
+    tempos, erros = [], 0
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        response = chamada()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+        if response.status_code >= 400:
+            erros += 1
+    tempos.sort()
+
+    def percentil(p):
+        return round(tempos[min(len(tempos) - 1, int(len(tempos) * p))], 3)
+
+    return {'n': repeticoes, 'errors': erros, 'min_ms': round(tempos[0], 3), 'p50_ms': percentil(0.5),
+            'p95_ms': percentil(0.95), 'mean_ms': round(sum(tempos) / len(tempos), 3)}
+
+
+def comparar(resultados, baseline, limite, delta_minimo):
+    """Routes whose median regressed by more than limite (a fraction) and by at least delta_minimo ms."""
+    regressoes = {}
+    for nome, atual in resultados.items():
+        anterior = baseline.get('results', {}).get(nome)
+        if not anterior:
+            continue
+        delta = atual['p50_ms'] - anterior['p50_ms']
+        if delta > anterior['p50_ms'] * limite and delta >= delta_minimo:
+            regressoes[nome] = {'baseline_p50_ms': anterior['p50_ms'], 'p50_ms': atual['p50_ms'],
+                                'change': round(delta / anterior['p50_ms'], 3)}
+    return regressoes
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scale', choices=sorted(caseload.SCALES), default='1k')
+    parser.add_argument('--cases', type=int, help='overrides --scale')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--routes', nargs='+', help='only these routes (default: all)')
+    parser.add_argument('--workdir', default=tempfile.gettempdir(), help='where seeded databases are kept')
+    parser.add_argument('--rebuild', action='store_true', help='reseed even if a database exists')
+    parser.add_argument('--output', help='write the JSON here instead of stdout')
+    parser.add_argument('--baseline', help='JSON of a previous run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed median slowdown (0.2 = 20%%)')
+    parser.add_argument('--min-delta-ms', type=float, default=0.5, help='ignore slowdowns smaller than this')
+    args = parser.parse_args()
+    args.cases = args.cases or caseload.SCALES[args.scale]
+
+    app = _app(args)
+    rng = random.Random(args.seed)
+    client = app.test_client()
+    rotas = _rotas(client, _alvos(app, rng), rng)
+    if args.routes:
+        rotas = {nome: rotas[nome] for nome in args.routes}
+
+    resultados = {}
+    for nome, chamada in rotas.items():
+        resultados[nome] = _medir(chamada, args.repeat, args.warmup)
+        print(f'{nome}: p50 {resultados[nome]["p50_ms"]} ms', file=sys.stderr)
+
+    relatorio = {
+        'meta': {
+            'cases': args.cases, 'seed': args.seed, 'repeat': args.repeat, 'commit': _commit(),
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version, 'machine': platform.machine(),
+        },
+        'results': resultados,
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['meta'].get('cases') != args.cases:
+            print(f"warning: baseline ran on {baseline['meta'].get('cases')} cases", file=sys.stderr)
+        relatorio['threshold'] = args.threshold
+        relatorio['regressions'] = comparar(resultados, baseline, args.threshold, args.min_delta_ms)
+
+    saida = json.dumps(relatorio, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(saida + '\n')
+    else:
+        print(saida)
+
+    if relatorio.get('regressions'):
+        print(f"{len(relatorio['regressions'])} route(s) regressed: {', '.join(relatorio['regressions'])}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""
+Synthetic caseload for the benchmarks: pericias with laudo sections of
+realistic size (in laudo_secao, compressed like the app stores them), their
+documentos (one blob each) and a macro library.
+
+Rows go in through bulk inserts in batches, without the per-row ORM events,
+so even a million cases seeds in minutes; the change-feed counter, the
+search index and the financial rollups are brought up to date at the end.
+The same seed always produces the same database.
+
+    python tests/benchmarks/caseload.py --cases 100000 --db /tmp/pericias_100k.db
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'backend'))
+
+SCALES = {'1k': 1_000, '100k': 100_000, '1m': 1_000_000}
+
+STATUS = (('Aguardando', 15), ('Agendado', 20), ('Em Andamento', 25), ('Concluido', 40))
+TIPOS_ACAO = ('Auxílio-Doença', 'Aposentadoria por Invalidez', 'BPC/LOAS', 'Acidente de Trabalho', 'Indenizatória')
+PROFISSOES = ('Pedreiro', 'Auxiliar de limpeza', 'Motorista', 'Costureira', 'Operador de máquinas', 'Professora')
+CIDADES = (('São Paulo', 'SP'), ('Campinas', 'SP'), ('Belo Horizonte', 'MG'), ('Curitiba', 'PR'), ('Recife', 'PE'))
+SOBRENOMES = ('Silva', 'Souza', 'Oliveira', 'Costa', 'Pereira', 'Almeida', 'Ferreira', 'Rodrigues', 'Lima', 'Gomes')
+NOMES = ('Maria', 'José', 'Ana', 'João', 'Antônio', 'Francisca', 'Carlos', 'Paulo', 'Adriana', 'Luiz')
+CATEGORIAS = ('anamnese', 'exame_fisico', 'conclusao')
+
+FRASES = (
+    'Refere dor lombar de caráter mecânico, com irradiação para o membro inferior esquerdo.',
+    'Relata piora progressiva nos últimos dois anos, sem melhora com fisioterapia.',
+    'Nega trauma prévio. Faz uso contínuo de anti-inflamatórios e analgésicos.',
+    'Apresenta marcha claudicante, com apoio preferencial no membro contralateral.',
+    'Teste de Lasègue positivo a 40 graus à esquerda; força muscular grau IV.',
+    'Amplitude de movimento da coluna lombar reduzida em flexão e extensão.',
+    'Exames de imagem evidenciam protrusão discal em L4-L5 e L5-S1.',
+    'Ombro direito com limitação da abdução e sinal de Neer positivo.',
+    'Eletroneuromiografia compatível com radiculopatia crônica.',
+    'Há nexo causal entre a patologia apresentada e as atividades laborais descritas.',
+    'A incapacidade é parcial e permanente para a função habitual.',
+    'O quadro é passível de reabilitação profissional para atividades sem sobrecarga.',
+    'Não foram constatados sinais de simulação ou de amplificação de sintomas.',
+    'A data de início da incapacidade é fixada na data do exame de imagem apresentado.',
+)
+
+# Approximate sizes (bytes) of the laudo sections of a finished case
+TAMANHOS = {
+    'objetivo': 300, 'metodologia': 600, 'anamnese': 2500, 'antecedentes': 800, 'exame_fisico': 2000,
+    'discussao': 4000, 'conclusao': 800, 'quesitos': 2500, 'bibliografia': 400,
+}
+
+
+def _texto(rng, tamanho):
+    paragrafos, total = [], 0
+    while total < tamanho:
+        paragrafo = ' '.join(rng.choice(FRASES) for _ in range(rng.randint(2, 5)))
+        paragrafos.append(f'<p>{paragrafo}</p>')
+        total += len(paragrafo) + 7
+    return ''.join(paragrafos)
+
+
+def _pool(rng, tamanho, quantidade=64):
+    # Picking from a pool keeps generation fast while still varying the text between cases
+    return [_texto(rng, int(tamanho * rng.uniform(0.5, 1.5))) for _ in range(quantidade)]
+
+
+def _pericia(rng, i, pools, inicio):
+    status = rng.choices([s for s, _ in STATUS], weights=[p for _, p in STATUS])[0]
+    criada = inicio + timedelta(minutes=rng.randint(0, 5 * 365 * 24 * 60))
+    cidade, uf = rng.choice(CIDADES)
+    registro = {
+        'id': i,
+        'numero_processo': f'{rng.randint(0, 9999999):07d}-{rng.randint(10, 99)}.{criada.year}.8.26.{rng.randint(1, 999):04d}',
+        'nome_autor': f'{rng.choice(NOMES)} {rng.choice(SOBRENOMES)} {rng.choice(SOBRENOMES)}',
+        'status': status,
+        'status_pagamento': 'Pago' if status == 'Concluido' and rng.random() < 0.7 else 'Pendente',
+        'valor_honorarios': rng.choice((350.0, 500.0, 800.0, 1200.0)),
+        'tipo_acao': rng.choice(TIPOS_ACAO),
+        'profissao': rng.choice(PROFISSOES),
+        'endereco_cidade': cidade,
+        'endereco_uf': uf,
+        'data_nascimento': datetime(1950, 1, 1) + timedelta(days=rng.randint(0, 50 * 365)),
+        'data_pericia': criada + timedelta(days=rng.randint(15, 120)),
+        'created_at': criada,
+        'atualizado_em': criada,
+        'uid': f'{i:032x}',
+        'sync_seq': i,
+        'versao': 1,
+    }
+    # Cases waiting for the exam have no laudo yet; drafts have part of it
+    secoes = {'Aguardando': 0, 'Agendado': 1, 'Em Andamento': 5}.get(status, len(TAMANHOS))
+    for secao in list(TAMANHOS)[:secoes]:
+        registro[secao] = rng.choice(pools[secao])
+    return registro
+
+
+def gerar(casos, seed=1, lote=5000, documentos_por_caso=2.0, macros=300, log=print):
+    """Seeds the current app's (empty) database. Must run inside an app context."""
+    import app as backend
+
+    db = backend.db
+    rng = random.Random(seed)
+    pools = {secao: _pool(rng, tamanho) for secao, tamanho in TAMANHOS.items()}
+    inicio = datetime(2020, 1, 1)
+    comeco = time.perf_counter()
+
+    blob_id = 0
+    for primeiro in range(1, casos + 1, lote):
+        ultimo = min(primeiro + lote - 1, casos)
+        registros = [_pericia(rng, i, pools, inicio) for i in range(primeiro, ultimo + 1)]
+        db.session.execute(db.insert(backend.Pericia), [
+            {campo: valor for campo, valor in r.items() if campo not in backend.SECOES_LAUDO} for r in registros
+        ])
+        db.session.execute(db.insert(backend.LaudoSecao), [linha for r in registros for linha in backend._linhas_secoes(r['id'], r)])
+
+        blobs, documentos = [], []
+        for pericia_id in range(primeiro, ultimo + 1):
+            for _ in range(min(int(rng.expovariate(1 / documentos_por_caso)), 30)):
+                blob_id += 1
+                sha256 = f'{blob_id:064x}'
+                blobs.append({'id': blob_id, 'sha256': sha256, 'filename': f'{sha256}.pdf',
+                              'size': rng.randint(50_000, 5_000_000), 'ref_count': 1})
+                documentos.append({'filename': f'{sha256}.pdf', 'original_name': f'exame_{blob_id}.pdf',
+                                   'pericia_id': pericia_id, 'blob_id': blob_id})
+        if blobs:
+            db.session.execute(db.insert(backend.Blob), blobs)
+            db.session.execute(db.insert(backend.Documento), documentos)
+        db.session.commit()
+        log(f'  {ultimo}/{casos} perícias ({time.perf_counter() - comeco:.0f} s)')
+
+    db.session.execute(db.insert(backend.Macro), [{
+        'titulo': f'Modelo {i}', 'categoria': CATEGORIAS[i % len(CATEGORIAS)],
+        'conteudo': _texto(rng, rng.randint(200, 1500)),
+    } for i in range(macros)])
+    db.session.add(backend.Contador(nome='sync', valor=casos))
+    db.session.add(backend.Contador(nome='resumo', valor=1))
+    db.session.add(backend.Contador(nome='macros', valor=1))
+    db.session.commit()
+
+    log('  índice de busca e resumo financeiro...')
+    with db.engine.begin() as conn:
+        backend._reindexar_busca(conn)
+        backend._recalcular_resumo_mensal(conn)
+    log(f'  pronto em {time.perf_counter() - comeco:.0f} s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--cases', type=int, default=SCALES['1k'])
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--batch', type=int, default=5000)
+    parser.add_argument('--db', required=True, help='SQLite file to create (must not exist)')
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        parser.error(f'{args.db} already exists')
+
+    from app import create_app
+    base = os.path.dirname(os.path.abspath(args.db))
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.abspath(args.db),
+        'UPLOAD_FOLDER': os.path.join(base, 'uploads'),
+        'LAUDO_CACHE_FOLDER': os.path.join(base, 'laudos'),
+        'COMPRESS_FOLDER': os.path.join(base, 'compressed'),
+        'BACKUP_FOLDER': os.path.join(base, 'backups'),
+        'METRICS_ENABLED': False,
+    })
+    with app.app_context():
+        gerar(args.cases, seed=args.seed, lote=args.batch, log=lambda m: print(m, file=sys.stderr))
+
+
+if __name__ == '__main__':
+    main()
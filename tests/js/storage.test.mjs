@@ -159,6 +159,21 @@ async function runTests() {
     const deletedP1 = Storage.getPericia(savedP1.id);
     assert(deletedP1 === undefined, 'deletePericia removes data');
 
+    // Test Sync Tracking
+    console.log('Testing Sync Tracking...');
+    const syncState = Storage.getSyncState();
+    assert(syncState.deleted[savedP1.id], 'deletePericia marks the delete for sync');
+    assert(!syncState.pending[savedP1.id], 'deletePericia drops the pending change');
+
+    const p2 = Storage.savePericia({ nomeAutor: 'Sync Local', numeroProcesso: '456' });
+    assert(Storage.getSyncState().pending[p2.id], 'savePericia marks the record as pending');
+
+    Storage.applyRemote([{ id: 'srv-1', nome_autor: 'Do Servidor', numero_processo: '789' }], [p2.id]);
+    assertEqual(Storage.getPericia('srv-1').nomeAutor, 'Do Servidor', 'applyRemote stores server records');
+    assert(Storage.getPericia(p2.id) === undefined, 'applyRemote removes deleted records');
+    assert(!Storage.getSyncState().pending['srv-1'], 'applyRemote does not mark records as pending');
+    Storage.deletePericia('srv-1');
+
     // Test FileDB
     console.log('Testing FileDB...');
     const fileId = 101;